@@ -52,6 +52,8 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    'DEFAULT_PAGINATION_CLASS': 'crm_app.pagination.StandardPagination',
+    'PAGE_SIZE': 50,
 }
 
 MIDDLEWARE = [
@@ -189,6 +191,42 @@ MEDIA_ROOT = BASE_DIR / "media"
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 
+# Buffered UserActivityLog writer (crm_app/activity.py)
+ACTIVITY_LOG_ASYNC = True
+ACTIVITY_LOG_QUEUE_SIZE = 10000
+ACTIVITY_LOG_BATCH_SIZE = 200
+ACTIVITY_LOG_FLUSH_INTERVAL = 2.0
+# Monthly activity log partitions kept in the database (see archive_activity_logs)
+ACTIVITY_LOG_RETENTION_MONTHS = 12
+
+# Admin CSV imports (crm_app/jobs.py): 'thread' runs them on a pool inside the
+# web process, 'worker' leaves them to `manage.py run_import_worker`, 'inline'
+# imports during the upload request
+IMPORT_JOBS_RUNNER = 'thread'
+IMPORT_WORKER_THREADS = 2
+# A job with no progress for this long is marked failed (its runner was
+# restarted or killed); see jobs.recover_stale_jobs
+IMPORT_JOB_STALE_SECONDS = 600
+
+# Per-process typeahead indexes (crm_app/autocomplete.py): rows changed by
+# other processes show up after a delta load; a full rebuild prunes deletes
+AUTOCOMPLETE_REFRESH_SECONDS = 30
+AUTOCOMPLETE_REBUILD_SECONDS = 60 * 60
+
+# Lead ingestion (crm_app/dedup.py): 'upsert' merges a lead whose email or
+# phone is already known into the existing lead, 'insert' always adds a row.
+# Phone numbers without a country code are read as LEAD_DEFAULT_CALLING_CODE.
+LEAD_INGEST_MODE = 'upsert'
+LEAD_DEFAULT_CALLING_CODE = '91'
+
+# Most rows one PATCH /api/<entity>/bulk/ may change (crm_app/bulk_edit.py)
+BULK_EDIT_MAX_ROWS = 5000
+
+# export_columnar --incremental only exports rows last updated this long ago,
+# so a transaction still open when the snapshot starts can't be skipped. Keep
+# it above the longest write transaction.
+COLUMNAR_EXPORT_LAG_SECONDS = 300
+
 import os
 
 LOGGING = {
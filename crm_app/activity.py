@@ -0,0 +1,155 @@
+"""
+Buffered writer for UserActivityLog.
+
+log_user_activity() used to INSERT one row inside the request. Rows now go
+into a bounded in-process queue that a daemon thread drains with
+bulk_create: a batch is written as soon as BATCH_SIZE rows are waiting or
+FLUSH_INTERVAL seconds after the first one arrived, and whatever is left
+is flushed at interpreter shutdown. When the queue is full (the database
+is slow or down) the row is written synchronously instead of dropped.
+
+Settings (all optional):
+    ACTIVITY_LOG_ASYNC           False writes every row synchronously
+    ACTIVITY_LOG_QUEUE_SIZE      rows the queue holds before overflowing
+    ACTIVITY_LOG_BATCH_SIZE      rows per bulk_create
+    ACTIVITY_LOG_FLUSH_INTERVAL  seconds a row may wait before it is written
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .models import UserActivityLog
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityLogBuffer:
+    def __init__(self, queue_size=10000, batch_size=200, flush_interval=2.0):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def start(self):
+        """Start the drain thread once per process (lazily, so it survives forking servers)"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name='activity-log-writer', daemon=True)
+                self._thread.start()
+
+    def add(self, entry):
+        """Queue an unsaved UserActivityLog; write it now if the queue is full"""
+        self.start()
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            logger.warning('Activity log queue is full, writing synchronously')
+            self.write([entry])
+
+    def _take_batch(self, timeout):
+        """Block up to `timeout` for a first row, then collect up to batch_size rows"""
+        try:
+            batch = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stopping.is_set():
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._take_batch(timeout=self.flush_interval)
+            if batch:
+                self.write(batch)
+                # The thread keeps its own connection; let CONN_MAX_AGE recycle it
+                close_old_connections()
+
+    def drain(self):
+        """Remove and return every queued row"""
+        entries = []
+        while True:
+            try:
+                entries.append(self.queue.get_nowait())
+            except queue.Empty:
+                return entries
+
+    def flush(self):
+        """Write everything still queued from the calling thread"""
+        entries = self.drain()
+        for start in range(0, len(entries), self.batch_size):
+            self.write(entries[start:start + self.batch_size])
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 1)
+        self.flush()
+
+    def write(self, entries):
+        # Never let activity logging break the caller
+        try:
+            with transaction.atomic():
+                UserActivityLog.objects.bulk_create(entries, batch_size=self.batch_size)
+            return
+        except Exception:
+            if len(entries) == 1:
+                logger.exception('Error writing an activity log row')
+                return
+            logger.warning('Error writing %d activity log rows, retrying one by one', len(entries), exc_info=True)
+        # One bad row (an oversized detail, a user deleted meanwhile) only loses itself
+        dropped = 0
+        for entry in entries:
+            try:
+                with transaction.atomic():
+                    UserActivityLog.objects.bulk_create([entry])
+            except Exception:
+                dropped += 1
+                logger.exception('Dropped activity log row for user %s: %s', entry.user_id, entry.action_type)
+        if dropped:
+            logger.error('Dropped %d of %d activity log rows', dropped, len(entries))
+
+
+activity_buffer = ActivityLogBuffer(
+    queue_size=getattr(settings, 'ACTIVITY_LOG_QUEUE_SIZE', 10000),
+    batch_size=getattr(settings, 'ACTIVITY_LOG_BATCH_SIZE', 200),
+    flush_interval=getattr(settings, 'ACTIVITY_LOG_FLUSH_INTERVAL', 2.0),
+)
+atexit.register(activity_buffer.stop)
+
+
+def record_activity(entry):
+    """Persist an unsaved UserActivityLog through the buffer (or directly when disabled)"""
+    if getattr(settings, 'ACTIVITY_LOG_ASYNC', True):
+        activity_buffer.add(entry)
+    else:
+        activity_buffer.write([entry])
+
+
+def record_activities(entries):
+    """
+    Persist many unsaved UserActivityLog rows. They are queued like
+    record_activity() when they fit; otherwise (or when disabled) they are
+    written here with one bulk_create per batch rather than row by row.
+    """
+    entries = list(entries)
+    if getattr(settings, 'ACTIVITY_LOG_ASYNC', True) and \
+            activity_buffer.queue.qsize() + len(entries) <= activity_buffer.queue.maxsize:
+        for entry in entries:
+            activity_buffer.add(entry)
+    else:
+        activity_buffer.write(entries)
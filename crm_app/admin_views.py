@@ -4,7 +4,9 @@ from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import User
 from django.contrib import messages
 from django.db.models import Count, Sum, Q as models_Q
+from django.db.models.functions import TruncMonth
 from django.http import JsonResponse, HttpResponse
+from django.urls import reverse
 from django.utils import timezone
 from datetime import datetime, timedelta
 import csv
@@ -14,8 +16,14 @@ import decimal
 
 from .models import (
     Industry, Account, Contact, Lead, Deal, Task, Event, 
-    Note, Document, Transaction, Product, DealProduct, UserProfile, UserActivityLog
+    Note, Document, Transaction, Product, DealProduct, UserProfile, UserActivityLog,
+    DailyLeadStats, DailyDealStats, ImportJob
 )
+from .hierarchy import ManagerHierarchy
+from .timeseries import task_trend, priority_histogram, window_buckets
+from .dashboard import dashboard_metrics, LEAD_SOURCE_CHART
+from .utils import log_user_activity
+from .jobs import create_import_job, recover_stale_jobs
 
 # Constants from models for use in views
 DEAL_STAGE_CHOICES = Deal.DEAL_STAGES
@@ -92,88 +100,13 @@ def admin_logout(request):
 @login_required
 @user_passes_test(is_admin)
 def admin_dashboard(request):
-    # Check if the current user is a manager
-    is_manager = False
-    if hasattr(request.user, 'profile') and request.user.profile and request.user.profile.role:
-        is_manager = request.user.profile.role.lower() == 'manager'
+    # KPIs are scoped to the manager's team for managers (see dashboard.py)
+    metrics = dashboard_metrics(request.user)
+    total_revenue = metrics['total_revenue']
+    revenue_increase = metrics['revenue_increase']
     
-    # Get the manager's username and user ID if applicable
-    manager_username = None
-    manager_id = None
-    managed_user_ids = []
-    
-    if is_manager:
-        manager_username = request.user.username
-        manager_id = request.user.id
-        
-        # Get IDs of users managed by this manager
-        for user in User.objects.all():
-            if hasattr(user, 'profile') and user.profile and user.profile.manager_username == manager_username:
-                managed_user_ids.append(user.id)
-    
-    # Calculate dashboard statistics based on role
-    if is_manager:
-        # For managers, only count users they manage
-        total_users = len(managed_user_ids) + 1  # +1 to include the manager
-        new_users = User.objects.filter(
-            models_Q(id__in=managed_user_ids) | models_Q(id=manager_id),
-            date_joined__gte=timezone.now() - timedelta(days=30)
-        ).count()
-        
-        # Filter leads for this manager
-        leads_filter = models_Q(manager_username=manager_username) | \
-                      models_Q(assigned_to__id__in=managed_user_ids) | \
-                      models_Q(created_by_id=manager_id)
-        
-        total_leads = Lead.objects.filter(leads_filter).distinct().count()
-        new_leads = Lead.objects.filter(
-            leads_filter,
-            created_at__gte=timezone.now() - timedelta(days=30)
-        ).distinct().count()
-        
-        # Filter deals for this manager
-        deals_filter = models_Q(assigned_to__id__in=managed_user_ids) | \
-                      models_Q(created_by_id=manager_id)
-        
-        total_deals = Deal.objects.filter(deals_filter).distinct().count()
-        new_deals = Deal.objects.filter(
-            deals_filter,
-            created_at__gte=timezone.now() - timedelta(days=30)
-        ).distinct().count()
-        
-        total_revenue = Deal.objects.filter(
-            deals_filter,
-            stage='closed_won'
-        ).distinct().aggregate(Sum('amount'))['amount__sum'] or 0
-        
-        last_month_revenue = Deal.objects.filter(
-            deals_filter,
-            stage='closed_won', 
-            created_at__gte=timezone.now() - timedelta(days=60),
-            created_at__lt=timezone.now() - timedelta(days=30)
-        ).distinct().aggregate(Sum('amount'))['amount__sum'] or 0
-    else:
-        # Admin sees all statistics
-        total_users = User.objects.count()
-        new_users = User.objects.filter(date_joined__gte=timezone.now() - timedelta(days=30)).count()
-        
-        total_leads = Lead.objects.count()
-        new_leads = Lead.objects.filter(created_at__gte=timezone.now() - timedelta(days=30)).count()
-        
-        total_deals = Deal.objects.count()
-        new_deals = Deal.objects.filter(created_at__gte=timezone.now() - timedelta(days=30)).count()
-        
-        total_revenue = Deal.objects.filter(stage='closed_won').aggregate(Sum('amount'))['amount__sum'] or 0
-        last_month_revenue = Deal.objects.filter(
-            stage='closed_won', 
-            created_at__gte=timezone.now() - timedelta(days=60),
-            created_at__lt=timezone.now() - timedelta(days=30)
-        ).aggregate(Sum('amount'))['amount__sum'] or 0
-    
-    revenue_increase = total_revenue - last_month_revenue
-    
-    # Get recent activities from the activity log
-    recent_activities_query = UserActivityLog.objects.all().order_by('-timestamp')[:5]
+    # Get recent activities from the activity log (current month's partition first)
+    recent_activities_query = UserActivityLog.objects.select_related('user').recent(5)
     recent_activities = []
     
     for activity in recent_activities_query:
@@ -295,33 +228,11 @@ def admin_dashboard(request):
     
     # Get monthly revenue data for the sales chart
     months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-    current_year = timezone.now().year
-    monthly_revenue_data = [0] * 12
-    monthly_deals_data = [0] * 12
-    
-    # Query deals for the current year
-    deals_this_year = Deal.objects.filter(created_at__year=current_year, stage='closed_won')
-    
-    # Aggregate revenue and deals count by month
-    for deal in deals_this_year:
-        month_idx = deal.created_at.month - 1  # 0-based index for months
-        monthly_revenue_data[month_idx] += deal.amount
-        monthly_deals_data[month_idx] += 1
+    monthly_revenue_data = metrics['monthly_revenue']
+    monthly_deals_data = metrics['monthly_deals']
     
     # Get lead sources data for the pie chart
-    lead_sources = {
-        'website_demo': Lead.objects.filter(models_Q(lead_source='website_demo') | models_Q(lead_source='website')).count(),
-        'website_live': Lead.objects.filter(lead_source='website_live').count(),
-        'phone': Lead.objects.filter(lead_source='phone').count(),
-        'referral': Lead.objects.filter(lead_source='referral').count(),
-        'email': Lead.objects.filter(lead_source='email').count(),
-        'social_media': Lead.objects.filter(lead_source='social_media').count(),
-        'trade_show': Lead.objects.filter(lead_source='trade_show').count(),
-        'email_campaign': Lead.objects.filter(lead_source='email_campaign').count(),
-        'cold_call': Lead.objects.filter(lead_source='cold_call').count(),
-        'event': Lead.objects.filter(lead_source='event').count(),
-        'other': Lead.objects.filter(lead_source='other').count()
-    }
+    lead_sources = metrics['lead_sources']
     
     # Convert data to JSON for charts
     import json
@@ -331,20 +242,8 @@ def admin_dashboard(request):
         'deals': monthly_deals_data
     })
     
-    lead_sources_labels = ['Website - {Demo}', 'Website - {live}', 'Phone', 'Referral', 'Email', 'Social Media', 'Trade Show', 'Email Campaign', 'Cold Call', 'Event', 'Other']
-    lead_sources_data = [
-        lead_sources['website_demo'],
-        lead_sources['website_live'],
-        lead_sources['phone'],
-        lead_sources['referral'],
-        lead_sources['email'],
-        lead_sources['social_media'],
-        lead_sources['trade_show'],
-        lead_sources['email_campaign'],
-        lead_sources['cold_call'],
-        lead_sources['event'],
-        lead_sources['other']
-    ]
+    lead_sources_labels = [label for _key, label in LEAD_SOURCE_CHART]
+    lead_sources_data = [lead_sources[key] for key, _label in LEAD_SOURCE_CHART]
     
     lead_sources_chart_data = json.dumps({
         'labels': lead_sources_labels,
@@ -353,12 +252,12 @@ def admin_dashboard(request):
     
     context = {
         'active_page': 'dashboard',
-        'total_users': total_users,
-        'new_users': new_users,
-        'total_leads': total_leads,
-        'new_leads': new_leads,
-        'total_deals': total_deals,
-        'new_deals': new_deals,
+        'total_users': metrics['total_users'],
+        'new_users': metrics['new_users'],
+        'total_leads': metrics['total_leads'],
+        'new_leads': metrics['new_leads'],
+        'total_deals': metrics['total_deals'],
+        'new_deals': metrics['new_deals'],
         'total_revenue': int(total_revenue),
         'revenue_increase': int(revenue_increase),
         'recent_activities': recent_activities,
@@ -485,16 +384,13 @@ def admin_users(request):
         manager_username = request.user.username
         
         # Filter users by manager_username in their profile
-        users_with_profile = []
-        for user in users_query:
-            if hasattr(user, 'profile') and user.profile and user.profile.manager_username == manager_username:
-                users_with_profile.append(user.id)
+        users_with_profile = ManagerHierarchy.subordinate_ids(request.user)
         
         users_query = users_query.filter(id__in=users_with_profile)
     
     # Get all users with their profiles
     users_data = []
-    for user in users_query.order_by('-date_joined'):
+    for user in users_query.select_related('profile').order_by('-date_joined'):
         # Default values
         role = 'User'
         role_color = 'secondary'
@@ -569,58 +465,15 @@ def admin_users(request):
         inactive_users = User.objects.filter(is_active=False).count()
         new_users = User.objects.filter(date_joined__gte=timezone.now() - timedelta(days=30)).count()
     
-    # Calculate role distribution for chart - use actual roles from database
-    # First, collect all unique roles that exist in the data
-    unique_roles = set()
-    
-    # If logged in as manager, only include users managed by this manager
-    if is_manager:
-        manager_username = request.user.username
-        managed_user_ids = []
-        
-        for user in User.objects.all():
-            if hasattr(user, 'profile') and user.profile and user.profile.manager_username == manager_username:
-                managed_user_ids.append(user.id)
-                if user.profile.role:
-                    unique_roles.add(user.profile.role)
-    else:
-        # Admin sees all roles
-        for user in User.objects.all():
-            if hasattr(user, 'profile') and user.profile and user.profile.role:
-                # Keep the role exactly as it is in the database
-                unique_roles.add(user.profile.role)
-    
-    # Create a counter for each unique role
-    role_counts = {role: 0 for role in unique_roles}
+    # Calculate role distribution for chart - use actual roles from database.
+    # users_data already holds the role of every visible user, so count from it
+    # instead of walking User.objects.all() again.
+    role_counts = {}
+    for user_data in users_data:
+        role_counts[user_data['role']] = role_counts.get(user_data['role'], 0) + 1
     if not role_counts:  # If no roles were found, use default categories
         role_counts = {'User': 0}
     
-    # Count users per role
-    if is_manager:
-        # Only count users managed by this manager
-        for user in users_query:
-            role = 'User'
-            if hasattr(user, 'profile') and user.profile and user.profile.role:
-                role = user.profile.role
-            
-            if role in role_counts:
-                role_counts[role] += 1
-            else:
-                # Add the role if it wasn't in our initial set
-                role_counts[role] = 1
-    else:
-        # Admin counts all users
-        for user in User.objects.all():
-            role = 'User'
-            if hasattr(user, 'profile') and user.profile and user.profile.role:
-                role = user.profile.role
-            
-            if role in role_counts:
-                role_counts[role] += 1
-            else:
-                # Add the role if it wasn't in our initial set
-                role_counts[role] = 1
-    
     # Calculate monthly registration data for the chart
     current_year = timezone.now().year
     monthly_registrations = [0] * 12  # One entry per month
@@ -720,8 +573,8 @@ def admin_user_detail(request, user_id):
     if log_type:
         activity_logs_query = activity_logs_query.filter(action_type=log_type)
     
-    # Order and limit the logs after all filters have been applied
-    activity_logs = activity_logs_query.order_by('-timestamp')[:50]
+    # Newest 50 after all filters, read partition by partition
+    activity_logs = activity_logs_query.recent(50)
     
     context = {
         'active_page': 'users',
@@ -1065,29 +918,30 @@ def admin_leads(request):
     
     # Get leads based on role
     if is_manager:
-        # Get the manager's username and user ID
-        manager_username = request.user.username
+        # Get the manager's user ID
         manager_id = request.user.id
         
         # Get IDs of users managed by this manager
-        managed_user_ids = []
-        for user in User.objects.all():
-            if hasattr(user, 'profile') and user.profile and user.profile.manager_username == manager_username:
-                managed_user_ids.append(user.id)
+        managed_user_ids = ManagerHierarchy.subordinate_ids(request.user)
         
         # Filter leads for managers to show:
         # 1. Leads assigned directly to the manager
         # 2. Unassigned leads that have this manager's username as manager_username
         # 3. Leads assigned to users managed by this manager
-        leads = Lead.objects.filter(
+        leads_scope = (
             models_Q(assigned_to_id=manager_id) |
-            models_Q(assigned_to__isnull=True, manager_username=manager_username) |
+            models_Q(assigned_to__isnull=True, manager_id=manager_id) |
             models_Q(assigned_to_id__in=managed_user_ids)
-        ).distinct().order_by('-created_at')
+        )
+        leads = Lead.objects.filter(leads_scope).order_by('-created_at')
     else:
         # Admin sees all leads
+        leads_scope = models_Q()
         leads = Lead.objects.all().order_by('-created_at')
     
+    # The charts below read the daily lead rollup with the same scope
+    lead_stats = DailyLeadStats.objects.filter(leads_scope)
+    
     # Calculate statistics
     total_leads = leads.count()
     new_leads = leads.filter(created_at__gte=timezone.now() - timedelta(days=30)).count()
@@ -1098,19 +952,11 @@ def admin_leads(request):
     if total_leads > 0:
         conversion_rate = round((converted_leads / total_leads) * 100, 1)
     
-    # Get lead sources data for pie chart
-    lead_sources = {
-        'website': leads.filter(lead_source='website').count(),
-        'phone': leads.filter(lead_source='phone').count(),
-        'referral': leads.filter(lead_source='referral').count(),
-        'email': leads.filter(lead_source='email').count(),
-        'social_media': leads.filter(lead_source='social_media').count(),
-        'trade_show': leads.filter(lead_source='trade_show').count(),
-        'other': leads.filter(lead_source='other').count(),
-        'email_campaign': leads.filter(lead_source='email_campaign').count(),
-        'cold_call': leads.filter(lead_source='cold_call').count(),
-        'event': leads.filter(lead_source='event').count()
-    }
+    # Get lead sources data for pie chart (one GROUP BY over the rollup)
+    lead_sources = {key: 0 for key in ['website', 'phone', 'referral', 'email', 'social_media', 'trade_show', 'other', 'email_campaign', 'cold_call', 'event']}
+    for source, count in lead_stats.order_by().values('lead_source').annotate(total=Sum('lead_count')).values_list('lead_source', 'total'):
+        if source in lead_sources:
+            lead_sources[source] = count
     
     # Ensure there's at least some data for the chart to display
     has_source_data = any(count > 0 for count in lead_sources.values())
@@ -1159,41 +1005,26 @@ def admin_leads(request):
         lead_sources_json = '{"labels":["Website","Phone","Referral","Email","Social Media","Trade Show","Other","Email Campaign","Cold Call","Event"],"data":[1,0,0,0,0,0,0,0,0,0]}'
     
     # Get lead conversion trend data (monthly for the past year)
-    current_month = timezone.now().month
-    current_year = timezone.now().year
-    
-    # Initialize data for all 12 months
+    # One GROUP BY month over the rollup: leads created per month and how many of them are converted
+    kind, month_starts, start_day, end_day = window_buckets('year')
+    month_totals = {}
+    month_converted = {}
+    monthly_rows = lead_stats.filter(day__gte=start_day, day__lt=end_day).order_by() \
+        .annotate(month=TruncMonth('day')).values('month') \
+        .annotate(total=Sum('lead_count'), converted=Sum('lead_count', filter=models_Q(lead_status='converted')))
+    for row in monthly_rows:
+        month_totals[row['month']] = row['total'] or 0
+        month_converted[row['month']] = row['converted'] or 0
+    
+    month_labels = [month_start.strftime('%b') for month_start in month_starts]
     monthly_conversion_data = []
-    month_labels = []
-    
-    # Calculate conversion rate for each month in the past year
-    for i in range(12):
-        # Calculate the month and year (going backwards from current month)
-        month = (current_month - i) % 12
-        if month == 0:
-            month = 12
-        year = current_year if month <= current_month else current_year - 1
-        
-        # Get month name
-        month_name = datetime(year, month, 1).strftime('%b')
-        month_labels.insert(0, month_name)
-        
-        # Get leads created in this month
-        month_leads = leads.filter(
-            created_at__year=year,
-            created_at__month=month
-        )
-        month_total = month_leads.count()
-        
-        # Get converted leads in this month
-        month_converted = month_leads.filter(lead_status='converted').count()
-        
+    for month_start in month_starts:
         # Calculate conversion rate for this month
         month_rate = 0
+        month_total = month_totals.get(month_start, 0)
         if month_total > 0:
-            month_rate = round((month_converted / month_total) * 100, 1)
-        
-        monthly_conversion_data.insert(0, month_rate)
+            month_rate = round((month_converted.get(month_start, 0) / month_total) * 100, 1)
+        monthly_conversion_data.append(month_rate)
     
     # Check if we have any conversion data
     has_conversion_data = any(rate > 0 for rate in monthly_conversion_data)
@@ -1217,9 +1048,8 @@ def admin_leads(request):
     # Get users for assignment dropdown
     if is_manager:
         # Only show users managed by this manager
-        manager_username = request.user.username
         users = User.objects.filter(
-            models_Q(profile__manager_username=manager_username) |
+            models_Q(profile__manager_id=request.user.id) |
             models_Q(id=request.user.id)  # Include the manager themselves
         ).filter(is_active=True).distinct().order_by('first_name', 'last_name')
     else:
@@ -1255,11 +1085,8 @@ def admin_contacts(request):
     
     # Get contacts based on role
     if is_manager:
-        # Get the manager's username
-        manager_username = request.user.username
-        
         # For managers, only show contacts where manager_username matches the logged-in user's username
-        contacts = Contact.objects.filter(manager_username=manager_username).order_by('-created_at')
+        contacts = Contact.objects.filter(manager_id=request.user.id).order_by('-created_at')
     elif request.user.is_superuser or is_admin(request.user):
         # Superusers and admins see all contacts
         contacts = Contact.objects.all().order_by('-created_at')
@@ -1303,11 +1130,8 @@ def admin_accounts(request):
     
     # Get accounts based on role
     if is_manager:
-        # Get the manager's username
-        manager_username = request.user.username
-        
         # For managers, only show accounts where manager_username matches the logged-in user's username
-        accounts = Account.objects.filter(manager_username=manager_username).order_by('-created_at')
+        accounts = Account.objects.filter(manager_id=request.user.id).order_by('-created_at')
     elif request.user.is_superuser or is_admin(request.user):
         # Superusers and admins see all accounts
         accounts = Account.objects.all().order_by('-created_at')
@@ -1358,15 +1182,11 @@ def admin_deals(request):
     
     # Get deals based on role
     if is_manager:
-        # Get the manager's username and user ID
-        manager_username = request.user.username
+        # Get the manager's user ID
         manager_id = request.user.id
         
         # Get IDs of users managed by this manager
-        managed_user_ids = []
-        for user in User.objects.all():
-            if hasattr(user, 'profile') and user.profile and user.profile.manager_username == manager_username:
-                managed_user_ids.append(user.id)
+        managed_user_ids = ManagerHierarchy.subordinate_ids(request.user)
         
         # Filter deals by assigned_to is a user managed by this manager OR created_by is this manager
         deals = Deal.objects.filter(
@@ -1435,19 +1255,15 @@ def admin_tasks(request):
     
     # Get tasks based on role
     if is_manager:
-        # Get the manager's username and user ID
-        manager_username = request.user.username
+        # Get the manager's user ID
         manager_id = request.user.id
         
         # Filter tasks by manager_username OR tasks assigned to users managed by this manager
-        managed_user_ids = []
-        for user in User.objects.all():
-            if hasattr(user, 'profile') and user.profile and user.profile.manager_username == manager_username:
-                managed_user_ids.append(user.id)
+        managed_user_ids = ManagerHierarchy.subordinate_ids(request.user)
         
         # Filter tasks by manager_username OR assigned_to is a user managed by this manager OR created_by is this manager
         tasks = Task.objects.filter(
-            models_Q(manager_username=manager_username) |
+            models_Q(manager_id=manager_id) |
             models_Q(assigned_to__id__in=managed_user_ids) |
             models_Q(created_by_id=manager_id)
         ).distinct().order_by('-created_at')
@@ -1879,7 +1695,7 @@ def admin_lead_convert(request, lead_id):
         lead.save()
         
         # Create activity log
-        UserActivityLog.objects.create(
+        log_user_activity(
             user=request.user,
             action_type='other',  # Using 'other' from ACTION_TYPES choices
             action_detail=f"Converted lead '{lead.first_name} {lead.last_name}' to account '{account.name}'",
@@ -2024,11 +1840,8 @@ def admin_accounts(request):
     
     # Get accounts based on role
     if is_manager:
-        # Get the manager's username
-        manager_username = request.user.username
-        
         # For managers, only show accounts where manager_username matches the logged-in user's username
-        accounts = Account.objects.filter(manager_username=manager_username).order_by('-created_at')
+        accounts = Account.objects.filter(manager_id=request.user.id).order_by('-created_at')
     elif request.user.is_superuser or is_admin(request.user):
         # Superusers and admins see all accounts
         accounts = Account.objects.all().order_by('-created_at')
@@ -2215,7 +2028,7 @@ def admin_account_edit(request, account_id):
             account.save()
             
             # Create activity log
-            UserActivityLog.objects.create(
+            log_user_activity(
                 user=request.user,
                 action_type='update',
                 action_detail=f"Updated account '{account.name}'",
@@ -2252,7 +2065,7 @@ def admin_account_delete(request, account_id):
         account.delete()
         
         # Create activity log
-        UserActivityLog.objects.create(
+        log_user_activity(
             user=request.user,
             action_type='delete',
             action_detail=f"Deleted account '{account_name}'",
@@ -2279,118 +2092,6 @@ def admin_account_delete(request, account_id):
             messages.error(request, f'Error deleting account: {str(e)}')
             return redirect('admin_accounts')
 
-# Admin Account Import View
-@login_required
-@user_passes_test(is_admin)
-def admin_account_import(request):
-    if request.method == 'POST' and request.FILES.get('import_file'):
-        try:
-            csv_file = request.FILES['import_file']
-            
-            # Check if file is CSV
-            if not csv_file.name.endswith('.csv'):
-                messages.error(request, 'Please upload a CSV file.')
-                return redirect('admin_accounts')
-            
-            # Decode the file
-            file_data = csv_file.read().decode('utf-8-sig').splitlines()
-            reader = csv.DictReader(file_data)
-            
-            # Track import statistics
-            total_rows = 0
-            imported_count = 0
-            error_count = 0
-            error_messages = []
-            
-            # Process each row
-            for row in reader:
-                total_rows += 1
-                try:
-                    # Create a new account
-                    account = Account()
-                    account.name = row.get('Name', '').strip()
-                    
-                    # Skip if no name provided
-                    if not account.name:
-                        error_count += 1
-                        error_messages.append(f"Row {total_rows}: Account name is required.")
-                        continue
-                    
-                    # Set other fields
-                    account.account_type = row.get('Type', '').strip().lower()
-                    account.phone = row.get('Phone', '').strip()
-                    account.email = row.get('Email', '').strip()
-                    account.website = row.get('Website', '').strip()
-                    account.billing_address = row.get('Billing Address', '').strip()
-                    account.shipping_address = row.get('Shipping Address', '').strip()
-                    account.description = row.get('Description', '').strip()
-                    account.manager_username = request.user.username
-                    
-                    # Handle numeric fields
-                    employees = row.get('Employees', '').strip()
-                    if employees:
-                        try:
-                            account.employees = int(employees)
-                        except ValueError:
-                            pass
-                    
-                    annual_revenue = row.get('Annual Revenue', '').strip()
-                    if annual_revenue:
-                        try:
-                            # Remove currency symbols and commas
-                            annual_revenue = annual_revenue.replace('$', '').replace(',', '')
-                            # Convert to Decimal to avoid precision issues
-                            from decimal import Decimal
-                            account.annual_revenue = Decimal(annual_revenue)
-                        except (ValueError, decimal.InvalidOperation):
-                            # If conversion fails, set to None
-                            account.annual_revenue = None
-                    
-                    # Handle industry if provided
-                    industry_name = row.get('Industry', '').strip()
-                    if industry_name:
-                        # Try to find existing industry or create new one
-                        industry, created = Industry.objects.get_or_create(name=industry_name)
-                        account.industry = industry
-                    
-                    # Set created_by to current user
-                    account.created_by = request.user
-                    
-                    # Save the account
-                    account.save()
-                    imported_count += 1
-                    
-                except Exception as e:
-                    error_count += 1
-                    error_messages.append(f"Row {total_rows}: {str(e)}")
-            
-            # Create activity log
-            UserActivityLog.objects.create(
-                user=request.user,
-                action_type='import',
-                action_detail=f"Imported {imported_count} accounts from CSV",
-                model_affected='Account',
-                object_id=None
-            )
-            
-            # Show success message with statistics
-            if imported_count > 0:
-                messages.success(request, f'Successfully imported {imported_count} accounts. {error_count} errors occurred.')
-            else:
-                messages.warning(request, f'No accounts were imported. {error_count} errors occurred.')
-            
-            # Show error details if any
-            if error_messages:
-                for msg in error_messages[:5]:  # Show first 5 errors
-                    messages.error(request, msg)
-                if len(error_messages) > 5:
-                    messages.error(request, f'... and {len(error_messages) - 5} more errors.')
-            
-        except Exception as e:
-            messages.error(request, f'Error importing accounts: {str(e)}')
-    
-    return redirect('admin_accounts')
-
 # Admin Download Account Template View
 @login_required
 @user_passes_test(is_admin)
@@ -2418,60 +2119,62 @@ def admin_download_account_template(request):
 @login_required
 @user_passes_test(is_admin)
 def admin_lead_import(request):
+    return run_csv_import(request, 'leads', 'admin_leads')
+
+def run_csv_import(request, kind, redirect_to):
+    """
+    Shared body of the admin CSV import views: store the upload as an
+    ImportJob for the background runner (see jobs.py) and return at once.
+    The list page polls the job's progress from the import_job parameter.
+    """
     if request.method == 'POST' and request.FILES.get('import_file'):
         csv_file = request.FILES['import_file']
         
         # Check if file is CSV
         if not csv_file.name.endswith('.csv'):
             messages.error(request, 'Please upload a CSV file')
-            return redirect('admin_leads')
-        
-        # Process CSV file
-        try:
-            decoded_file = csv_file.read().decode('utf-8').splitlines()
-            reader = csv.DictReader(decoded_file)
-            
-            success_count = 0
-            error_count = 0
-            
-            for row in reader:
-                try:
-                    # Create lead from CSV row
-                    lead = Lead(
-                        first_name=row.get('first_name', ''),
-                        last_name=row.get('last_name', ''),
-                        email=row.get('email', ''),
-                        phone=row.get('phone', ''),
-                        company=row.get('company', ''),
-                        title=row.get('job_title', ''),
-                        lead_source=row.get('lead_source', 'other'),
-                        lead_status=row.get('lead_status', 'new'),
-                        created_by=request.user
-                    )
-                    
-                    # Set assigned_to if username provided
-                    if row.get('assigned_to'):
-                        try:
-                            user = User.objects.get(username=row.get('assigned_to'))
-                            lead.assigned_to = user
-                        except User.DoesNotExist:
-                            pass
-                    
-                    lead.save()
-                    success_count += 1
-                    
-                except Exception:
-                    error_count += 1
-            
-            if success_count > 0:
-                messages.success(request, f'Successfully imported {success_count} leads')
-            if error_count > 0:
-                messages.warning(request, f'Failed to import {error_count} leads due to errors')
-                
-        except Exception as e:
-            messages.error(request, f'Error importing leads: {str(e)}')
+            return redirect(redirect_to)
+        
+        # Without a header row the columns are read in template order
+        job = create_import_job(request.user, kind, csv_file, has_header=request.POST.get('header_row') == 'on')
+        return redirect(f"{reverse(redirect_to)}?import_job={job.id}")
+    
+    return redirect(redirect_to)
+
+# Admin Import Job Progress View
+@login_required
+@user_passes_test(is_admin)
+def admin_import_job_status(request, job_id):
+    # A job whose runner died would otherwise be polled as running forever
+    recover_stale_jobs()
+    job = get_object_or_404(ImportJob, id=job_id)
+    return JsonResponse({
+        'id': job.id,
+        'kind': job.kind,
+        'file': job.original_name,
+        'status': job.status,
+        'finished': job.is_finished,
+        'rows_processed': job.rows_processed,
+        'created': job.created_count,
+        'error_count': job.error_count,
+        'rows_per_second': round(job.rows_per_second),
+        'message': job.message,
+    })
+
+# Admin Import Job Error Report View
+@login_required
+@user_passes_test(is_admin)
+def admin_import_job_errors(request, job_id):
+    job = get_object_or_404(ImportJob, id=job_id)
+    response = HttpResponse(content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="import_{job.id}_errors.csv"'
     
-    return redirect('admin_leads')
+    writer = csv.writer(response)
+    writer.writerow(['line', 'error'])
+    for error in job.errors:
+        writer.writerow([error['line'], error['error']])
+    
+    return response
 
 # Admin Download Lead Template View
 @login_required
@@ -2631,7 +2334,7 @@ def admin_contact_edit(request, contact_id):
                 )
             
             # Create activity log
-            UserActivityLog.objects.create(
+            log_user_activity(
                 user=request.user,
                 action_type='update',
                 action_detail=f"Updated contact '{contact.first_name} {contact.last_name}'",
@@ -2679,7 +2382,7 @@ def admin_contact_add_note(request, contact_id):
             )
             
             # Create activity log
-            UserActivityLog.objects.create(
+            log_user_activity(
                 user=request.user,
                 action_type='create',
                 action_detail=f"Added note to contact '{contact.first_name} {contact.last_name}'",
@@ -2707,7 +2410,7 @@ def admin_contact_delete_note(request, contact_id):
             note.delete()
             
             # Create activity log
-            UserActivityLog.objects.create(
+            log_user_activity(
                 user=request.user,
                 action_type='delete',
                 action_detail=f"Deleted note from contact '{contact.first_name} {contact.last_name}'",
@@ -2727,57 +2430,7 @@ def admin_contact_delete_note(request, contact_id):
 @login_required
 @user_passes_test(is_admin)
 def admin_contact_import(request):
-    if request.method == 'POST' and request.FILES.get('import_file'):
-        csv_file = request.FILES['import_file']
-        
-        # Check if file is CSV
-        if not csv_file.name.endswith('.csv'):
-            messages.error(request, 'Please upload a CSV file')
-            return redirect('admin_contacts')
-        
-        # Process CSV file
-        try:
-            decoded_file = csv_file.read().decode('utf-8').splitlines()
-            reader = csv.DictReader(decoded_file)
-            
-            success_count = 0
-            error_count = 0
-            
-            for row in reader:
-                try:
-                    # Create contact from CSV row
-                    contact = Contact(
-                        first_name=row.get('first_name', ''),
-                        last_name=row.get('last_name', ''),
-                        email=row.get('email', ''),
-                        phone=row.get('phone', ''),
-                        job_title=row.get('job_title', ''),
-                        created_by=request.user
-                    )
-                    
-                    # Set account if account_id provided
-                    if row.get('account_id'):
-                        try:
-                            account = Account.objects.get(id=row.get('account_id'))
-                            contact.account = account
-                        except Account.DoesNotExist:
-                            pass
-                    
-                    contact.save()
-                    success_count += 1
-                    
-                except Exception:
-                    error_count += 1
-            
-            if success_count > 0:
-                messages.success(request, f'Successfully imported {success_count} contacts')
-            if error_count > 0:
-                messages.warning(request, f'Failed to import {error_count} contacts due to errors')
-                
-        except Exception as e:
-            messages.error(request, f'Error importing contacts: {str(e)}')
-    
-    return redirect('admin_contacts')
+    return run_csv_import(request, 'contacts', 'admin_contacts')
 
 # Admin Download Contact Template View
 @login_required
@@ -2900,7 +2553,7 @@ def admin_account_create(request):
             account.save()
             
             # Create activity log
-            UserActivityLog.objects.create(
+            log_user_activity(
                 user=request.user,
                 action_type='create',
                 action_detail=f"Created new account '{account.name}'",
@@ -3047,69 +2700,7 @@ def admin_account_edit(request, account_id):
 @login_required
 @user_passes_test(is_admin)
 def admin_account_import(request):
-    if request.method == 'POST' and request.FILES.get('import_file'):
-        csv_file = request.FILES['import_file']
-        
-        # Check if file is CSV
-        if not csv_file.name.endswith('.csv'):
-            messages.error(request, 'Please upload a CSV file')
-            return redirect('admin_accounts')
-            
-        try:
-            # Check if file is too large
-            if csv_file.size > 1048576:  # 1 MB
-                messages.error(request, 'The uploaded file is too large')
-                return redirect('admin_accounts')
-                
-            # Process CSV file
-            decoded_file = csv_file.read().decode('utf-8').splitlines()
-            reader = csv.reader(decoded_file)
-            
-            # Skip header row if specified
-            header_row = request.POST.get('header_row') == 'on'
-            if header_row:
-                next(reader)  # Skip the header row
-                
-            # Process rows
-            accounts_created = 0
-            for row in reader:
-                if len(row) < 1:  # Must have at least name
-                    continue
-                    
-                name = row[0].strip()
-                if not name:  # Skip if name is empty
-                    continue
-                    
-                # Get industry if provided (index 1)
-                industry = None
-                if len(row) > 1 and row[1].strip():
-                    try:
-                        industry_id = int(row[1].strip())
-                        industry = Industry.objects.get(id=industry_id)
-                    except (ValueError, Industry.DoesNotExist):
-                        pass
-                        
-                # Create account with available data
-                account = Account(
-                    name=name,
-                    industry=industry,
-                    website=row[2].strip() if len(row) > 2 else '',
-                    phone=row[3].strip() if len(row) > 3 else '',
-                    annual_revenue=float(row[4]) if len(row) > 4 and row[4].strip() else 0,
-                    employees=int(row[5]) if len(row) > 5 and row[5].strip() else 0,
-                    address=row[6].strip() if len(row) > 6 else '',
-                    description=row[7].strip() if len(row) > 7 else ''
-                )
-                account.save()
-                accounts_created += 1
-                
-            messages.success(request, f'Successfully imported {accounts_created} accounts')
-        except Exception as e:
-            messages.error(request, f'Error importing accounts: {str(e)}')
-            
-        return redirect('admin_accounts')
-    
-    return redirect('admin_accounts')
+    return run_csv_import(request, 'accounts', 'admin_accounts')
 
 # Admin Download Account Template View
 @login_required
@@ -3288,81 +2879,7 @@ def admin_deal_edit(request, deal_id):
 @login_required
 @user_passes_test(is_admin)
 def admin_deal_import(request):
-    if request.method == 'POST' and request.FILES.get('import_file'):
-        csv_file = request.FILES['import_file']
-        
-        # Check if file is CSV
-        if not csv_file.name.endswith('.csv'):
-            messages.error(request, 'Please upload a CSV file')
-            return redirect('admin_deals')
-        
-        try:
-            # Check if file is too large
-            if csv_file.size > 1048576:  # 1 MB
-                messages.error(request, 'The uploaded file is too large')
-                return redirect('admin_deals')
-            
-            # Process CSV file
-            decoded_file = csv_file.read().decode('utf-8').splitlines()
-            reader = csv.reader(decoded_file)
-            
-            # Skip header row if specified
-            header_row = request.POST.get('header_row') == 'on'
-            if header_row:
-                next(reader)  # Skip the header row
-            
-            # Process rows
-            deals_created = 0
-            for row in reader:
-                if len(row) < 2:  # Must have at least name and amount
-                    continue
-                
-                name = row[0].strip()
-                amount = 0
-                try:
-                    amount = float(row[1].strip()) if row[1].strip() else 0
-                except ValueError:
-                    amount = 0
-                
-                if not name or amount <= 0:  # Skip if name is empty or amount is invalid
-                    continue
-                
-                # Create deal with available data
-                deal = Deal(
-                    name=name,
-                    amount=amount,
-                    stage=row[2].strip() if len(row) > 2 and row[2].strip() else 'qualification',
-                    expected_close_date=row[3].strip() if len(row) > 3 and row[3].strip() else timezone.now() + timedelta(days=30),
-                    probability=float(row[4].strip()) if len(row) > 4 and row[4].strip() else 50,
-                    created_by=request.user
-                )
-                
-                # Set account if provided
-                if len(row) > 5 and row[5].strip():
-                    try:
-                        account_id = int(row[5].strip())
-                        deal.account = Account.objects.get(id=account_id)
-                    except Exception:
-                        pass
-                
-                # Set contact if provided
-                if len(row) > 6 and row[6].strip():
-                    try:
-                        contact_id = int(row[6].strip())
-                        deal.contact = Contact.objects.get(id=contact_id)
-                    except Exception:
-                        pass
-                
-                deal.save()
-                deals_created += 1
-            
-            messages.success(request, f'Successfully imported {deals_created} deals')
-        except Exception as e:
-            messages.error(request, f'Error importing deals: {str(e)}')
-        
-        return redirect('admin_deals')
-    
-    return redirect('admin_deals')
+    return run_csv_import(request, 'deals', 'admin_deals')
 
 @login_required
 @user_passes_test(is_admin)
@@ -3423,19 +2940,15 @@ def admin_tasks(request):
     
     # Get tasks based on role
     if is_manager:
-        # Get the manager's username and user ID
-        manager_username = request.user.username
+        # Get the manager's user ID
         manager_id = request.user.id
         
         # Get IDs of users managed by this manager
-        managed_user_ids = []
-        for user in User.objects.all():
-            if hasattr(user, 'profile') and user.profile and user.profile.manager_username == manager_username:
-                managed_user_ids.append(user.id)
+        managed_user_ids = ManagerHierarchy.subordinate_ids(request.user)
         
         # Filter tasks by manager_username OR assigned_to is a user managed by this manager OR created_by is this manager
         tasks = Task.objects.filter(
-            models_Q(manager_username=manager_username) |
+            models_Q(manager_id=manager_id) |
             models_Q(assigned_to__id__in=managed_user_ids) |
             models_Q(created_by_id=manager_id)
         ).distinct().order_by('-due_date')
@@ -3454,9 +2967,8 @@ def admin_tasks(request):
     # Get users for assignee dropdown
     if is_manager:
         # Only show users managed by this manager
-        manager_username = request.user.username
         users = User.objects.filter(
-            models_Q(profile__manager_username=manager_username) |
+            models_Q(profile__manager_id=request.user.id) |
             models_Q(id=request.user.id)  # Include the manager themselves
         ).distinct().order_by('username')
     else:
@@ -3470,77 +2982,10 @@ def admin_tasks(request):
         'year': get_task_data_for_year(request.user)
     }
     
-    # Calculate priority data for charts with different time frames
-    priority_counts = {
-        'week': get_priority_data_for_week(request.user),
-        'month': get_priority_data_for_month(request.user),
-        'year': get_priority_data_for_year(request.user)
-    }
+    # Calculate priority data for charts with different time frames (one query)
+    priority_counts = priority_histogram(request.user)
     
-    # Get leads, contacts, accounts, and deals for the related items dropdown
-    if is_manager:
-        # Filter leads by manager
-        manager_username = request.user.username
-        manager_id = request.user.id
-        
-        # Get IDs of users managed by this manager
-        managed_user_ids = []
-        for user in User.objects.all():
-            if hasattr(user, 'profile') and user.profile and user.profile.manager_username == manager_username:
-                managed_user_ids.append(user.id)
-        
-        # Filter leads by manager_username OR assigned_to is a user managed by this manager OR created_by is this manager
-        leads = Lead.objects.filter(
-            models_Q(manager_username=manager_username) |
-            models_Q(assigned_to__id__in=managed_user_ids) |
-            models_Q(created_by_id=manager_id)
-        ).distinct().order_by('first_name', 'last_name')
-        
-        # Filter contacts by manager
-        contacts = Contact.objects.filter(
-            models_Q(assigned_to__id__in=managed_user_ids) |
-            models_Q(created_by_id=manager_id)
-        ).distinct().order_by('first_name', 'last_name')
-        
-        # Filter accounts by manager
-        accounts = Account.objects.filter(
-            models_Q(assigned_to__id__in=managed_user_ids) |
-            models_Q(created_by_id=manager_id)
-        ).distinct().order_by('name')
-        
-        # Filter deals by manager
-        deals = Deal.objects.filter(
-            models_Q(assigned_to__id__in=managed_user_ids) |
-            models_Q(created_by_id=manager_id)
-        ).distinct().order_by('name')
-    else:
-        # Admin sees all items
-        leads = Lead.objects.all().order_by('first_name', 'last_name')
-        contacts = Contact.objects.all().order_by('first_name', 'last_name')
-        accounts = Account.objects.all().order_by('name')
-        deals = Deal.objects.all().order_by('name')
-    
-    # Convert related items to JSON for JavaScript
-    # Add explicit type conversion to ensure JSON serialization works correctly
-    leads_json = json.dumps([{
-        'id': str(lead.id),  # Convert ID to string to ensure proper JSON serialization
-        'name': f"{lead.first_name} {lead.last_name} ({lead.email})"
-    } for lead in leads])
-    
-    contacts_json = json.dumps([{
-        'id': str(contact.id),  # Convert ID to string to ensure proper JSON serialization
-        'name': f"{contact.first_name} {contact.last_name} ({contact.email})"
-    } for contact in contacts])
-    
-    accounts_json = json.dumps([{
-        'id': str(account.id),  # Convert ID to string to ensure proper JSON serialization
-        'name': f"{account.name} ({account.website or 'No website'})"
-    } for account in accounts])
-    
-    deals_json = json.dumps([{
-        'id': str(deal.id),  # Convert ID to string to ensure proper JSON serialization
-        'name': f"{deal.name} (${deal.amount})"
-    } for deal in deals])
+    # The related-item picker loads its options from /api/autocomplete/<entity>/
     
     context = {
         'active_page': 'tasks',
@@ -3553,10 +2998,6 @@ def admin_tasks(request):
         'users': users,
         'task_counts_json': json.dumps(task_counts),
         'priority_counts_json': json.dumps(priority_counts),
-        'leads_json': leads_json,
-        'contacts_json': contacts_json,
-        'accounts_json': accounts_json,
-        'deals_json': deals_json
     }
     
     return render(request, 'admin/tasks.html', context)
@@ -3574,9 +3015,8 @@ def admin_calendar(request):
 
     # Build users queryset for dropdown
     if is_manager:
-        manager_username = request.user.username
         users_qs = User.objects.filter(
-            models_Q(profile__manager_username=manager_username) |
+            models_Q(profile__manager_id=request.user.id) |
             models_Q(id=request.user.id)
         ).distinct().order_by('username')
     else:
@@ -3596,421 +3036,16 @@ def admin_calendar(request):
     }
     return render(request, 'admin/calendar.html', context)
 
-# Helper function to get task data for the past week
+# Helper functions to get task trend data for the charts.
+# Each one runs two GROUP BY queries (see timeseries.py).
 def get_task_data_for_week(user=None):
-    # Get dates for the past 7 days
-    today = timezone.now().date()
-    days = []
-    created_counts = []
-    completed_counts = []
-    
-    # Check if the user is a manager
-    is_manager = False
-    manager_username = None
-    manager_id = None
-    managed_user_ids = []
-    
-    if user and hasattr(user, 'profile') and user.profile and user.profile.role:
-        is_manager = user.profile.role.lower() == 'manager'
-        if is_manager:
-            manager_username = user.username
-            manager_id = user.id
-            
-            # Get IDs of users managed by this manager
-            for managed_user in User.objects.all():
-                if hasattr(managed_user, 'profile') and managed_user.profile and managed_user.profile.manager_username == manager_username:
-                    managed_user_ids.append(managed_user.id)
-    
-    # Get data for each day of the week
-    for i in range(6, -1, -1):
-        day = today - timedelta(days=i)
-        days.append(day.strftime('%a'))  # Day name (Mon, Tue, etc.)
-        
-        # Filter tasks based on user role
-        if is_manager:
-            # Filter tasks for manager
-            task_filter = models_Q(created_at__date=day)
-            task_filter = task_filter & (
-                models_Q(manager_username=manager_username) |
-                models_Q(assigned_to__id__in=managed_user_ids) |
-                models_Q(created_by_id=manager_id)
-            )
-            created_count = Task.objects.filter(task_filter).distinct().count()
-            
-            # Count tasks completed on this day
-            completed_filter = models_Q(status='completed', completed_date__date=day)
-            completed_filter = completed_filter & (
-                models_Q(manager_username=manager_username) |
-                models_Q(assigned_to__id__in=managed_user_ids) |
-                models_Q(created_by_id=manager_id)
-            )
-            completed_count = Task.objects.filter(completed_filter).distinct().count()
-        else:
-            # Admin sees all tasks
-            created_count = Task.objects.filter(created_at__date=day).count()
-            completed_count = Task.objects.filter(status='completed', completed_date__date=day).count()
-        
-        created_counts.append(created_count)
-        completed_counts.append(completed_count)
-    
-    return {
-        'labels': days,
-        'created': created_counts,
-        'completed': completed_counts
-    }
+    return task_trend(user, 'week')
 
-# Helper function to get task data for the past month
 def get_task_data_for_month(user=None):
-    # Get dates for the past 30 days
-    today = timezone.now().date()
-    days = []
-    created_counts = []
-    completed_counts = []
-    
-    # Check if the user is a manager
-    is_manager = False
-    manager_username = None
-    manager_id = None
-    managed_user_ids = []
-    
-    if user and hasattr(user, 'profile') and user.profile and user.profile.role:
-        is_manager = user.profile.role.lower() == 'manager'
-        if is_manager:
-            manager_username = user.username
-            manager_id = user.id
-            
-            # Get IDs of users managed by this manager
-            for managed_user in User.objects.all():
-                if hasattr(managed_user, 'profile') and managed_user.profile and managed_user.profile.manager_username == manager_username:
-                    managed_user_ids.append(managed_user.id)
-    
-    # Get data for each day of the month
-    for i in range(29, -1, -1):
-        day = today - timedelta(days=i)
-        days.append(day.day)  # Day of month (1-31)
-        
-        # Filter tasks based on user role
-        if is_manager:
-            # Filter tasks for manager
-            task_filter = models_Q(created_at__date=day)
-            task_filter = task_filter & (
-                models_Q(manager_username=manager_username) |
-                models_Q(assigned_to__id__in=managed_user_ids) |
-                models_Q(created_by_id=manager_id)
-            )
-            created_count = Task.objects.filter(task_filter).distinct().count()
-            
-            # Count tasks completed on this day
-            completed_filter = models_Q(status='completed', completed_date__date=day)
-            completed_filter = completed_filter & (
-                models_Q(manager_username=manager_username) |
-                models_Q(assigned_to__id__in=managed_user_ids) |
-                models_Q(created_by_id=manager_id)
-            )
-            completed_count = Task.objects.filter(completed_filter).distinct().count()
-        else:
-            # Admin sees all tasks
-            created_count = Task.objects.filter(created_at__date=day).count()
-            completed_count = Task.objects.filter(status='completed', completed_date__date=day).count()
-        
-        created_counts.append(created_count)
-        completed_counts.append(completed_count)
-    
-    return {
-        'labels': days,
-        'created': created_counts,
-        'completed': completed_counts
-    }
+    return task_trend(user, 'month')
 
-# Helper function to get task data for the past year
 def get_task_data_for_year(user=None):
-    # Get data for each month of the past year
-    today = timezone.now().date()
-    months = []
-    created_counts = []
-    completed_counts = []
-    
-    # Check if the user is a manager
-    is_manager = False
-    manager_username = None
-    manager_id = None
-    managed_user_ids = []
-    
-    if user and hasattr(user, 'profile') and user.profile and user.profile.role:
-        is_manager = user.profile.role.lower() == 'manager'
-        if is_manager:
-            manager_username = user.username
-            manager_id = user.id
-            
-            # Get IDs of users managed by this manager
-            for managed_user in User.objects.all():
-                if hasattr(managed_user, 'profile') and managed_user.profile and managed_user.profile.manager_username == manager_username:
-                    managed_user_ids.append(managed_user.id)
-    
-    # Get data for each month of the year
-    for i in range(11, -1, -1):
-        # Calculate the first day of each month in the past year
-        year = today.year
-        month = today.month - i
-        
-        # Adjust year if we go to previous year
-        while month <= 0:
-            month += 12
-            year -= 1
-        
-        # Get the month name
-        month_name = datetime(year, month, 1).strftime('%b')  # Month name (Jan, Feb, etc.)
-        months.append(month_name)
-        
-        # Count tasks created in this month
-        start_date = datetime(year, month, 1).date()
-        if month == 12:
-            end_date = datetime(year + 1, 1, 1).date()
-        else:
-            end_date = datetime(year, month + 1, 1).date()
-        
-        # Filter tasks based on user role
-        if is_manager:
-            # Filter tasks for manager
-            task_filter = models_Q(created_at__gte=start_date, created_at__lt=end_date)
-            task_filter = task_filter & (
-                models_Q(manager_username=manager_username) |
-                models_Q(assigned_to__id__in=managed_user_ids) |
-                models_Q(created_by_id=manager_id)
-            )
-            created_count = Task.objects.filter(task_filter).distinct().count()
-            
-            # Count tasks completed in this month
-            completed_filter = models_Q(status='completed', completed_date__gte=start_date, completed_date__lt=end_date)
-            completed_filter = completed_filter & (
-                models_Q(manager_username=manager_username) |
-                models_Q(assigned_to__id__in=managed_user_ids) |
-                models_Q(created_by_id=manager_id)
-            )
-            completed_count = Task.objects.filter(completed_filter).distinct().count()
-        else:
-            # Admin sees all tasks
-            created_count = Task.objects.filter(created_at__gte=start_date, created_at__lt=end_date).count()
-            completed_count = Task.objects.filter(status='completed', completed_date__gte=start_date, completed_date__lt=end_date).count()
-        
-        created_counts.append(created_count)
-        completed_counts.append(completed_count)
-    
-    return {
-        'labels': months,
-        'created': created_counts,
-        'completed': completed_counts
-    }
-
-# Helper function to get priority data for the past week
-def get_priority_data_for_week(user=None):
-    # Get tasks from the past 7 days
-    today = timezone.now().date()
-    week_ago = today - timedelta(days=7)
-    
-    # Check if the user is a manager
-    is_manager = False
-    manager_username = None
-    manager_id = None
-    managed_user_ids = []
-    
-    if user and hasattr(user, 'profile') and user.profile and user.profile.role:
-        is_manager = user.profile.role.lower() == 'manager'
-        if is_manager:
-            manager_username = user.username
-            manager_id = user.id
-            
-            # Get IDs of users managed by this manager
-            for managed_user in User.objects.all():
-                if hasattr(managed_user, 'profile') and managed_user.profile and managed_user.profile.manager_username == manager_username:
-                    managed_user_ids.append(managed_user.id)
-    
-    # Filter tasks based on user role
-    if is_manager:
-        # Filter tasks for manager
-        base_filter = (
-            models_Q(manager_username=manager_username) |
-            models_Q(assigned_to__id__in=managed_user_ids) |
-            models_Q(created_by_id=manager_id)
-        )
-        
-        # Count tasks by priority
-        high_count = Task.objects.filter(
-            models_Q(created_at__date__gte=week_ago, created_at__date__lte=today, priority='high') & base_filter
-        ).distinct().count()
-        
-        medium_count = Task.objects.filter(
-            models_Q(created_at__date__gte=week_ago, created_at__date__lte=today, priority='medium') & base_filter
-        ).distinct().count()
-        
-        low_count = Task.objects.filter(
-            models_Q(created_at__date__gte=week_ago, created_at__date__lte=today, priority='low') & base_filter
-        ).distinct().count()
-    else:
-        # Admin sees all tasks
-        high_count = Task.objects.filter(
-            created_at__date__gte=week_ago,
-            created_at__date__lte=today,
-            priority='high'
-        ).count()
-        
-        medium_count = Task.objects.filter(
-            created_at__date__gte=week_ago,
-            created_at__date__lte=today,
-            priority='medium'
-        ).count()
-        
-        low_count = Task.objects.filter(
-            created_at__date__gte=week_ago,
-            created_at__date__lte=today,
-            priority='low'
-        ).count()
-    
-    return {
-        'high': high_count,
-        'medium': medium_count,
-        'low': low_count
-    }
-
-# Helper function to get priority data for the past month
-def get_priority_data_for_month(user=None):
-    # Get tasks from the past 30 days
-    today = timezone.now().date()
-    month_ago = today - timedelta(days=30)
-    
-    # Check if the user is a manager
-    is_manager = False
-    manager_username = None
-    manager_id = None
-    managed_user_ids = []
-    
-    if user and hasattr(user, 'profile') and user.profile and user.profile.role:
-        is_manager = user.profile.role.lower() == 'manager'
-        if is_manager:
-            manager_username = user.username
-            manager_id = user.id
-            
-            # Get IDs of users managed by this manager
-            for managed_user in User.objects.all():
-                if hasattr(managed_user, 'profile') and managed_user.profile and managed_user.profile.manager_username == manager_username:
-                    managed_user_ids.append(managed_user.id)
-    
-    # Filter tasks based on user role
-    if is_manager:
-        # Filter tasks for manager
-        base_filter = (
-            models_Q(manager_username=manager_username) |
-            models_Q(assigned_to__id__in=managed_user_ids) |
-            models_Q(created_by_id=manager_id)
-        )
-        
-        # Count tasks by priority
-        high_count = Task.objects.filter(
-            models_Q(created_at__date__gte=month_ago, created_at__date__lte=today, priority='high') & base_filter
-        ).distinct().count()
-        
-        medium_count = Task.objects.filter(
-            models_Q(created_at__date__gte=month_ago, created_at__date__lte=today, priority='medium') & base_filter
-        ).distinct().count()
-        
-        low_count = Task.objects.filter(
-            models_Q(created_at__date__gte=month_ago, created_at__date__lte=today, priority='low') & base_filter
-        ).distinct().count()
-    else:
-        # Admin sees all tasks
-        high_count = Task.objects.filter(
-            created_at__date__gte=month_ago,
-            created_at__date__lte=today,
-            priority='high'
-        ).count()
-        
-        medium_count = Task.objects.filter(
-            created_at__date__gte=month_ago,
-            created_at__date__lte=today,
-            priority='medium'
-        ).count()
-        
-        low_count = Task.objects.filter(
-            created_at__date__gte=month_ago,
-            created_at__date__lte=today,
-            priority='low'
-        ).count()
-    
-    return {
-        'high': high_count,
-        'medium': medium_count,
-        'low': low_count
-    }
-
-# Helper function to get priority data for the past year
-def get_priority_data_for_year(user=None):
-    # Get tasks from the current year
-    today = timezone.now().date()
-    start_of_year = datetime(today.year, 1, 1).date()
-    
-    # Check if the user is a manager
-    is_manager = False
-    manager_username = None
-    manager_id = None
-    managed_user_ids = []
-    
-    if user and hasattr(user, 'profile') and user.profile and user.profile.role:
-        is_manager = user.profile.role.lower() == 'manager'
-        if is_manager:
-            manager_username = user.username
-            manager_id = user.id
-            
-            # Get IDs of users managed by this manager
-            for managed_user in User.objects.all():
-                if hasattr(managed_user, 'profile') and managed_user.profile and managed_user.profile.manager_username == manager_username:
-                    managed_user_ids.append(managed_user.id)
-    
-    # Filter tasks based on user role
-    if is_manager:
-        # Filter tasks for manager
-        base_filter = (
-            models_Q(manager_username=manager_username) |
-            models_Q(assigned_to__id__in=managed_user_ids) |
-            models_Q(created_by_id=manager_id)
-        )
-        
-        # Count tasks by priority
-        high_count = Task.objects.filter(
-            models_Q(created_at__date__gte=start_of_year, created_at__date__lte=today, priority='high') & base_filter
-        ).distinct().count()
-        
-        medium_count = Task.objects.filter(
-            models_Q(created_at__date__gte=start_of_year, created_at__date__lte=today, priority='medium') & base_filter
-        ).distinct().count()
-        
-        low_count = Task.objects.filter(
-            models_Q(created_at__date__gte=start_of_year, created_at__date__lte=today, priority='low') & base_filter
-        ).distinct().count()
-    else:
-        # Admin sees all tasks
-        high_count = Task.objects.filter(
-            created_at__date__gte=start_of_year,
-            created_at__date__lte=today,
-            priority='high'
-        ).count()
-        
-        medium_count = Task.objects.filter(
-            created_at__date__gte=start_of_year,
-            created_at__date__lte=today,
-            priority='medium'
-        ).count()
-        
-        low_count = Task.objects.filter(
-            created_at__date__gte=start_of_year,
-            created_at__date__lte=today,
-            priority='low'
-        ).count()
-    
-    return {
-        'high': high_count,
-        'medium': medium_count,
-        'low': low_count
-    }
+    return task_trend(user, 'year')
 
 # Admin Reports View
 @login_required
@@ -4019,19 +3054,21 @@ def admin_reports(request):
     # Get basic stats for reports
     total_accounts = Account.objects.count()
     total_contacts = Contact.objects.count()
-    total_deals = Deal.objects.count()
     total_revenue = Transaction.objects.filter(transaction_type='income').aggregate(Sum('amount'))
     revenue = total_revenue['amount__sum'] if total_revenue['amount__sum'] else 0
     
-    # Deal stage distribution
+    # Deal stage distribution (one GROUP BY over the daily deal rollup)
+    stage_totals = dict(
+        DailyDealStats.objects.order_by().values('stage').annotate(total=Sum('deal_count')).values_list('stage', 'total')
+    )
     deal_stages = {}
     for stage_id, stage_name in DEAL_STAGE_CHOICES:
-        stage_count = Deal.objects.filter(stage=stage_id).count()
-        deal_stages[stage_name] = stage_count
+        deal_stages[stage_name] = stage_totals.get(stage_id) or 0
+    total_deals = sum(total or 0 for total in stage_totals.values())
     
     # Create sample data for report
     total_sales = revenue
-    deals_closed = Deal.objects.filter(stage='closed_won').count()
+    deals_closed = stage_totals.get('closed_won') or 0
     avg_deal_size = revenue / deals_closed if deals_closed > 0 else 0
     new_customers = Account.objects.filter(created_at__gte=timezone.now() - timedelta(days=30)).count()
     
@@ -4418,74 +3455,7 @@ def admin_product_edit(request, product_id):
 @login_required
 @user_passes_test(is_admin)
 def admin_product_import(request):
-    if request.method == 'POST' and request.FILES.get('import_file'):
-        csv_file = request.FILES['import_file']
-        
-        # Check if file is CSV
-        if not csv_file.name.endswith('.csv'):
-            messages.error(request, 'Please upload a CSV file')
-            return redirect('admin_products')
-        
-        try:
-            # Check if file is too large
-            if csv_file.size > 1048576:  # 1 MB
-                messages.error(request, 'The uploaded file is too large')
-                return redirect('admin_products')
-            
-            # Process CSV file
-            decoded_file = csv_file.read().decode('utf-8').splitlines()
-            reader = csv.reader(decoded_file)
-            
-            # Skip header row if specified
-            header_row = request.POST.get('header_row') == 'on'
-            if header_row:
-                next(reader)  # Skip the header row
-            
-            # Process rows
-            products_created = 0
-            for row in reader:
-                if len(row) < 2:  # Must have at least name and price
-                    continue
-                
-                name = row[0].strip()
-                price = 0
-                try:
-                    price = float(row[3].strip()) if len(row) > 3 and row[3].strip() else 0
-                except ValueError:
-                    price = 0
-                
-                if not name or price <= 0:  # Skip if name is empty or price is invalid
-                    continue
-                
-                # Create product with available data
-                product = Product(
-                    name=name,
-                    sku=row[2].strip() if len(row) > 2 else '',
-                    price=price,
-                    stock_quantity=int(row[4]) if len(row) > 4 and row[4].strip() else 0,
-                    description=row[5].strip() if len(row) > 5 else '',
-                    low_stock_threshold=int(row[6]) if len(row) > 6 and row[6].strip() else 10,
-                    created_by=request.user
-                )
-                
-                # Set category if provided
-                if len(row) > 1 and row[1].strip():
-                    try:
-                        category_id = int(row[1].strip())
-                        product.category = ProductCategory.objects.get(id=category_id)
-                    except Exception:
-                        pass
-                
-                product.save()
-                products_created += 1
-            
-            messages.success(request, f'Successfully imported {products_created} products')
-        except Exception as e:
-            messages.error(request, f'Error importing products: {str(e)}')
-        
-        return redirect('admin_products')
-    
-    return redirect('admin_products')
+    return run_csv_import(request, 'products', 'admin_products')
 
 @login_required
 @user_passes_test(is_admin)
@@ -4634,84 +3604,7 @@ def admin_transaction_edit(request, transaction_id):
 @login_required
 @user_passes_test(is_admin)
 def admin_transaction_import(request):
-    if request.method == 'POST' and request.FILES.get('import_file'):
-        csv_file = request.FILES['import_file']
-        
-        # Check if file is CSV
-        if not csv_file.name.endswith('.csv'):
-            messages.error(request, 'Please upload a CSV file')
-            return redirect('admin_transactions')
-        
-        try:
-            # Check if file is too large
-            if csv_file.size > 1048576:  # 1 MB
-                messages.error(request, 'The uploaded file is too large')
-                return redirect('admin_transactions')
-            
-            # Process CSV file
-            decoded_file = csv_file.read().decode('utf-8').splitlines()
-            reader = csv.reader(decoded_file)
-            
-            # Skip header row if specified
-            header_row = request.POST.get('header_row') == 'on'
-            if header_row:
-                next(reader)  # Skip the header row
-            
-            # Process rows
-            transactions_created = 0
-            for row in reader:
-                if len(row) < 3:  # Must have at least type, amount, and date
-                    continue
-                
-                transaction_type = row[0].strip()
-                amount = 0
-                try:
-                    amount = float(row[1].strip()) if row[1].strip() else 0
-                except ValueError:
-                    amount = 0
-                
-                date = row[2].strip()
-                
-                if not transaction_type or amount <= 0 or not date:  # Skip if essential data is missing
-                    continue
-                
-                # Create transaction with available data
-                transaction = Transaction(
-                    transaction_type=transaction_type,
-                    amount=amount,
-                    date=date,
-                    status=row[3].strip() if len(row) > 3 else 'completed',
-                    description=row[6].strip() if len(row) > 6 else '',
-                    category=row[7].strip() if len(row) > 7 else '',
-                    created_by=request.user
-                )
-                
-                # Set account if provided
-                if len(row) > 4 and row[4].strip():
-                    try:
-                        account_id = int(row[4].strip())
-                        transaction.account = Account.objects.get(id=account_id)
-                    except Exception:
-                        pass
-                
-                # Set deal if provided
-                if len(row) > 5 and row[5].strip():
-                    try:
-                        deal_id = int(row[5].strip())
-                        transaction.deal = Deal.objects.get(id=deal_id)
-                    except Exception:
-                        pass
-                
-                transaction.save()
-                transactions_created += 1
-            
-            messages.success(request, f'Successfully imported {transactions_created} transactions')
-        except Exception as e:
-            messages.error(request, f'Error importing transactions: {str(e)}')
-        
-        return redirect('admin_transactions')
-    
-    return redirect('admin_transactions')
+    return run_csv_import(request, 'transactions', 'admin_transactions')
 
 @login_required
 @user_passes_test(is_admin)
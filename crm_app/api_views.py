@@ -139,7 +139,7 @@ def get_users_by_manager(request):
         # Check if user is manager - return all users where manager_username = current_username
         elif current_user_role == 'manager':
             users = User.objects.filter(
-                profile__manager_username=current_user.username
+                profile__manager_id=current_user.id
             ).order_by('first_name', 'last_name')
         # Otherwise, return users with the same manager
         elif current_user_manager:
@@ -0,0 +1,284 @@
+"""
+Typeahead lookups for the related-item pickers.
+
+admin_tasks used to embed every lead, contact, account and deal in the page
+so the "Related To" dropdown could be filled client-side. Instead each web
+process keeps one PrefixIndex per entity: a sorted list of (key, pk) pairs,
+where the keys are the normalized display text starting at each word
+("john smith acme", "smith acme", "acme"). A prefix lookup is a bisect plus
+a forward scan, so matches come back in alphabetical order without touching
+the database.
+
+Visibility is not stored in the index. Candidate pks are checked against
+visible_to() in batches (one pk IN (...) query per batch), which also drops
+rows deleted by another process. A user who can see few of the rows may
+find too few of them among the capped candidates; the rest of their matches
+then come from one query on visible_to() itself (at most MAX_FALLBACK_ROWS
+rows), checked against the same keys.
+
+Freshness:
+    - signals.py applies saves and deletes made in this process right away;
+    - rows changed elsewhere (other workers, bulk_create, QuerySet.update
+      callers that set updated_at) are picked up by a delta load on
+      updated_at at most AUTOCOMPLETE_REFRESH_SECONDS later;
+    - the whole index is rebuilt every AUTOCOMPLETE_REBUILD_SECONDS, which
+      prunes rows deleted elsewhere. The new entries are loaded without
+      holding the index lock and swapped in, so lookups keep using the old
+      ones meanwhile; only the first build of an index makes callers wait.
+"""
+import bisect
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .exports import iter_batches
+from .models import Account, Contact, Deal, Lead
+from .search import word_tokens
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+# Keys longer than this are cut; a prefix that long is unique enough
+MAX_KEY_LENGTH = 64
+# Candidates checked against visible_to() per query, and queries per lookup
+CANDIDATE_BATCH = 500
+MAX_CANDIDATE_BATCHES = 4
+# Rows read by the visible_to() fallback query; past this its matches are
+# the first ones by pk rather than by key
+MAX_FALLBACK_ROWS = 2000
+# Slack on the delta load watermark, for rows committed while it ran
+REFRESH_OVERLAP = timedelta(seconds=5)
+
+
+class AutocompleteSpec:
+    """Which columns of a model are matched and how its options are labelled"""
+
+    def __init__(self, model, fields, search_fields, label):
+        self.model = model
+        self.fields = fields
+        self.search_fields = search_fields
+        self.label = label
+
+
+def person_label(row):
+    return f"{row['first_name']} {row['last_name']} ({row['email']})"
+
+
+SPECS = {
+    'lead': AutocompleteSpec(
+        Lead, ('first_name', 'last_name', 'email'), ('first_name', 'last_name', 'email'), person_label,
+    ),
+    'contact': AutocompleteSpec(
+        Contact, ('first_name', 'last_name', 'email'), ('first_name', 'last_name', 'email'), person_label,
+    ),
+    'account': AutocompleteSpec(
+        Account, ('name', 'website'), ('name', 'website'),
+        lambda row: f"{row['name']} ({row['website'] or 'No website'})",
+    ),
+    'deal': AutocompleteSpec(
+        Deal, ('name', 'amount'), ('name',),
+        lambda row: f"{row['name']} (${row['amount']})",
+    ),
+}
+MODEL_ENTITIES = {spec.model: entity for entity, spec in SPECS.items()}
+
+
+def prefix_key(text):
+    """Normalized form used for both keys and queries: words joined by single spaces"""
+    return ' '.join(word_tokens(text))[:MAX_KEY_LENGTH]
+
+
+class PrefixIndex:
+    """Sorted (key, pk) entries for one entity, plus each pk's label and keys"""
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.lock = threading.RLock()
+        # Held while loading from the database, so only one thread loads at a time
+        self.load_lock = threading.Lock()
+        self.entries = []
+        self.rows = {}
+        self.built_at = None
+        self.refreshed_at = None
+        self.synced_at = None
+
+    def keys(self, row):
+        words = word_tokens(' '.join(str(row[field] or '') for field in self.spec.search_fields))
+        return {' '.join(words[i:])[:MAX_KEY_LENGTH] for i in range(len(words))}
+
+    def is_stale(self):
+        now = time.monotonic()
+        return (self.built_at is None
+                or now - self.built_at > getattr(settings, 'AUTOCOMPLETE_REBUILD_SECONDS', 3600)
+                or now - self.refreshed_at > getattr(settings, 'AUTOCOMPLETE_REFRESH_SECONDS', 30))
+
+    def ensure_fresh(self):
+        if not self.is_stale():
+            return
+        # Until the first build there is nothing to serve, so wait for it; after
+        # that, a thread that finds another one loading goes on with the old entries
+        if not self.load_lock.acquire(blocking=self.built_at is None):
+            return
+        try:
+            now = time.monotonic()
+            if self.built_at is None or now - self.built_at > getattr(settings, 'AUTOCOMPLETE_REBUILD_SECONDS', 3600):
+                self.build()
+            elif now - self.refreshed_at > getattr(settings, 'AUTOCOMPLETE_REFRESH_SECONDS', 30):
+                self.refresh()
+        finally:
+            self.load_lock.release()
+
+    def load(self, queryset):
+        lookups = ('pk',) + self.spec.fields
+        for batch in iter_batches(queryset, lookups):
+            for values in batch:
+                yield values[0], dict(zip(self.spec.fields, values[1:]))
+
+    def build(self):
+        """Load every row and sort once, then swap the result in"""
+        synced_at = timezone.now()
+        entries, rows = [], {}
+        for pk, row in self.load(self.spec.model._base_manager.all()):
+            keys = self.keys(row)
+            rows[pk] = (self.spec.label(row), keys)
+            entries.extend((key, pk) for key in keys)
+        entries.sort()
+        # Saves applied to the old entries meanwhile come back with the next
+        # delta load, which starts from synced_at
+        with self.lock:
+            self.entries, self.rows = entries, rows
+            self.built_at = self.refreshed_at = time.monotonic()
+            self.synced_at = synced_at
+
+    def refresh(self):
+        """Apply rows whose updated_at moved since the last load"""
+        synced_at = timezone.now()
+        queryset = self.spec.model._base_manager.filter(updated_at__gte=self.synced_at - REFRESH_OVERLAP)
+        for pk, row in self.load(queryset):
+            self.put(pk, row)
+        self.refreshed_at = time.monotonic()
+        self.synced_at = synced_at
+
+    def put(self, pk, row):
+        with self.lock:
+            self.remove(pk)
+            keys = self.keys(row)
+            self.rows[pk] = (self.spec.label(row), keys)
+            for key in keys:
+                bisect.insort(self.entries, (key, pk))
+
+    def remove(self, pk):
+        with self.lock:
+            _label, keys = self.rows.pop(pk, (None, ()))
+            for key in keys:
+                i = bisect.bisect_left(self.entries, (key, pk))
+                if i < len(self.entries) and self.entries[i] == (key, pk):
+                    del self.entries[i]
+
+    def scan(self, prefix, after=None, count=CANDIDATE_BATCH):
+        """
+        Up to count (pk, label) pairs whose keys start with prefix, in key
+        order, resuming after the entry returned as the cursor. The cursor is
+        None once the matches are exhausted.
+        """
+        matches, entry = [], None
+        with self.lock:
+            entries = self.entries
+            i = bisect.bisect_left(entries, (prefix,)) if after is None else bisect.bisect_right(entries, after)
+            while i < len(entries) and len(matches) < count:
+                entry = entries[i]
+                if not entry[0].startswith(prefix):
+                    return matches, None
+                row = self.rows.get(entry[1])
+                if row:
+                    matches.append((entry[1], row[0]))
+                i += 1
+            return matches, entry if i < len(entries) else None
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(entity):
+    with _indexes_lock:
+        index = _indexes.get(entity)
+        if index is None:
+            index = _indexes[entity] = PrefixIndex(SPECS[entity])
+    index.ensure_fresh()
+    return index
+
+
+def lookup(user, entity, prefix, limit=DEFAULT_LIMIT):
+    """Top matches visible to user as [{'id', 'name'}], in alphabetical order"""
+    prefix = prefix_key(prefix)
+    if not prefix:
+        return []
+    index = get_index(entity)
+    visible = SPECS[entity].model.objects.visible_to(user)
+
+    results, seen, cursor = [], set(), None
+    for _batch in range(MAX_CANDIDATE_BATCHES):
+        matches, cursor = index.scan(prefix, cursor, CANDIDATE_BATCH)
+        # A row matches once per key that starts with the prefix
+        unseen = []
+        for pk, label in matches:
+            if pk not in seen:
+                seen.add(pk)
+                unseen.append((pk, label))
+        matches = unseen
+        if matches:
+            allowed = set(visible.filter(pk__in=[pk for pk, _label in matches]).values_list('pk', flat=True))
+            results.extend({'id': pk, 'name': label} for pk, label in matches if pk in allowed)
+        if len(results) >= limit or cursor is None:
+            break
+    if len(results) < limit and cursor is not None:
+        # The candidate cap ran out before enough visible rows turned up
+        results.extend(visible_matches(index, visible, prefix, seen, limit - len(results)))
+    return results[:limit]
+
+
+def visible_matches(index, visible, prefix, skip, limit):
+    """
+    Up to limit matches read from the visible queryset itself, in key order,
+    leaving out the pks in skip. The first word narrows the query; the keys
+    decide, as in the index. At most MAX_FALLBACK_ROWS rows are read, so a
+    common word costs one bounded query.
+    """
+    spec = index.spec
+    word = prefix.split(' ')[0]
+    condition = Q()
+    for field in spec.search_fields:
+        condition |= Q(**{f'{field}__icontains': word})
+    rows = (visible.filter(condition).exclude(pk__in=skip)
+            .order_by('pk').values_list('pk', *spec.fields)[:MAX_FALLBACK_ROWS])
+    found = []
+    for values in rows:
+        pk, row = values[0], dict(zip(spec.fields, values[1:]))
+        keys = sorted(key for key in index.keys(row) if key.startswith(prefix))
+        if keys:
+            found.append((keys[0], pk, spec.label(row)))
+    found.sort()
+    return [{'id': pk, 'name': label} for _key, pk, label in found[:limit]]
+
+
+def object_saved(model, instance):
+    """Update this process's index for a saved row, if the index is loaded"""
+    index = _indexes.get(MODEL_ENTITIES[model])
+    if index is not None and index.built_at is not None:
+        index.put(instance.pk, {field: getattr(instance, field) for field in index.spec.fields})
+
+
+def object_deleted(model, pk):
+    index = _indexes.get(MODEL_ENTITIES[model])
+    if index is not None:
+        index.remove(pk)
+
+
+def reset():
+    """Forget every loaded index (tests)"""
+    with _indexes_lock:
+        _indexes.clear()
@@ -0,0 +1,169 @@
+"""
+Bulk field updates for leads, tasks and deals (PATCH /api/<entity>/bulk/).
+
+Reassigning a rep's book used to take one PATCH per record, each with a
+full serializer pass and its own visibility query. apply() takes
+
+    {"ids": [1, 2, 3]} and/or {"filter": {"assigned_to": 7, "lead_status": "new"}}
+    plus {"patch": {"assigned_to": 9}}
+
+and makes one query for the matching rows the user can see, then writes
+the patch with one QuerySet.update. Only the fields in BulkEditSpec.fields
+can be patched or filtered on. Each patch value goes through the model
+field's clean(), so choices and foreign keys are checked like a form would.
+
+QuerySet.update skips save() and the signals, so this module sets
+updated_at (autocomplete.py and export_columnar load deltas by it),
+rebuilds the rollup days of the touched rows, reindexes leads for search
+and logs one activity row per record, written together.
+"""
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Deal, Lead, Task
+from .rollups import ROLLUPS, local_day, rebuild_days
+from .utils import log_user_activities
+from . import search
+
+
+class BulkEditError(Exception):
+    """The request can't be applied; the message is shown to the client"""
+
+
+class BulkEditSpec:
+    """Which columns of a model a bulk edit may set (fields) and select on (filters)"""
+
+    def __init__(self, model, fields, filters, forbidden=None):
+        self.model = model
+        self.fields = fields
+        self.filters = filters
+        # {field: {value: reason}} for values that need their own endpoint
+        self.forbidden = forbidden or {}
+
+
+SPECS = {
+    'leads': BulkEditSpec(
+        Lead, fields=('assigned_to', 'lead_status'),
+        filters=('assigned_to', 'created_by', 'lead_status', 'lead_source', 'manager_username'),
+        forbidden={'lead_status': {'converted': 'Use /api/leads/bulk_convert/ to convert leads'}},
+    ),
+    'tasks': BulkEditSpec(
+        Task, fields=('assigned_to', 'status', 'priority'),
+        filters=('assigned_to', 'created_by', 'status', 'priority', 'related_lead',
+                 'related_contact', 'related_account', 'related_deal'),
+    ),
+    'deals': BulkEditSpec(
+        Deal, fields=('assigned_to', 'stage'),
+        filters=('assigned_to', 'created_by', 'stage', 'account'),
+    ),
+}
+MODEL_ENTITIES = {spec.model: entity for entity, spec in SPECS.items()}
+
+
+def max_rows():
+    return getattr(settings, 'BULK_EDIT_MAX_ROWS', 5000)
+
+
+def clean_patch(spec, patch):
+    """{attname: value} ready for QuerySet.update, or BulkEditError"""
+    if not isinstance(patch, dict) or not patch:
+        raise BulkEditError('"patch" must name at least one field')
+    unknown = sorted(set(patch) - set(spec.fields))
+    if unknown:
+        raise BulkEditError(f"Can't bulk edit {', '.join(unknown)}; allowed: {', '.join(spec.fields)}")
+    cleaned = {}
+    for name, value in patch.items():
+        field = spec.model._meta.get_field(name)
+        if value == '' and field.null:
+            value = None
+        try:
+            value = field.clean(value, None)
+        except ValidationError as error:
+            raise BulkEditError(f"{name}: {' '.join(error.messages)}")
+        reason = spec.forbidden.get(name, {}).get(value)
+        if reason:
+            raise BulkEditError(reason)
+        cleaned[field.attname] = value
+    return cleaned
+
+
+def selection(spec, user, ids=None, filters=None):
+    """The rows of spec.model visible to user that the request selects"""
+    if ids is None and not filters:
+        raise BulkEditError('Send "ids" or a non-empty "filter"')
+    queryset = spec.model.objects.visible_to(user)
+    if ids is not None:
+        if not isinstance(ids, list) or not all(str(pk).isdigit() for pk in ids):
+            raise BulkEditError('"ids" must be a list of record ids')
+        queryset = queryset.filter(pk__in=[int(pk) for pk in ids])
+    if filters:
+        if not isinstance(filters, dict):
+            raise BulkEditError('"filter" must be an object')
+        unknown = sorted(set(filters) - set(spec.filters))
+        if unknown:
+            raise BulkEditError(f"Can't filter on {', '.join(unknown)}; allowed: {', '.join(spec.filters)}")
+        for name, value in filters.items():
+            field = spec.model._meta.get_field(name)
+            # {"assigned_to": null} selects the unassigned rows
+            try:
+                if value not in (None, ''):
+                    value = field.target_field.to_python(value) if field.is_relation else field.to_python(value)
+                else:
+                    value = None
+            except ValidationError as error:
+                raise BulkEditError(f"filter {name}: {' '.join(error.messages)}")
+            queryset = queryset.filter(**{field.attname: value})
+    return queryset
+
+
+def apply(user, entity, data):
+    """
+    Apply data['patch'] to the selected rows. Returns {'updated': n, 'ids':
+    [...]} and, for an id list, 'missing': the ids that don't exist or that
+    user can't see.
+    """
+    spec = SPECS[entity]
+    model = spec.model
+    patch = clean_patch(spec, data.get('patch'))
+    queryset = selection(spec, user, data.get('ids'), data.get('filter'))
+    date_fields = ROLLUPS[model].date_fields
+
+    with transaction.atomic():
+        rows = list(queryset.order_by('pk').values_list('pk', *date_fields)[:max_rows() + 1])
+        if len(rows) > max_rows():
+            raise BulkEditError(f'More than {max_rows()} records match; narrow the filter')
+        ids = [row[0] for row in rows]
+        now = timezone.now()
+        changes = dict(patch, updated_at=now)
+        if model is Task and patch.get('status') == 'completed':
+            # Like mark_complete, but keep the date of tasks already completed
+            changes['completed_date'] = Coalesce(F('completed_date'), Value(now))
+        updated = model.objects.filter(pk__in=ids).update(**changes) if ids else 0
+
+        # What the signals would have done
+        days = {local_day(value) for row in rows for value in row[1:]}
+        if 'completed_date' in changes:
+            days.add(local_day(now))
+        rebuild_days(model, days)
+        if model in search.INDEXES and ids:
+            search.index_queryset(model.objects.filter(pk__in=ids))
+
+    result = {'updated': updated, 'ids': ids}
+    if data.get('ids') is not None:
+        found = set(ids)
+        result['missing'] = [int(pk) for pk in data['ids'] if int(pk) not in found]
+    if ids:
+        described = ', '.join(f'{name}={value}' for name, value in patch.items())
+        log_user_activities(
+            user=user,
+            action_type='update',
+            action_detail=f'Bulk updated {model.__name__.lower()}: {described}'[:255],
+            model_affected=model.__name__,
+            object_ids=ids,
+            additional_data={'patch': patch, 'records': len(ids)},
+        )
+    return result
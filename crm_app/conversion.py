@@ -0,0 +1,227 @@
+"""
+Bulk lead conversion.
+
+LeadViewSet.convert builds an Account, a Contact and optionally a Deal for
+one lead through three serializer round trips. convert_leads() does the
+same for a whole selection in one transaction:
+
+    1. one query loads (and locks) the selected leads the user can see,
+       one more the existing accounts they should join;
+    2. every account, contact and deal is built in memory and checked
+       with clean_fields(); a lead that fails is reported and skipped;
+    3. accounts, contacts, deals and the deal-contact links are written
+       with one bulk_create each, and the leads with one bulk_update.
+
+bulk_create skips save() and the signals, so this module sets both
+manager columns itself and rebuilds the rollups and search entries for
+the rows it wrote. Either every valid lead is converted or, on a database
+error, none is.
+"""
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import Account, Contact, Deal, Lead
+from .rollups import local_day, rebuild_days
+from .utils import log_user_activity
+from . import search
+
+MAX_BULK_CONVERT = 500
+
+
+class ConcurrentInsert(Exception):
+    """Rows written by someone else got between a bulk insert and its read-back"""
+
+
+def bulk_insert(model, objects, user, label):
+    """
+    bulk_create that leaves a primary key on every object, also on backends
+    (MySQL) that don't return them. There the new rows are read back by
+    creator and pk order, and label(obj) must match row for row.
+    """
+    if not objects:
+        return
+    if connection.features.can_return_rows_from_bulk_insert:
+        model.objects.bulk_create(objects)
+        return
+    last_pk = model._base_manager.aggregate(last=Max('pk'))['last'] or 0
+    model.objects.bulk_create(objects)
+    rows = list(model._base_manager.filter(pk__gt=last_pk, created_by=user).order_by('pk')
+                .values_list('pk', *label.fields))
+    if len(rows) != len(objects) or any(tuple(row[1:]) != label(obj) for row, obj in zip(rows, objects)):
+        raise ConcurrentInsert(model.__name__)
+    for row, obj in zip(rows, objects):
+        obj.pk = row[0]
+
+
+class Label:
+    """The columns that identify a freshly inserted row in bulk_insert's read-back"""
+
+    def __init__(self, *fields):
+        self.fields = fields
+
+    def __call__(self, obj):
+        return tuple(getattr(obj, field) for field in self.fields)
+
+
+def company_name(lead):
+    return (lead.company or f"{lead.first_name} {lead.last_name}'s Company")[:200]
+
+
+def build_account(lead, user):
+    return Account(
+        name=company_name(lead), phone=lead.phone, email=lead.email, website=lead.website,
+        industry_id=lead.industry_id, annual_revenue=lead.annual_revenue, employees=lead.employees,
+        description=lead.description, billing_address=lead.address, assigned_to_id=lead.assigned_to_id,
+        manager_username=lead.manager_username, manager_id=lead.manager_id,
+        created_by=user, converted_by=user,
+    )
+
+
+def build_contact(lead, user):
+    return Contact(
+        salutation=lead.salutation, first_name=lead.first_name, last_name=lead.last_name,
+        email=lead.email, phone=lead.phone, mobile=lead.mobile, job_title=lead.title,
+        mailing_address=lead.address, description=lead.description, assigned_to_id=lead.assigned_to_id,
+        manager_username=lead.manager_username, manager_id=lead.manager_id, created_by=user,
+    )
+
+
+def build_deal(lead, user, options):
+    try:
+        amount = Decimal(str(options.get('amount', 0)))
+        probability = int(options.get('probability', 10))
+    except (InvalidOperation, TypeError, ValueError):
+        raise ValidationError({'deal': ['amount and probability must be numbers']})
+    closing_date = options.get('closing_date') or timezone.localdate()
+    if not isinstance(closing_date, date):
+        closing_date = parse_date(str(closing_date))
+        if closing_date is None:
+            raise ValidationError({'closing_date': ['Enter a valid date (YYYY-MM-DD)']})
+    return Deal(
+        name=options.get('name') or f"Deal for {lead.first_name} {lead.last_name}",
+        amount=amount, closing_date=closing_date, stage=options.get('stage', 'qualification'),
+        probability=probability, description=options.get('description', ''),
+        assigned_to_id=lead.assigned_to_id, created_by=user,
+    )
+
+
+def describe(error):
+    if hasattr(error, 'message_dict'):
+        return '; '.join(f"{field}: {' '.join(messages)}" for field, messages in error.message_dict.items())
+    return ' '.join(error.messages)
+
+
+def convert_leads(user, items):
+    """
+    Convert leads in one transaction. items is a list of dicts:
+
+        {'id': <lead id>,
+         'account': {'id': <existing account id>},        optional
+         'deal': {'create_deal': true, 'name', 'amount',  optional
+                  'closing_date', 'stage', 'probability', 'description'}}
+
+    Returns one result per item, in order: {'id', 'status': 'converted',
+    'account', 'contact', 'deal'} or {'id', 'status': 'error', 'error'}.
+    """
+    results = [{'id': item.get('id')} for item in items]
+
+    def fail(result, message):
+        result.update(status='error', error=message)
+
+    with transaction.atomic():
+        lead_ids = [item.get('id') for item in items]
+        leads = Lead.objects.visible_to(user).select_for_update() \
+            .in_bulk([pk for pk in lead_ids if isinstance(pk, int)])
+        account_ids = {(item.get('account') or {}).get('id') for item in items} - {None}
+        accounts = Account.objects.visible_to(user).in_bulk(
+            [pk for pk in account_ids if isinstance(pk, int)]
+        )
+
+        # Build and validate everything before the first write
+        planned, seen = [], set()
+        for item, result in zip(items, results):
+            lead = leads.get(item.get('id'))
+            if lead is None:
+                fail(result, 'Lead not found')
+                continue
+            if lead.lead_status == 'converted' or lead.pk in seen:
+                fail(result, 'Lead is already converted')
+                continue
+            seen.add(lead.pk)
+
+            account_id = (item.get('account') or {}).get('id')
+            try:
+                if account_id is None:
+                    account, new_account = build_account(lead, user), True
+                    account.clean_fields(exclude=['industry', 'assigned_to', 'created_by', 'converted_by', 'manager'])
+                elif account_id in accounts:
+                    account, new_account = accounts[account_id], False
+                else:
+                    fail(result, 'Account not found')
+                    continue
+                contact = build_contact(lead, user)
+                contact.clean_fields(exclude=['account', 'assigned_to', 'created_by', 'manager'])
+                deal = None
+                if (item.get('deal') or {}).get('create_deal'):
+                    deal = build_deal(lead, user, item['deal'])
+                    deal.clean_fields(exclude=['account', 'assigned_to', 'created_by'])
+            except ValidationError as error:
+                fail(result, describe(error))
+                continue
+            planned.append((result, lead, account, new_account, contact, deal))
+
+        # One INSERT per table, then one UPDATE for the leads
+        new_accounts = [account for _r, _l, account, new_account, _c, _d in planned if new_account]
+        bulk_insert(Account, new_accounts, user, Label('name', 'email'))
+        contacts = []
+        for _result, _lead, account, _new, contact, _deal in planned:
+            contact.account = account
+            contacts.append(contact)
+        bulk_insert(Contact, contacts, user, Label('account_id', 'first_name', 'last_name'))
+        deals = []
+        for _result, _lead, account, _new, _contact, deal in planned:
+            if deal is not None:
+                deal.account = account
+                deals.append(deal)
+        bulk_insert(Deal, deals, user, Label('account_id', 'name'))
+        Deal.contacts.through.objects.bulk_create([
+            Deal.contacts.through(deal_id=deal.pk, contact_id=contact.pk)
+            for _r, _l, _a, _n, contact, deal in planned if deal is not None
+        ])
+
+        now = timezone.now()
+        converted = []
+        for result, lead, account, _new, contact, deal in planned:
+            lead.lead_status = 'converted'
+            lead.converted_account = account
+            lead.converted_contact = contact
+            lead.updated_at = now
+            converted.append(lead)
+            result.update(status='converted', account=account.pk, contact=contact.pk,
+                          deal=deal.pk if deal else None)
+        Lead.objects.bulk_update(converted, ['lead_status', 'converted_account', 'converted_contact', 'updated_at'])
+
+        # What the signals would have done
+        if converted:
+            rebuild_days(Lead, {local_day(lead.created_at) for lead in converted})
+        if deals:
+            rebuild_days(Deal, {local_day(deal.created_at) for deal in deals})
+        search.index_objects(Account, new_accounts)
+        search.index_objects(Contact, contacts)
+
+    if converted:
+        log_user_activity(
+            user=user,
+            action_type='update',
+            action_detail=f"Converted {len(converted)} leads",
+            model_affected='Lead',
+            object_id=None,
+            additional_data={'lead_ids': [lead.pk for lead in converted]},
+        )
+    return results
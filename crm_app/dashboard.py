@@ -0,0 +1,160 @@
+"""
+KPI queries for the admin dashboard.
+
+Every KPI group is a single aggregate() with filtered Count/Sum
+expressions, so the dashboard costs a fixed handful of queries however
+many leads and deals there are. The historical charts (monthly revenue,
+lead sources) read the daily rollup tables instead of the raw rows.
+"""
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db.models import Count, Sum, Q
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .hierarchy import ManagerHierarchy
+from .models import Lead, Deal, DailyLeadStats, DailyDealStats, is_manager_user
+
+# Lead source keys in the order the pie chart shows them. Old rows still
+# carry the pre-split 'website' value, which is counted as 'website_demo'.
+LEAD_SOURCE_CHART = [
+    ('website_demo', 'Website - {Demo}'),
+    ('website_live', 'Website - {live}'),
+    ('phone', 'Phone'),
+    ('referral', 'Referral'),
+    ('email', 'Email'),
+    ('social_media', 'Social Media'),
+    ('trade_show', 'Trade Show'),
+    ('email_campaign', 'Email Campaign'),
+    ('cold_call', 'Cold Call'),
+    ('event', 'Event'),
+    ('other', 'Other'),
+]
+LEAD_SOURCE_ALIASES = {'website': 'website_demo'}
+
+
+def dashboard_scope(user):
+    """
+    Return (user_ids, leads, deals) the dashboard KPIs are computed over.
+
+    user_ids is None for admins (all users); managers get themselves plus
+    their subordinates, with leads/deals narrowed the same way.
+    """
+    leads = Lead.objects.all()
+    deals = Deal.objects.all()
+    if not is_manager_user(user):
+        return None, leads, deals
+
+    managed_user_ids = ManagerHierarchy.subordinate_ids(user)
+    leads = leads.filter(
+        Q(manager_id=user.id) |
+        Q(assigned_to_id__in=managed_user_ids) |
+        Q(created_by_id=user.id)
+    )
+    deals = deals.filter(
+        Q(assigned_to_id__in=managed_user_ids) |
+        Q(created_by_id=user.id)
+    )
+    return managed_user_ids + [user.id], leads, deals
+
+
+def user_kpis(user_ids, since):
+    """Total and recently joined users in one query"""
+    users = User.objects.all()
+    if user_ids is not None:
+        users = users.filter(id__in=user_ids)
+    return users.aggregate(
+        total=Count('id'),
+        new=Count('id', filter=Q(date_joined__gte=since)),
+    )
+
+
+def lead_kpis(leads, since):
+    """Total and recent leads in one query"""
+    return leads.aggregate(
+        total=Count('id'),
+        new=Count('id', filter=Q(created_at__gte=since)),
+    )
+
+
+def deal_kpis(deals, since, previous_since):
+    """
+    Deal counts plus closed-won revenue in one query.
+
+    last_month_revenue covers deals created in [previous_since, since).
+    """
+    won = Q(stage='closed_won')
+    totals = deals.aggregate(
+        total=Count('id'),
+        new=Count('id', filter=Q(created_at__gte=since)),
+        revenue=Sum('amount', filter=won),
+        last_month_revenue=Sum('amount', filter=won & Q(created_at__gte=previous_since, created_at__lt=since)),
+    )
+    totals['revenue'] = totals['revenue'] or 0
+    totals['last_month_revenue'] = totals['last_month_revenue'] or 0
+    return totals
+
+
+def monthly_revenue(deal_stats, year):
+    """
+    Closed-won revenue and deal count per month of `year`, read from a
+    DailyDealStats queryset.
+
+    Returns two 12-item lists (revenue as floats so they can go to JSON).
+    """
+    rows = (
+        deal_stats.filter(stage='closed_won', day__year=year)
+        .order_by()
+        .annotate(month=TruncMonth('day'))
+        .values('month')
+        .annotate(revenue=Sum('amount'), count=Sum('deal_count'))
+        .values_list('month', 'revenue', 'count')
+    )
+    revenue = [0] * 12
+    counts = [0] * 12
+    for month, month_revenue, month_count in rows:
+        revenue[month.month - 1] += float(month_revenue or 0)
+        counts[month.month - 1] += month_count or 0
+    return revenue, counts
+
+
+def lead_source_counts(lead_stats):
+    """Lead count per chart source key from a DailyLeadStats queryset (one GROUP BY)"""
+    counts = {key: 0 for key, _label in LEAD_SOURCE_CHART}
+    rows = lead_stats.order_by().values('lead_source').annotate(total=Sum('lead_count')).values_list('lead_source', 'total')
+    for source, total in rows:
+        key = LEAD_SOURCE_ALIASES.get(source, source)
+        if key in counts:
+            counts[key] += total or 0
+    return counts
+
+
+def dashboard_metrics(user, now=None):
+    """Every KPI the admin dashboard shows, scoped to `user`"""
+    now = now or timezone.now()
+    since = now - timedelta(days=30)
+    previous_since = now - timedelta(days=60)
+    user_ids, leads, deals = dashboard_scope(user)
+
+    users = user_kpis(user_ids, since)
+    lead_totals = lead_kpis(leads, since)
+    deal_totals = deal_kpis(deals, since, previous_since)
+
+    # The charts are company-wide for every role and read the daily rollups
+    revenue_by_month, deals_by_month = monthly_revenue(DailyDealStats.objects.all(), timezone.localtime(now).year)
+    sources = lead_source_counts(DailyLeadStats.objects.all())
+
+    return {
+        'total_users': users['total'],
+        'new_users': users['new'],
+        'total_leads': lead_totals['total'],
+        'new_leads': lead_totals['new'],
+        'total_deals': deal_totals['total'],
+        'new_deals': deal_totals['new'],
+        'total_revenue': deal_totals['revenue'],
+        'revenue_increase': deal_totals['revenue'] - deal_totals['last_month_revenue'],
+        'monthly_revenue': revenue_by_month,
+        'monthly_deals': deals_by_month,
+        'lead_sources': sources,
+    }
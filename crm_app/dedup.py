@@ -0,0 +1,220 @@
+"""
+Lead deduplication.
+
+Every lead's identity is stored as LeadDedupKey rows, one per normalized
+email and phone number:
+
+    email:ann@example.com      lowercased, trimmed
+    phone:+919876543210        E.164; national numbers get
+                               LEAD_DEFAULT_CALLING_CODE
+
+The key column is unique, so finding the lead an incoming submission
+duplicates is one index lookup, and each key belongs to at most one lead
+(the first to claim it).
+
+With LEAD_INGEST_MODE = 'upsert', the lead ingestion paths (web form,
+API create, CSV import) merge a duplicate into the existing lead instead
+of inserting it. A merge only fills fields that are blank on the existing
+lead, and status is never touched. The owner (assigned_to and the
+manager pair) is only filled by the admin paths, the CSV import and
+`manage.py dedupe_leads`; a web form or API submission can't claim a
+lead that way. The API only merges into leads the requester can see and
+reports any other match as a conflict (DuplicateLead).
+
+signals.py keeps a lead's keys in step with its email/phone on save.
+Writes that skip signals call register_leads().
+"""
+import re
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Lead, LeadDedupKey
+
+# Lead columns a merge copies onto the surviving lead when it has no value
+MERGE_FIELDS = [
+    'salutation', 'company', 'title', 'email', 'phone', 'mobile', 'website', 'industry_id',
+    'annual_revenue', 'employees', 'description', 'address',
+]
+# Ownership columns; only the admin merges (CSV import, dedupe_leads) fill them
+OWNER_FIELDS = ['assigned_to_id', 'manager_username', 'manager_id']
+# Models whose related_lead moves to the surviving lead
+LEAD_CHILDREN = ('tasks', 'events', 'notes', 'documents')
+
+NATIONAL_DIGITS = 10
+MIN_E164_DIGITS = 8
+MAX_E164_DIGITS = 15
+
+
+def ingest_mode():
+    return getattr(settings, 'LEAD_INGEST_MODE', 'upsert')
+
+
+def normalize_email(email):
+    email = (email or '').strip().lower()
+    return email if '@' in email else None
+
+
+def normalize_phone(phone):
+    """E.164 form of a phone number ("+919876543210"), or None if it can't be one"""
+    phone = (phone or '').strip()
+    digits = re.sub(r'\D', '', phone)
+    if not phone.startswith('+'):
+        if digits.startswith('00'):
+            digits = digits[2:]
+        elif len(digits) == NATIONAL_DIGITS + 1 and digits.startswith('0'):
+            digits = getattr(settings, 'LEAD_DEFAULT_CALLING_CODE', '91') + digits[1:]
+        elif len(digits) == NATIONAL_DIGITS:
+            digits = getattr(settings, 'LEAD_DEFAULT_CALLING_CODE', '91') + digits
+    if not MIN_E164_DIGITS <= len(digits) <= MAX_E164_DIGITS:
+        return None
+    return '+' + digits
+
+
+def dedup_keys(email=None, phone=None, mobile=None):
+    keys = []
+    email = normalize_email(email)
+    if email:
+        keys.append(f'email:{email}')
+    for number in (phone, mobile):
+        number = normalize_phone(number)
+        if number and f'phone:{number}' not in keys:
+            keys.append(f'phone:{number}')
+    return keys
+
+
+def lead_keys(lead):
+    return dedup_keys(lead.email, lead.phone, lead.mobile)
+
+
+def key_owners(keys):
+    """{key: lead_id} for the keys that are already claimed"""
+    if not keys:
+        return {}
+    return dict(LeadDedupKey.objects.filter(key__in=keys).values_list('key', 'lead_id'))
+
+
+def find_duplicate(keys, candidates=None):
+    """
+    The existing lead owning any of keys, or None. With candidates (a Lead
+    queryset), a match outside it raises DuplicateLead.
+    """
+    owners = key_owners(keys)
+    for key in keys:
+        if key in owners:
+            lead = (Lead.objects.all() if candidates is None else candidates).filter(pk=owners[key]).first()
+            if lead is None and candidates is not None:
+                raise DuplicateLead()
+            return lead
+    return None
+
+
+def is_blank(value):
+    return value is None or value == ''
+
+
+def fill_blanks(lead, source, owner=False):
+    """
+    Copy MERGE_FIELDS that are blank on lead from source, plus the owner
+    (assigned_to and the manager pair) when owner is set; return the
+    changed fields
+    """
+    changed = []
+    for field in MERGE_FIELDS:
+        value = getattr(source, field)
+        if is_blank(getattr(lead, field)) and not is_blank(value):
+            setattr(lead, field, value)
+            changed.append(field)
+    if owner:
+        if is_blank(lead.assigned_to_id) and not is_blank(source.assigned_to_id):
+            lead.assigned_to_id = source.assigned_to_id
+            changed.append('assigned_to_id')
+        if is_blank(lead.manager_username) and not is_blank(source.manager_username):
+            lead.manager_username, lead.manager_id = source.manager_username, source.manager_id
+            changed += ['manager_username', 'manager_id']
+    return changed
+
+
+def register(lead):
+    """Bring one lead's keys in line with its current email and phones"""
+    keys = set(lead_keys(lead))
+    stored = set(LeadDedupKey.objects.filter(lead=lead).values_list('key', flat=True))
+    if keys == stored:
+        return
+    if stored - keys:
+        LeadDedupKey.objects.filter(lead=lead, key__in=stored - keys).delete()
+    # Keys owned by another lead stay with it (dedupe_leads merges the two)
+    LeadDedupKey.objects.bulk_create(
+        [LeadDedupKey(key=key, lead=lead) for key in keys - stored], ignore_conflicts=True,
+    )
+
+
+def register_leads(rows):
+    """Claim the unclaimed keys of (pk, email, phone, mobile) rows, earliest row first"""
+    LeadDedupKey.objects.bulk_create(
+        [
+            LeadDedupKey(key=key, lead_id=pk)
+            for pk, email, phone, mobile in rows
+            for key in dedup_keys(email, phone, mobile)
+        ],
+        batch_size=1000, ignore_conflicts=True,
+    )
+
+
+class LostRace(Exception):
+    """A concurrent request registered the same lead first"""
+
+
+class DuplicateLead(Exception):
+    """The submission duplicates a lead the requester can't see"""
+
+
+def ingest(serializer, user=None, **save_kwargs):
+    """
+    Save a validated LeadSerializer as a new lead, or in upsert mode merge it
+    into the lead it duplicates. Returns (lead, created). With user, only
+    leads visible to user are merged into; a match outside that scope
+    raises DuplicateLead.
+    """
+    if ingest_mode() != 'upsert':
+        return serializer.save(**save_kwargs), True
+
+    incoming = Lead(**{**serializer.validated_data, **save_kwargs})
+    keys = lead_keys(incoming)
+    candidates = None if user is None else Lead.objects.visible_to(user)
+    with transaction.atomic():
+        existing = find_duplicate(keys, candidates)
+        if existing is None:
+            try:
+                with transaction.atomic():
+                    lead = serializer.save(**save_kwargs)
+                    # The save registered our keys unless another request got there first
+                    if LeadDedupKey.objects.filter(key__in=keys).exclude(lead=lead).exists():
+                        raise LostRace()
+                return lead, True
+            except LostRace:
+                existing = find_duplicate(keys, candidates)
+        if fill_blanks(existing, incoming):
+            existing.save()
+        return existing, False
+
+
+def merge_leads(survivor, duplicates):
+    """Fold duplicates (oldest first) into survivor and delete them"""
+    with transaction.atomic():
+        changed = False
+        for duplicate in duplicates:
+            changed |= bool(fill_blanks(survivor, duplicate, owner=True))
+        duplicate_ids = [duplicate.pk for duplicate in duplicates]
+        now = timezone.now()
+        for relation in LEAD_CHILDREN:
+            related_model = Lead._meta.get_field(relation).related_model
+            related_model.objects.filter(related_lead_id__in=duplicate_ids) \
+                .update(related_lead=survivor, updated_at=now)
+        for duplicate in duplicates:
+            duplicate.delete()
+        if changed:
+            survivor.save()
+        else:
+            register(survivor)
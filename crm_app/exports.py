@@ -0,0 +1,257 @@
+"""
+Streaming CSV / XLSX exports.
+
+Rows are read as values_list tuples in primary-key batches (WHERE id > last
+ORDER BY id LIMIT n) rather than one big SELECT: MySQL drivers buffer a
+whole result set client-side, so a plain .iterator() would still hold
+every row in memory. Each batch is rendered and handed to the response
+before the next one is fetched, so memory stays flat whatever the table
+size.
+
+The XLSX writer is a minimal SpreadsheetML package (one sheet, inline
+strings, no styles) written through zipfile into the response stream.
+zipfile supports unseekable outputs, so no temporary file is needed.
+
+Exported text comes from web forms and imports, so a cell such as
+"=HYPERLINK(...)" or "+1 555 0100" could run as a formula when the file is
+opened in a spreadsheet. In the CSV, text cells starting with =, +, -, @,
+tab or carriage return get a leading apostrophe (spreadsheet_text). XLSX
+text is written unchanged as an inline string, which a spreadsheet never
+evaluates; an apostrophe there would just be part of the text.
+"""
+import csv
+import zipfile
+from datetime import date, datetime
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from django.utils import timezone
+
+from .models import Account, Contact, Deal, Lead, Task, Transaction
+
+# Rows fetched per query
+EXPORT_CHUNK_SIZE = 2000
+
+
+class ExportSpec:
+    """What one entity exports: (header, values_list lookup) pairs and a visibility scope"""
+
+    def __init__(self, model, columns, scope=None):
+        self.model = model
+        self.columns = columns
+        self.scope = scope
+
+    @property
+    def headers(self):
+        return [header for header, _lookup in self.columns]
+
+    def queryset(self, user):
+        if self.scope:
+            return self.scope(user)
+        return self.model.objects.visible_to(user)
+
+
+def visible_transactions(user):
+    """Transactions have no owner columns: they follow their account's visibility"""
+    if user.is_staff or user.is_superuser:
+        return Transaction.objects.all()
+    return Transaction.objects.filter(account__in=Account.objects.visible_to(user).values('id'))
+
+
+EXPORTS = {
+    'leads': ExportSpec(Lead, [
+        ('id', 'id'), ('first_name', 'first_name'), ('last_name', 'last_name'), ('email', 'email'),
+        ('phone', 'phone'), ('mobile', 'mobile'), ('company', 'company'), ('title', 'title'),
+        ('lead_source', 'lead_source'), ('lead_status', 'lead_status'), ('industry', 'industry__name'),
+        ('website', 'website'), ('annual_revenue', 'annual_revenue'), ('employees', 'employees'),
+        ('assigned_to', 'assigned_to__username'), ('created_by', 'created_by__username'),
+        ('manager', 'manager_username'), ('created_at', 'created_at'), ('updated_at', 'updated_at'),
+    ]),
+    'contacts': ExportSpec(Contact, [
+        ('id', 'id'), ('first_name', 'first_name'), ('last_name', 'last_name'), ('email', 'email'),
+        ('phone', 'phone'), ('mobile', 'mobile'), ('job_title', 'job_title'), ('department', 'department'),
+        ('account_id', 'account_id'), ('account', 'account__name'),
+        ('assigned_to', 'assigned_to__username'), ('created_by', 'created_by__username'),
+        ('manager', 'manager_username'), ('created_at', 'created_at'), ('updated_at', 'updated_at'),
+    ]),
+    'accounts': ExportSpec(Account, [
+        ('id', 'id'), ('name', 'name'), ('account_type', 'account_type'), ('industry', 'industry__name'),
+        ('website', 'website'), ('phone', 'phone'), ('email', 'email'),
+        ('annual_revenue', 'annual_revenue'), ('employees', 'employees'),
+        ('billing_address', 'billing_address'), ('shipping_address', 'shipping_address'),
+        ('assigned_to', 'assigned_to__username'), ('created_by', 'created_by__username'),
+        ('manager', 'manager_username'), ('created_at', 'created_at'), ('updated_at', 'updated_at'),
+    ]),
+    'deals': ExportSpec(Deal, [
+        ('id', 'id'), ('name', 'name'), ('account_id', 'account_id'), ('account', 'account__name'),
+        ('amount', 'amount'), ('stage', 'stage'), ('probability', 'probability'),
+        ('closing_date', 'closing_date'), ('assigned_to', 'assigned_to__username'),
+        ('created_by', 'created_by__username'), ('created_at', 'created_at'), ('updated_at', 'updated_at'),
+    ]),
+    'tasks': ExportSpec(Task, [
+        ('id', 'id'), ('subject', 'subject'), ('status', 'status'), ('priority', 'priority'),
+        ('due_date', 'due_date'), ('completed_date', 'completed_date'),
+        ('assigned_to', 'assigned_to__username'), ('created_by', 'created_by__username'),
+        ('related_lead_id', 'related_lead_id'), ('related_contact_id', 'related_contact_id'),
+        ('related_account_id', 'related_account_id'), ('related_deal_id', 'related_deal_id'),
+        ('manager', 'manager_username'), ('created_at', 'created_at'), ('updated_at', 'updated_at'),
+    ]),
+    'transactions': ExportSpec(Transaction, [
+        ('id', 'id'), ('transaction_type', 'transaction_type'), ('amount', 'amount'), ('date', 'date'),
+        ('due_date', 'due_date'), ('status', 'status'), ('reference_number', 'reference_number'),
+        ('account_id', 'account_id'), ('account', 'account__name'), ('deal_id', 'deal_id'),
+        ('created_by', 'created_by__username'), ('created_at', 'created_at'), ('updated_at', 'updated_at'),
+    ], scope=visible_transactions),
+}
+
+
+def iter_batches(queryset, lookups, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield lists of value tuples, one keyset-paginated query per batch"""
+    queryset = queryset.order_by('pk').values_list('pk', *lookups)
+    last_pk = None
+    while True:
+        page = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        rows = list(page[:chunk_size].iterator(chunk_size=chunk_size))
+        if not rows:
+            return
+        last_pk = rows[-1][0]
+        yield [row[1:] for row in rows]
+        if len(rows) < chunk_size:
+            return
+
+
+# First characters that make a spreadsheet read a cell as a formula
+FORMULA_TRIGGERS = ('=', '+', '-', '@', '\t', '\r')
+
+
+def spreadsheet_text(text):
+    """Text that a spreadsheet shows as typed instead of evaluating it"""
+    return "'" + text if text.startswith(FORMULA_TRIGGERS) else text
+
+
+def cell_text(value):
+    """Render a value for a cell: local ISO datetimes, plain decimals, blanks for NULL"""
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return (timezone.localtime(value) if timezone.is_aware(value) else value).isoformat(sep=' ')
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def csv_cell(value):
+    """cell_text, with text a spreadsheet would evaluate quoted"""
+    value = cell_text(value)
+    return spreadsheet_text(value) if isinstance(value, str) else value
+
+
+class Echo:
+    """File-like object whose write() returns what it was given (for csv.writer)"""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(spec, queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    writer = csv.writer(Echo())
+    # BOM so spreadsheet apps pick UTF-8; the importers read utf-8-sig
+    yield '\ufeff' + writer.writerow(spec.headers)
+    lookups = [lookup for _header, lookup in spec.columns]
+    for batch in iter_batches(queryset, lookups, chunk_size):
+        yield ''.join(writer.writerow([csv_cell(value) for value in row]) for row in batch)
+
+
+class StreamBuffer:
+    """Write-only, unseekable file object drained by the streaming generator"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '</Relationships>'
+    ),
+}
+
+WORKBOOK_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets></workbook>'
+)
+
+# Control characters are not allowed in XML 1.0
+_XML_ILLEGAL = dict.fromkeys(c for c in range(32) if c not in (9, 10, 13))
+
+
+def xlsx_cell(value):
+    if value is None:
+        return '<c/>'
+    if isinstance(value, bool):
+        return f'<c t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float, Decimal)):
+        return f'<c><v>{value}</v></c>'
+    text = escape(str(cell_text(value)).translate(_XML_ILLEGAL))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def xlsx_row(values):
+    return '<row>' + ''.join(xlsx_cell(value) for value in values) + '</row>'
+
+
+def stream_xlsx(spec, queryset, sheet_name, chunk_size=EXPORT_CHUNK_SIZE):
+    buffer = StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as package:
+        for name, xml in XLSX_PARTS.items():
+            package.writestr(name, xml)
+        package.writestr('xl/workbook.xml', WORKBOOK_XML.format(name=escape(sheet_name)))
+        yield buffer.take()
+
+        with package.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+                + xlsx_row(spec.headers)
+            ).encode('utf-8'))
+            lookups = [lookup for _header, lookup in spec.columns]
+            for batch in iter_batches(queryset, lookups, chunk_size):
+                sheet.write(''.join(xlsx_row(row) for row in batch).encode('utf-8'))
+                yield buffer.take()
+            sheet.write(b'</sheetData></worksheet>')
+    yield buffer.take()
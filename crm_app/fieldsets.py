@@ -0,0 +1,347 @@
+"""
+Sparse fieldsets for the list and retrieve endpoints.
+
+    /api/leads/?fields=id,first_name,last_name,lead_status,assigned_to_name
+    /api/deals/?expand=account,assigned_to
+    /api/leads/?lean=1&fields=id,first_name,last_name,lead_status
+
+fields keeps only the named serializer fields, and the query only loads
+what they read. The model's own columns go through .only(). A
+select_related join is kept only for relations a selected field follows,
+and prefetches and annotations only when their field is selected.
+
+expand swaps a foreign key id for a nested object. The serializers list
+the keys they can expand in Meta.expandable.
+
+lean (lists only) is for read-only grids. Rows come straight from
+.values() and are turned into dicts without the DRF field classes. Only
+fields backed by a single column (or an annotation) are available: model
+columns, "industry.name" style sources and choice labels. With no fields=,
+lean returns all of them except TEXT/JSON columns.
+
+Rows are rendered by a function compile_renderer() generates for the
+selected Columns. read_serializers.py builds on the same Columns.
+
+To map a field to columns, fieldsets follow its source. SerializerMethodFields
+and other computed fields declare the lookups they read in
+Meta.field_sources. A selected field that can't be mapped either way makes
+the query load every column, as before.
+"""
+import re
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from django.db.models import Prefetch
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+
+from .pagination import KeysetCursorPagination
+
+FIELDS_PARAM = 'fields'
+EXPAND_PARAM = 'expand'
+LEAN_PARAM = 'lean'
+
+# Model methods a source may call, and the columns they read
+METHOD_LOOKUPS = {'get_full_name': ('first_name', 'last_name')}
+# Columns lean mode leaves out unless asked for
+BULKY_FIELDS = (models.TextField, models.JSONField)
+
+_DISPLAY = re.compile(r'get_(\w+)_display')
+_serializer_fields = {}
+
+
+def parse_names(value):
+    return [name.strip() for name in (value or '').split(',') if name.strip()]
+
+
+def is_truthy(value):
+    return (value or '').lower() in ('1', 'true', 'yes')
+
+
+def serializer_fields(serializer_class):
+    """Unbound field instances of a serializer class, built once per process"""
+    fields = _serializer_fields.get(serializer_class)
+    if fields is None:
+        fields = _serializer_fields[serializer_class] = serializer_class().fields
+    return fields
+
+
+def resolve_source(model, source):
+    """
+    (lookup, model field, is choice label, guards) for a dotted source such
+    as "industry.name" or "get_stage_display"; None if it isn't one column.
+    guards are the relations the source goes through ("industry"): when
+    one is empty the serializer leaves the field out.
+    """
+    parts = source.split('.')
+    path, guards = [], []
+    for index, part in enumerate(parts):
+        last = index == len(parts) - 1
+        try:
+            field = model._meta.get_field(part)
+        except FieldDoesNotExist:
+            display = _DISPLAY.fullmatch(part)
+            if last and display:
+                try:
+                    field = model._meta.get_field(display[1])
+                except FieldDoesNotExist:
+                    return None
+                return '__'.join(path + [field.name]), field, True, tuple(guards)
+            return None
+        path.append(part)
+        if not last:
+            if not (field.many_to_one or field.one_to_one):
+                return None
+            guards.append('__'.join(path))
+            model = field.related_model
+    return '__'.join(path), field, False, tuple(guards)
+
+
+def field_lookups(serializer_class, name, annotations=()):
+    """Model lookups a serializer field reads ("first_name", "industry__name"), or None"""
+    declared = getattr(serializer_class.Meta, 'field_sources', {})
+    if name in declared:
+        return tuple(declared[name])
+    if name in annotations:
+        return (name,)
+    field = serializer_fields(serializer_class)[name]
+    if isinstance(field, serializers.SerializerMethodField) or field.source == '*':
+        return None
+    model = serializer_class.Meta.model
+    parts = field.source.split('.')
+    if len(parts) > 1 and parts[-1] in METHOD_LOOKUPS:
+        relation = resolve_source(model, '.'.join(parts[:-1]))
+        if relation is None:
+            return None
+        return tuple(f'{relation[0]}__{column}' for column in METHOD_LOOKUPS[parts[-1]])
+    resolved = resolve_source(model, field.source)
+    return (resolved[0],) if resolved else None
+
+
+class Column:
+    """
+    How one output field is read from a .values() row: lookups[0] as is or
+    through convert, or function(row) over all of lookups. The field is
+    left out of rows where one of its guards is None.
+    """
+
+    def __init__(self, lookups, convert=None, function=None, guards=()):
+        self.lookups = tuple(lookups)
+        self.convert = convert
+        self.function = function
+        self.guards = tuple(guards)
+
+
+def compile_renderer(columns):
+    """
+    A function turning a .values() row into the output dict of columns
+    ({name: Column}, in output order). It is generated as straight-line
+    code, one statement per field, so a row costs no per-field dispatch.
+    """
+    namespace, lines = {}, ['def render(row):', '    out = {}']
+    for index, (name, column) in enumerate(columns.items()):
+        if column.function is not None:
+            namespace[f'function{index}'] = column.function
+            value = f'function{index}(row)'
+        elif column.convert is not None:
+            namespace[f'convert{index}'] = column.convert
+            value = f'convert{index}(row[{column.lookups[0]!r}])'
+        else:
+            value = f'row[{column.lookups[0]!r}]'
+        if column.guards:
+            present = ' and '.join(f'row[{guard!r}] is not None' for guard in column.guards)
+            lines.append(f'    if {present}:')
+            lines.append(f'        out[{name!r}] = {value}')
+        else:
+            lines.append(f'    out[{name!r}] = {value}')
+    lines.append('    return out')
+    exec('\n'.join(lines), namespace)
+    return namespace['render']
+
+
+def lean_column(serializer_class, name, annotations=()):
+    """The Column of a field lean mode can read from one column, else None"""
+    if name in annotations:
+        return Column((name,))
+    declared = getattr(serializer_class.Meta, 'field_sources', {})
+    field = serializer_fields(serializer_class)[name]
+    if name in declared or isinstance(field, (serializers.SerializerMethodField, serializers.ManyRelatedField)) \
+            or field.source == '*':
+        return None
+    resolved = resolve_source(serializer_class.Meta.model, field.source)
+    if resolved is None:
+        return None
+    lookup, model_field, is_label, guards = resolved
+    if model_field.many_to_many or model_field.one_to_many or isinstance(model_field, models.FileField):
+        return None
+    if is_label:
+        labels = dict(model_field.flatchoices)
+        return Column((lookup,), lambda value: labels.get(value, value), guards=guards)
+    return Column((lookup,), converter(model_field), guards=guards)
+
+
+def render_datetime(value):
+    """What serializers.DateTimeField renders for an aware datetime"""
+    if value is None:
+        return None
+    value = timezone.localtime(value).isoformat() if timezone.is_aware(value) else value.isoformat()
+    return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+
+def converter(model_field):
+    if isinstance(model_field, models.DateTimeField):
+        return render_datetime
+    if isinstance(model_field, models.DecimalField):
+        return lambda value: None if value is None else '{:f}'.format(value)
+    return None
+
+
+class Fieldset:
+    """The ?fields= / ?expand= / ?lean= of one request against one ViewSet"""
+
+    def __init__(self, serializer_class, fields=None, expand=(), lean=False, annotations=()):
+        self.serializer_class = serializer_class
+        self.model = serializer_class.Meta.model
+        self.expand = list(expand)
+        self.lean = lean
+        self.annotations = annotations
+        available = serializer_fields(serializer_class)
+        expandable = getattr(serializer_class.Meta, 'expandable', {})
+
+        unknown = [name for name in fields or () if name not in available]
+        if unknown:
+            raise ValidationError({FIELDS_PARAM: [f"Unknown field(s): {', '.join(unknown)}"]})
+        unknown = [name for name in self.expand if name not in expandable]
+        if unknown:
+            raise ValidationError({EXPAND_PARAM: [
+                f"Can't expand {', '.join(unknown)}; expandable: {', '.join(expandable) or 'none'}"
+            ]})
+
+        if lean:
+            if self.expand:
+                raise ValidationError({EXPAND_PARAM: ['expand is not available with lean']})
+            columns = {name: lean_column(serializer_class, name, annotations) for name in fields or available}
+            if fields:
+                missing = [name for name, column in columns.items() if column is None]
+                if missing:
+                    raise ValidationError({FIELDS_PARAM: [f"Not available with lean: {', '.join(missing)}"]})
+            else:
+                columns = {
+                    name: column for name, column in columns.items()
+                    if column is not None and not self.is_bulky(column.lookups[0])
+                }
+            self.columns = columns
+            self.fields = list(columns)
+            self.render = compile_renderer(columns)
+        else:
+            self.fields = list(fields) if fields else None
+            if self.fields is not None:
+                self.fields += [name for name in self.expand if name not in self.fields]
+
+    @classmethod
+    def from_request(cls, request, serializer_class, lean_allowed=True, annotations=()):
+        """The request's fieldset, or None when it asks for the full representation"""
+        params = request.query_params
+        fields = parse_names(params.get(FIELDS_PARAM))
+        expand = parse_names(params.get(EXPAND_PARAM))
+        lean = lean_allowed and is_truthy(params.get(LEAN_PARAM))
+        if not (fields or expand or lean):
+            return None
+        return cls(serializer_class, fields, expand, lean, annotations)
+
+    def is_bulky(self, lookup):
+        model = self.model
+        for part in lookup.split('__'):
+            try:
+                field = model._meta.get_field(part)
+            except FieldDoesNotExist:
+                return False
+            model = field.related_model or model
+        return isinstance(field, BULKY_FIELDS)
+
+    # Serializer side
+
+    def apply(self, serializer):
+        """Expand and prune the fields of a (child) serializer instance"""
+        expandable = getattr(self.serializer_class.Meta, 'expandable', {})
+        for name in self.expand:
+            serializer.fields[name] = expandable[name](read_only=True)
+        if self.fields is not None:
+            for name in list(serializer.fields):
+                if name not in self.fields:
+                    serializer.fields.pop(name)
+
+    def lean_rows(self, rows):
+        """Output dicts for .values() rows"""
+        return list(map(self.render, rows))
+
+    # Query side
+
+    def lookups(self):
+        """Every lookup the selected and expanded fields read, or None if some are unknown"""
+        lookups = []
+        for name in self.fields:
+            if name in self.expand:
+                nested = getattr(self.serializer_class.Meta, 'expandable')[name]
+                relation = resolve_source(self.model, serializer_fields(self.serializer_class)[name].source)
+                for nested_name in serializer_fields(nested):
+                    nested_lookups = field_lookups(nested, nested_name)
+                    if nested_lookups is None or relation is None:
+                        return None
+                    lookups.extend(f'{relation[0]}__{lookup}' for lookup in nested_lookups)
+                continue
+            field_lookup = field_lookups(self.serializer_class, name, self.annotations)
+            if field_lookup is None:
+                return None
+            lookups.extend(field_lookup)
+        return lookups
+
+    def narrow(self, queryset, view):
+        """
+        queryset reduced to the selected fields. view supplies the profile
+        (select_related_fields, prefetch_related_fields, annotations) that
+        would otherwise be applied in full.
+        """
+        ordering = [name.lstrip('-') for name in KeysetCursorPagination.get_ordering(queryset, view)]
+        if self.lean:
+            lookups = [lookup for column in self.columns.values() for lookup in column.lookups + column.guards]
+            annotations = {name: view.annotations[name] for name in lookups if name in view.annotations}
+            return queryset.annotate(**annotations).values(*dict.fromkeys(lookups + ordering))
+
+        lookups = self.lookups() if self.fields is not None else None
+        if lookups is None:
+            # Full (or unknown) column set: the whole profile, plus the expanded joins
+            queryset = view.with_profile(queryset)
+            return queryset.select_related(*self.expand) if self.expand else queryset
+
+        columns, joins, prefetches, annotations = [], set(), set(), {}
+        for lookup in lookups:
+            if lookup in view.annotations:
+                annotations[lookup] = view.annotations[lookup]
+                continue
+            model, path = self.model, []
+            for part in lookup.split('__'):
+                field = model._meta.get_field(part)
+                if field.many_to_many or field.one_to_many:
+                    prefetches.add('__'.join(path + [part]))
+                    break
+                if path:
+                    joins.add('__'.join(path))
+                path.append(part)
+                model = field.related_model
+            else:
+                # "account__name" joins account; "account" alone is just the id column
+                columns.append(lookup)
+
+        queryset = queryset.only(*dict.fromkeys(columns + ordering))
+        if joins:
+            queryset = queryset.select_related(*joins)
+        for prefetch in view.prefetch_related_fields:
+            name = prefetch.prefetch_to if isinstance(prefetch, Prefetch) else prefetch
+            if name.split('__')[0] in prefetches:
+                queryset = queryset.prefetch_related(prefetch)
+                prefetches.discard(name.split('__')[0])
+        if prefetches:
+            queryset = queryset.prefetch_related(*prefetches)
+        return queryset.annotate(**annotations) if annotations else queryset
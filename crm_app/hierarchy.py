@@ -0,0 +1,29 @@
+"""
+Manager -> subordinates lookup.
+
+A user reports to the manager their UserProfile.manager FK points at
+(ManagerLinkedModel keeps it in sync with manager_username). The admin views
+used to rebuild the subordinate list by walking User.objects.all() and
+touching user.profile one by one, which costs one query per user on every
+page. ManagerHierarchy answers from the indexed manager_id column instead:
+subordinates() is a subquery the scope filters embed, and subordinate_ids()
+is one query for the views that need the IDs themselves.
+
+Nothing is cached. These lookups decide what a manager may read and edit,
+so a profile reassigned in one worker (or a renamed manager) has to take
+effect everywhere on the next request, not when a per-process cache expires.
+"""
+from .models import UserProfile
+
+
+class ManagerHierarchy:
+
+    @staticmethod
+    def subordinates(manager):
+        """The user IDs reporting to manager, as a subquery for `<owner>_id__in=`"""
+        return UserProfile.objects.filter(manager_id=manager.pk).values('user_id')
+
+    @classmethod
+    def subordinate_ids(cls, manager):
+        """The IDs of the users whose profile points at manager"""
+        return list(cls.subordinates(manager).values_list('user_id', flat=True))
@@ -0,0 +1,496 @@
+"""
+Declarative, streaming CSV import shared by the admin importers.
+
+An importer subclass lists its columns: each Column maps a CSV header onto
+a model field through a coercer, and each Related column resolves a key
+(an id, a username, a name) to a foreign key. The upload is decoded and
+parsed incrementally, rows are validated in chunks and each chunk is
+written with one bulk_create inside its own transaction. Related keys are
+looked up once per chunk with a single IN query (and remembered for the
+rest of the file) instead of one get() per row. A bad row never aborts the
+import: it is skipped and reported with its line number in the
+ImportReport.
+
+bulk_create skips save() and the post_save signals, so importers set the
+denormalized columns themselves, rebuild the daily rollups for the days
+they wrote and index the new rows for search. The lead importer also
+stores the dedup keys of its rows and, in upsert mode, merges rows that
+duplicate an existing lead (see dedup.py).
+"""
+import csv
+import io
+import time
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import Account, Contact, Deal, Industry, Lead, Product, Transaction
+from . import dedup
+from .rollups import ROLLUPS, local_day, rebuild_days
+from . import search
+
+# Rows validated and written per transaction
+CHUNK_SIZE = 1000
+# Row errors kept in the report (the total is always counted)
+MAX_REPORTED_ERRORS = 1000
+
+
+def iter_csv_rows(upload, encoding='utf-8-sig', fieldnames=None):
+    """
+    Yield (line_number, row) for each record of an uploaded CSV file.
+
+    The file is read through a text wrapper, so only the current buffer is
+    in memory whatever the upload size. Header names are stripped. Pass
+    fieldnames for files without a header row.
+    """
+    upload.seek(0)
+    text = io.TextIOWrapper(upload, encoding=encoding, newline='')
+    try:
+        reader = csv.DictReader(text, fieldnames=fieldnames)
+        if reader.fieldnames:
+            reader.fieldnames = [name.strip() for name in reader.fieldnames]
+        for row in reader:
+            yield reader.line_num, row
+    finally:
+        # Leave the upload open for Django to clean up
+        text.detach()
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        # Rows folded into an existing record instead of inserted (lead upserts)
+        self.merged = 0
+        self.error_count = 0
+        self.errors = []
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def finish(self):
+        # Unique checks run after validation, so errors arrive out of order
+        self.errors.sort(key=lambda error: error['line'])
+        self.elapsed = time.perf_counter() - self.started
+        return self
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+
+def describe_validation_error(error):
+    if hasattr(error, 'message_dict'):
+        return '; '.join(f'{field}: {" ".join(messages)}' for field, messages in error.message_dict.items())
+    return ' '.join(error.messages)
+
+
+# Coercers turn a stripped, non-empty cell into a field value and raise
+# ValueError when they can't.
+
+def text(value):
+    return value
+
+
+def lowercase(value):
+    return value.lower()
+
+
+def integer(value):
+    try:
+        return int(Decimal(value.replace(',', '')))
+    except InvalidOperation:
+        raise ValueError(f'"{value}" is not a whole number')
+
+
+def decimal(value):
+    """Amounts as exported by spreadsheets: '$1,200.50' -> Decimal('1200.50')"""
+    try:
+        return Decimal(value.replace('$', '').replace(',', ''))
+    except InvalidOperation:
+        raise ValueError(f'"{value}" is not a number')
+
+
+def positive_decimal(value):
+    amount = decimal(value)
+    if amount <= 0:
+        raise ValueError('must be greater than zero')
+    return amount
+
+
+def date(value):
+    parsed = parse_date(value)
+    if parsed is None:
+        raise ValueError(f'"{value}" is not a YYYY-MM-DD date')
+    return parsed
+
+
+class Column:
+    """A CSV header mapped onto a model field"""
+
+    def __init__(self, header, field=None, coerce=text, default='', unique=False):
+        self.header = header
+        self.field = field or header
+        self.coerce = coerce
+        # Used for empty cells; a callable is called per row
+        self.default = default
+        # Values must not exist in the table yet nor repeat within the file
+        self.unique = unique
+
+    def value(self, row):
+        raw = (row.get(self.header) or '').strip()
+        if not raw:
+            return self.default() if callable(self.default) else self.default
+        try:
+            return self.coerce(raw)
+        except (ValueError, ArithmeticError) as error:
+            raise ValidationError({self.field: str(error) or f'invalid value "{raw}"'})
+
+
+class Ignored(Column):
+    """A template column with no model field behind it"""
+
+    def __init__(self, header):
+        super().__init__(header, field=None)
+        self.field = None
+
+
+class Related(Column):
+    """
+    A CSV key resolved to a foreign key id through `lookup` on `model`.
+
+    Keys are prefetched per chunk with one query into a cache owned by the
+    importer run. Unknown keys leave the field empty, or reject the row
+    when `required`.
+    """
+
+    def __init__(self, header, field, model, lookup='pk', required=False):
+        super().__init__(header, field, default=None)
+        self.model = model
+        self.lookup = lookup
+        self.required = required
+
+    def key(self, row):
+        key = (row.get(self.header) or '').strip()
+        if self.lookup == 'pk':
+            return int(key) if key.isdigit() else None
+        return key or None
+
+    def prefetch(self, rows, cache):
+        keys = {self.key(row) for row in rows} - {None} - set(cache)
+        if keys:
+            cache.update(self.model.objects.filter(**{f'{self.lookup}__in': keys})
+                         .values_list(self.lookup, 'pk'))
+
+    def resolve(self, row, cache):
+        raw = (row.get(self.header) or '').strip()
+        if not raw:
+            if self.required:
+                raise ValidationError({self.header: 'This field is required.'})
+            return None
+        pk = cache.get(self.key(row))
+        if pk is None and self.required:
+            raise ValidationError({self.header: f'no {self.model._meta.verbose_name} matches "{raw}"'})
+        return pk
+
+
+class BulkImporter:
+    """
+    Base importer: subclasses set `model` and `columns`.
+
+    Column order is the order of the downloadable template, which is also
+    how files without a header row are read.
+    """
+    model = None
+    columns = ()
+
+    def __init__(self, user, chunk_size=CHUNK_SIZE):
+        self.user = user
+        self.chunk_size = chunk_size
+        self.related = [column for column in self.columns if isinstance(column, Related)]
+        self.unique = [column for column in self.columns if column.unique]
+        # Resolved ids per Related column, kept for the whole file
+        self.related_ids = {column.header: {} for column in self.related}
+        field_names = {field.name for field in self.model._meta.fields}
+        self.sets_created_by = 'created_by' in field_names
+        # Only mapped plain fields are validated per row: foreign keys are
+        # checked by their Related column instead of a query per row
+        validated = {column.field for column in self.columns if type(column) is Column}
+        self.exclude = [name for name in field_names if name not in validated]
+
+    @classmethod
+    def headers(cls):
+        return [column.header for column in cls.columns]
+
+    def build(self, row):
+        values = {}
+        errors = {}
+        for column in self.columns:
+            try:
+                if isinstance(column, Related):
+                    values[f'{column.field}_id'] = column.resolve(row, self.related_ids[column.header])
+                elif column.field:
+                    values[column.field] = column.value(row)
+            except ValidationError as error:
+                errors.update(error.message_dict)
+        if errors:
+            raise ValidationError(errors)
+
+        instance = self.model(**values)
+        if self.sets_created_by:
+            instance.created_by = self.user
+        instance.clean_fields(exclude=self.exclude)
+        return instance
+
+    def check_unique(self, built, seen, report):
+        """Drop rows whose unique values exist in the table or earlier in the file"""
+        taken = {
+            column.field: set(self.model.objects.filter(**{
+                f'{column.field}__in': [getattr(obj, column.field) for _line, obj in built],
+            }).values_list(column.field, flat=True))
+            for column in self.unique
+        }
+        kept = []
+        for line, obj in built:
+            clashes = [
+                column.field for column in self.unique
+                if getattr(obj, column.field) in taken[column.field] | seen[column.field]
+            ]
+            if clashes:
+                report.add_error(line, '; '.join(
+                    f'{field}: "{getattr(obj, field)}" already exists' for field in clashes))
+                continue
+            for column in self.unique:
+                seen[column.field].add(getattr(obj, column.field))
+            kept.append((line, obj))
+        return kept
+
+    def write(self, built, report):
+        """bulk_create a chunk; on an integrity error retry row by row to report the culprits"""
+        objects = [obj for _line, obj in built]
+        try:
+            with transaction.atomic():
+                self.model.objects.bulk_create(objects, batch_size=self.chunk_size)
+            return objects
+        except IntegrityError:
+            pass
+        written = []
+        for line, obj in built:
+            try:
+                with transaction.atomic():
+                    self.model.objects.bulk_create([obj])
+                written.append(obj)
+            except IntegrityError as error:
+                report.add_error(line, str(error))
+        return written
+
+    def run(self, rows, progress=None):
+        """
+        Import an iterable of (line_number, row) and return the ImportReport.
+
+        progress, if given, is called with the report after every chunk.
+        """
+        report = ImportReport()
+        self.started_at = started_at = timezone.now()
+        days = set()
+        seen = {column.field: set() for column in self.unique}
+        for chunk in chunked(rows, self.chunk_size):
+            for column in self.related:
+                column.prefetch([row for _line, row in chunk], self.related_ids[column.header])
+            built = []
+            for line, row in chunk:
+                report.rows += 1
+                try:
+                    built.append((line, self.build(row)))
+                except ValidationError as error:
+                    report.add_error(line, describe_validation_error(error))
+            if self.unique:
+                built = self.check_unique(built, seen, report)
+            if built:
+                written = self.write(built, report)
+                report.created += len(written)
+                if self.model in ROLLUPS:
+                    days.update(local_day(obj.created_at) for obj in written)
+            if progress:
+                report.elapsed = time.perf_counter() - report.started
+                progress(report)
+
+        if days:
+            rebuild_days(self.model, days)
+        if self.model in search.INDEXES and report.created:
+            # bulk_create doesn't return ids on every backend: find the new rows by owner and time
+            search.index_queryset(self.model.objects.filter(created_by=self.user, created_at__gte=started_at))
+        return report.finish()
+
+
+class LeadImporter(BulkImporter):
+    """Leads, from the admin lead template"""
+    model = Lead
+    columns = [
+        Column('first_name'),
+        Column('last_name'),
+        Column('email'),
+        Column('phone'),
+        Column('company'),
+        Column('job_title', 'title'),
+        Column('lead_source', default='other'),
+        Column('lead_status', default='new'),
+        # Unknown usernames leave the lead unassigned, as before
+        Related('assigned_to', 'assigned_to', User, lookup='username'),
+        Ignored('notes'),
+    ]
+
+    def __init__(self, user, chunk_size=CHUNK_SIZE, ingest_mode=None):
+        super().__init__(user, chunk_size)
+        self.upsert = (ingest_mode or dedup.ingest_mode()) == 'upsert'
+        # Rows of this run up to this pk have their dedup keys stored
+        self.registered_pk = 0
+
+    def write(self, built, report):
+        if self.upsert:
+            built = self.merge_duplicates(built, report)
+        written = super().write(built, report)
+        if written:
+            self.register_new_rows()
+        return written
+
+    def merge_duplicates(self, built, report):
+        """
+        Fold rows that match an existing lead, or an earlier row of the
+        chunk, into that lead. One key lookup and one bulk_update per chunk.
+        """
+        keyed = [(line, obj, dedup.lead_keys(obj)) for line, obj in built]
+        owners = dedup.key_owners({key for _line, _obj, keys in keyed for key in keys})
+        existing = Lead.objects.in_bulk(set(owners.values()))
+        kept, pending, changed = [], {}, {}
+        for line, obj, keys in keyed:
+            target = next((existing[owners[key]] for key in keys if key in owners), None)
+            if target is not None:
+                if dedup.fill_blanks(target, obj, owner=True):
+                    changed[target.pk] = target
+                report.merged += 1
+                continue
+            twin = next((pending[key] for key in keys if key in pending), None)
+            if twin is not None:
+                dedup.fill_blanks(twin, obj, owner=True)
+                report.merged += 1
+                continue
+            pending.update((key, obj) for key in keys)
+            kept.append((line, obj))
+
+        if changed:
+            now = timezone.now()
+            for lead in changed.values():
+                lead.updated_at = now
+            fields = dedup.MERGE_FIELDS + dedup.OWNER_FIELDS + ['updated_at']
+            with transaction.atomic():
+                Lead.objects.bulk_update(changed.values(), fields, batch_size=self.chunk_size)
+                # bulk_update skips the signals; a filled-in owner moves the lead in the rollups
+                rebuild_days(Lead, {local_day(lead.created_at) for lead in changed.values()})
+            search.index_objects(Lead, changed.values())
+        return kept
+
+    def register_new_rows(self):
+        """Store the dedup keys of the rows written since the last chunk"""
+        # bulk_create doesn't return ids on every backend: find the rows by owner and time
+        rows = list(Lead.objects.filter(
+            created_by=self.user, created_at__gte=self.started_at, pk__gt=self.registered_pk,
+        ).order_by('pk').values_list('pk', 'email', 'phone', 'mobile'))
+        if rows:
+            dedup.register_leads(rows)
+            self.registered_pk = rows[-1][0]
+
+
+class ContactImporter(BulkImporter):
+    """Contacts, from the admin contact template"""
+    model = Contact
+    columns = [
+        Column('first_name'),
+        Column('last_name'),
+        Column('email'),
+        Column('phone'),
+        Column('job_title'),
+        Related('account_id', 'account', Account, required=True),
+    ]
+
+
+class AccountImporter(BulkImporter):
+    """Accounts, from the admin account template"""
+    model = Account
+    columns = [
+        Column('name'),
+        Related('industry_id', 'industry', Industry),
+        Column('website'),
+        Column('phone'),
+        Column('annual_revenue', coerce=decimal, default=None),
+        Column('employees', coerce=integer, default=None),
+        Column('address', 'billing_address'),
+        Column('description'),
+    ]
+
+
+class DealImporter(BulkImporter):
+    """Deals, from the admin deal template"""
+    model = Deal
+    columns = [
+        Column('name'),
+        Column('amount', coerce=positive_decimal, default=None),
+        Column('stage', coerce=lowercase, default='qualification'),
+        Column('expected_close_date', 'closing_date', coerce=date,
+               default=lambda: timezone.localdate() + timedelta(days=30)),
+        Column('probability', coerce=integer, default=50),
+        Related('account_id', 'account', Account, required=True),
+        # Deal contacts are a many-to-many, which bulk_create can't fill in
+        Ignored('contact_id'),
+        Column('description'),
+    ]
+
+
+class ProductImporter(BulkImporter):
+    """Products, from the admin product template"""
+    model = Product
+    columns = [
+        Column('name'),
+        Column('category_id', 'category'),
+        Column('sku', 'product_code', unique=True),
+        Column('price', 'unit_price', coerce=positive_decimal, default=None),
+        # Stock isn't tracked on Product
+        Ignored('stock_quantity'),
+        Column('description'),
+        Ignored('low_stock_threshold'),
+    ]
+
+
+class TransactionImporter(BulkImporter):
+    """Transactions, from the admin transaction template"""
+    model = Transaction
+    columns = [
+        Column('transaction_type', coerce=lowercase),
+        Column('amount', coerce=positive_decimal, default=None),
+        Column('date', coerce=date, default=None),
+        Column('status', coerce=lowercase, default='completed'),
+        Related('account_id', 'account', Account, required=True),
+        Related('deal_id', 'deal', Deal),
+        Column('description'),
+        Ignored('category'),
+    ]
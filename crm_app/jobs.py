@@ -0,0 +1,163 @@
+"""
+Background admin CSV imports.
+
+The upload view stores the file on an ImportJob and returns at once; the
+import itself runs elsewhere and writes its progress (rows processed,
+rows created, errors) back to the job row after every chunk, which the
+admin list pages poll.
+
+Where it runs depends on IMPORT_JOBS_RUNNER:
+    thread  a small thread pool inside the web process (the default)
+    worker  `manage.py run_import_worker`, polling for pending jobs
+    inline  during the upload request (tests, debugging)
+
+A job is claimed by flipping it from pending to running with a single
+UPDATE, so several worker processes can poll the same table.
+
+A restart (deploy, crash, OOM kill) takes the thread pool and its queue
+with it, leaving jobs pending or running forever. The runner touches
+heartbeat_at on claim and after every chunk, and recover_stale_jobs()
+fails the jobs that went quiet for longer than IMPORT_JOB_STALE_SECONDS.
+It runs when the worker starts and whenever it finds nothing to do, and
+when the admin pages poll a job's progress.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .importers import (
+    AccountImporter, ContactImporter, DealImporter, LeadImporter, ProductImporter, TransactionImporter,
+    iter_csv_rows,
+)
+from .models import ImportJob
+from .utils import log_user_activity
+
+logger = logging.getLogger(__name__)
+
+IMPORTERS = {
+    'leads': LeadImporter,
+    'contacts': ContactImporter,
+    'accounts': AccountImporter,
+    'deals': DealImporter,
+    'products': ProductImporter,
+    'transactions': TransactionImporter,
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """The process-wide pool, created on first use (after any server fork)"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'IMPORT_WORKER_THREADS', 2),
+                thread_name_prefix='import-job',
+            )
+        return _executor
+
+
+def create_import_job(user, kind, upload, has_header=True):
+    """Store an uploaded CSV as a pending ImportJob and hand it to the runner"""
+    job = ImportJob(kind=kind, original_name=upload.name[:255], has_header=has_header, created_by=user)
+    job.file.save(upload.name, upload, save=False)
+    job.save()
+
+    runner = getattr(settings, 'IMPORT_JOBS_RUNNER', 'thread')
+    if runner == 'inline':
+        run_import_job(job.id)
+    elif runner == 'thread':
+        transaction.on_commit(lambda: get_executor().submit(run_in_thread, job.id))
+    return job
+
+
+def stale_after():
+    return getattr(settings, 'IMPORT_JOB_STALE_SECONDS', 600)
+
+
+def recover_stale_jobs():
+    """
+    Fail the jobs whose runner is gone: running jobs without a heartbeat for
+    IMPORT_JOB_STALE_SECONDS, and, with the thread runner, pending jobs that
+    old (their place in a pool queue was lost; the worker runner picks
+    pending jobs up from the table, so they are only waiting). Returns the
+    number of jobs failed.
+    """
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=stale_after())
+    stale = Q(status='running') & (Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff))
+    if getattr(settings, 'IMPORT_JOBS_RUNNER', 'thread') == 'thread':
+        stale |= Q(status='pending', created_at__lt=cutoff)
+    failed = ImportJob.objects.filter(stale).update(
+        status='failed', finished_at=now,
+        message=f'The import stopped responding for over {stale_after()} seconds '
+                f'(the server was probably restarted); upload the file again',
+    )
+    if failed:
+        logger.warning('Failed %d stale import job(s)', failed)
+    return failed
+
+
+def run_in_thread(job_id):
+    try:
+        run_import_job(job_id)
+    finally:
+        # Pool threads keep their own connections; let CONN_MAX_AGE recycle them
+        close_old_connections()
+
+
+def claim_job(job_id):
+    """Move a pending job to running; False if someone else got it first"""
+    now = timezone.now()
+    return bool(ImportJob.objects.filter(id=job_id, status='pending')
+                .update(status='running', started_at=now, heartbeat_at=now))
+
+
+def run_import_job(job_id):
+    """Import a pending job's file, recording progress on the job as it goes"""
+    if not claim_job(job_id):
+        return
+    job = ImportJob.objects.select_related('created_by').get(id=job_id)
+    importer_class = IMPORTERS[job.kind]
+
+    def progress(report):
+        ImportJob.objects.filter(id=job_id).update(
+            rows_processed=report.rows, created_count=report.created,
+            error_count=report.error_count, elapsed=report.elapsed, heartbeat_at=timezone.now(),
+        )
+
+    try:
+        fieldnames = None if job.has_header else importer_class.headers()
+        with job.file.open('rb') as upload:
+            report = importer_class(job.created_by).run(iter_csv_rows(upload, fieldnames=fieldnames), progress)
+    except Exception as e:
+        logger.exception('Import job %s failed', job_id)
+        ImportJob.objects.filter(id=job_id).update(status='failed', message=str(e), finished_at=timezone.now())
+        return
+
+    ImportJob.objects.filter(id=job_id).update(
+        status='completed', rows_processed=report.rows, created_count=report.created,
+        error_count=report.error_count, errors=report.errors, elapsed=report.elapsed,
+        message=f'{report.merged} rows merged into existing records' if report.merged else '',
+        finished_at=timezone.now(),
+    )
+    # The rows are in the database now; the upload isn't needed any more
+    job.file.delete(save=False)
+    ImportJob.objects.filter(id=job_id).update(file='')
+
+    if report.created:
+        log_user_activity(
+            user=job.created_by,
+            action_type='import',
+            action_detail=f"Imported {report.created} {job.kind} from CSV",
+            model_affected=importer_class.model.__name__,
+            object_id=None
+        )
@@ -0,0 +1,89 @@
+import gzip
+import json
+import os
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from crm_app.models import UserActivityLog, month_start, next_month_start
+
+
+class Command(BaseCommand):
+    help = (
+        'Move monthly UserActivityLog partitions older than the retention window to '
+        'gzipped JSONL files under MEDIA_ROOT/activity_archive and delete them from the table.'
+    )
+
+    FIELDS = [
+        'id', 'user_id', 'user__username', 'action_type', 'action_detail', 'model_affected',
+        'object_id', 'ip_address', 'timestamp', 'additional_data',
+    ]
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-months', type=int,
+                            default=getattr(settings, 'ACTIVITY_LOG_RETENTION_MONTHS', 12),
+                            help='Monthly partitions to keep in the database, including the current one')
+        parser.add_argument('--output-dir', default=os.path.join(settings.MEDIA_ROOT, 'activity_archive'))
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows read and deleted per batch')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be archived')
+
+    def handle(self, *args, **options):
+        if options['keep_months'] < 1:
+            raise CommandError('--keep-months must be at least 1 (the current month)')
+
+        # Oldest month that stays in the table
+        cutoff = month_start(timezone.now())
+        for _ in range(options['keep_months'] - 1):
+            cutoff = month_start(cutoff - timedelta(days=1))
+
+        oldest = UserActivityLog.objects.filter(timestamp__lt=cutoff).order_by('timestamp') \
+            .values_list('timestamp', flat=True).first()
+        if oldest is None:
+            self.stdout.write(f'Nothing older than {cutoff:%Y-%m} to archive')
+            return
+
+        output_dir = Path(options['output_dir'])
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        start = month_start(oldest)
+        while start < cutoff:
+            self.archive_partition(start, output_dir, options['batch_size'], options['dry_run'])
+            start = next_month_start(start)
+
+    def archive_path(self, output_dir, start):
+        """activity-YYYY-MM.jsonl.gz, or a numbered part if that month was archived before"""
+        path = output_dir / f'activity-{start:%Y-%m}.jsonl.gz'
+        part = 1
+        while path.exists():
+            part += 1
+            path = output_dir / f'activity-{start:%Y-%m}.{part}.jsonl.gz'
+        return path
+
+    def archive_partition(self, start, output_dir, batch_size, dry_run):
+        partition = UserActivityLog.objects.partition(start).order_by('id')
+        total = partition.count()
+        if not total:
+            return
+        if dry_run:
+            self.stdout.write(f'{start:%Y-%m}: would archive {total} rows')
+            return
+
+        # Write to a temporary file and rename it, so a crash never leaves a
+        # truncated archive; rows are only deleted once the file is in place.
+        path = self.archive_path(output_dir, start)
+        tmp_path = path.with_name(path.name + '.tmp')
+        archived_ids = []
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as archive:
+            for row in partition.values(*self.FIELDS).iterator(chunk_size=batch_size):
+                archive.write(json.dumps(row, cls=DjangoJSONEncoder) + '\n')
+                archived_ids.append(row['id'])
+        os.replace(tmp_path, path)
+
+        for offset in range(0, len(archived_ids), batch_size):
+            UserActivityLog.objects.filter(id__in=archived_ids[offset:offset + batch_size]).delete()
+
+        self.stdout.write(self.style.SUCCESS(f'{start:%Y-%m}: archived {len(archived_ids)} rows to {path}'))
@@ -0,0 +1,140 @@
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q, Min, Max, Sum
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from crm_app.dashboard import dashboard_metrics
+from crm_app.models import Lead, Account, Deal
+from crm_app.rollups import ROLLUPS, rebuild_range
+
+
+class Rollback(Exception):
+    """Raised to throw away the seeded benchmark rows"""
+
+
+class Command(BaseCommand):
+    help = (
+        'Time dashboard_metrics() against synthetic leads/deals, next to the '
+        'per-row queries the admin dashboard ran before it (legacy_metrics). '
+        'The rows are created inside a transaction that is rolled back afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[10000, 100000, 1000000],
+                            help='Lead counts to benchmark (default: 10k 100k 1M)')
+        parser.add_argument('--runs', type=int, default=5, help='Timed runs per size')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        sources = [value for value, _label in Lead.LEAD_SOURCES]
+        stages = [value for value, _label in Deal.DEAL_STAGES]
+        self.stdout.write(f"{'leads':>10} {'version':>10} {'queries':>8} {'best ms':>9} {'avg ms':>9}")
+
+        for size in options['sizes']:
+            try:
+                with transaction.atomic():
+                    admin = User.objects.create(username=f'bench_admin_{size}', is_staff=True)
+                    self.seed(size, admin, sources, stages, options['batch_size'])
+                    results = [
+                        ('before', self.measure(legacy_metrics, admin, options['runs'])),
+                        ('after', self.measure(dashboard_metrics, admin, options['runs'])),
+                    ]
+                    raise Rollback()
+            except Rollback:
+                pass
+
+            for version, (queries, timings) in results:
+                self.stdout.write(
+                    f'{size:>10} {version:>10} {queries:>8} {min(timings) * 1000:>9.1f} '
+                    f'{sum(timings) / len(timings) * 1000:>9.1f}'
+                )
+
+    def seed(self, size, admin, sources, stages, batch_size):
+        """Bulk-insert `size` leads and one deal per 10 leads spread over the past year"""
+        now = timezone.now()
+        account = Account.objects.create(name='Benchmark account', created_by=admin)
+        # Only touch the rows seeded here when backdating below
+        seeded_after = {model: model.objects.aggregate(last=Max('id'))['last'] or 0 for model in (Lead, Deal)}
+
+        created = 0
+        while created < size:
+            count = min(batch_size, size - created)
+            Lead.objects.bulk_create([
+                Lead(first_name='Bench', last_name=str(created + i), lead_source=random.choice(sources),
+                     created_by=admin, assigned_to=admin)
+                for i in range(count)
+            ], batch_size=batch_size)
+            Deal.objects.bulk_create([
+                Deal(name=f'Bench deal {created + i}', account=account, amount=random.randint(100, 10000),
+                     closing_date=now.date(), stage=random.choice(stages), created_by=admin)
+                for i in range(count // 10)
+            ], batch_size=batch_size)
+            created += count
+
+        # auto_now_add ignores explicit values, so spread created_at afterwards:
+        # split each table's id range into one slice per week of the past year
+        weeks = 52
+        for model in (Lead, Deal):
+            ids = model.objects.filter(id__gt=seeded_after[model]).aggregate(low=Min('id'), high=Max('id'))
+            if ids['low'] is None:
+                continue
+            step = (ids['high'] - ids['low']) // weeks + 1
+            for week in range(weeks):
+                low = ids['low'] + week * step
+                model.objects.filter(id__gte=low, id__lt=low + step).update(
+                    created_at=now - timedelta(days=week * 7)
+                )
+
+        # bulk_create/update bypass the rollup signals, so rebuild the seeded year
+        today = timezone.localdate()
+        started = time.perf_counter()
+        for model in (Lead, Deal):
+            rebuild_range(ROLLUPS[model], today - timedelta(days=366), today)
+        self.stdout.write(f'  rollups for {size} leads rebuilt in {time.perf_counter() - started:.1f}s')
+
+    def measure(self, metrics, user, runs):
+        """Return (queries per call, [seconds per run])"""
+        metrics(user)  # warm-up
+        timings = []
+        for _ in range(runs):
+            with CaptureQueriesContext(connection) as ctx:
+                started = time.perf_counter()
+                metrics(user)
+                timings.append(time.perf_counter() - started)
+        return len(ctx.captured_queries), timings
+
+
+def legacy_metrics(user):
+    """The admin-role KPIs as admin_dashboard computed them before dashboard.py"""
+    now = timezone.now()
+    since = now - timedelta(days=30)
+    won = Deal.objects.filter(stage='closed_won')
+    metrics = {
+        'total_users': User.objects.count(),
+        'new_users': User.objects.filter(date_joined__gte=since).count(),
+        'total_leads': Lead.objects.count(),
+        'new_leads': Lead.objects.filter(created_at__gte=since).count(),
+        'total_deals': Deal.objects.count(),
+        'new_deals': Deal.objects.filter(created_at__gte=since).count(),
+        'total_revenue': won.aggregate(Sum('amount'))['amount__sum'] or 0,
+        'last_month_revenue': won.filter(created_at__gte=now - timedelta(days=60),
+                                         created_at__lt=since).aggregate(Sum('amount'))['amount__sum'] or 0,
+    }
+    monthly_revenue = [0] * 12
+    monthly_deals = [0] * 12
+    for deal in won.filter(created_at__year=now.year):
+        monthly_revenue[deal.created_at.month - 1] += deal.amount
+        monthly_deals[deal.created_at.month - 1] += 1
+    metrics['monthly_revenue'], metrics['monthly_deals'] = monthly_revenue, monthly_deals
+    metrics['lead_sources'] = {
+        value: Lead.objects.filter(Q(lead_source=value) | Q(lead_source='website') if value == 'website_demo'
+                                   else Q(lead_source=value)).count()
+        for value, _label in Lead.LEAD_SOURCES
+    }
+    return metrics
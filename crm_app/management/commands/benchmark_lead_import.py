@@ -0,0 +1,85 @@
+import random
+import tempfile
+import time
+
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from crm_app.importers import LeadImporter, iter_csv_rows, CHUNK_SIZE
+from crm_app.models import Lead
+
+
+class Rollback(Exception):
+    """Raised to throw away the imported benchmark rows"""
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure lead CSV import throughput (rows/sec) on synthetic files. '
+        'Everything is imported inside a transaction that is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', nargs='+', type=int, default=[10000, 50000, 200000],
+                            help='CSV sizes to import (default: 10k 50k 200k)')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+        parser.add_argument('--legacy-rows', type=int, default=2000,
+                            help='Rows for the row-at-a-time baseline (0 to skip)')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'mode':>8} {'rows':>8} {'queries':>8} {'seconds':>8} {'rows/sec':>10}")
+        if options['legacy_rows']:
+            self.run('legacy', options['legacy_rows'], options['chunk_size'])
+        for size in options['rows']:
+            self.run('bulk', size, options['chunk_size'])
+
+    def run(self, mode, size, chunk_size):
+        prefix = f'bench_{mode}_{size}'
+        with tempfile.TemporaryFile() as handle:
+            self.write_csv(handle, size, prefix)
+            upload = File(handle, name='bench.csv')
+            try:
+                with transaction.atomic():
+                    admin = User.objects.create(username=f'{prefix}_admin', is_staff=True)
+                    User.objects.bulk_create([User(username=f'{prefix}_rep{i}') for i in range(20)])
+                    self.queries = 0
+                    with connection.execute_wrapper(self.count_query):
+                        started = time.perf_counter()
+                        if mode == 'bulk':
+                            LeadImporter(admin, chunk_size=chunk_size).run(iter_csv_rows(upload))
+                        else:
+                            self.legacy_import(admin, iter_csv_rows(upload))
+                        elapsed = time.perf_counter() - started
+                    raise Rollback()
+            except Rollback:
+                pass
+
+        self.stdout.write(
+            f'{mode:>8} {size:>8} {self.queries:>8} {elapsed:>8.2f} {size / elapsed:>10.0f}'
+        )
+
+    def count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def write_csv(self, handle, size, prefix):
+        sources = [value for value, _label in Lead.LEAD_SOURCES]
+        handle.write(b'first_name,last_name,email,phone,company,job_title,lead_source,lead_status,assigned_to\n')
+        for i in range(size):
+            rep = f'{prefix}_rep{i % 20}'
+            handle.write(
+                f'Bench,Lead{i},lead{i}@example.com,555{i:07d},Company {i % 500},Buyer,'
+                f'{random.choice(sources)},new,{rep}\n'.encode()
+            )
+        handle.seek(0)
+
+    def legacy_import(self, admin, rows):
+        """The previous admin_lead_import loop: one user lookup and one INSERT per row"""
+        for _line, row in rows:
+            lead = Lead(first_name=row['first_name'], last_name=row['last_name'], email=row['email'],
+                        phone=row['phone'], company=row['company'], title=row['job_title'],
+                        lead_source=row['lead_source'], lead_status=row['lead_status'], created_by=admin)
+            lead.assigned_to = User.objects.filter(username=row['assigned_to']).first()
+            lead.save()
@@ -0,0 +1,95 @@
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from crm_app.models import Industry, Lead, Task
+from crm_app.read_serializers import LeadReadSerializer, TaskReadSerializer
+from crm_app.serializers import LeadSerializer, TaskSerializer
+from crm_app.views import LeadViewSet, TaskViewSet
+
+
+class Rollback(Exception):
+    """Raised to throw away the seeded benchmark rows"""
+
+
+class Command(BaseCommand):
+    help = (
+        'Time one list page of leads and tasks through the ModelSerializers '
+        '(LeadSerializer, TaskSerializer) and through the values()-based read '
+        'serializers, query included. The rows are created inside a '
+        'transaction that is rolled back afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000],
+                            help='Rows per response (default: 1k 10k)')
+        parser.add_argument('--runs', type=int, default=5, help='Timed runs per size')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'entity':>7} {'rows':>7} {'serializer':>22} {'best ms':>9} {'avg ms':>9} {'speedup':>8}")
+        for size in options['sizes']:
+            try:
+                with transaction.atomic():
+                    admin = User.objects.create(username=f'bench_lists_{size}', first_name='Bench',
+                                                last_name='Admin', is_staff=True)
+                    self.seed(size, admin)
+                    cases = [
+                        ('lead', Lead.objects.filter(created_by=admin).order_by('-created_at', '-id'),
+                         LeadViewSet, LeadSerializer, LeadReadSerializer),
+                        ('task', Task.objects.filter(created_by=admin).order_by('-created_at', '-id'),
+                         TaskViewSet, TaskSerializer, TaskReadSerializer),
+                    ]
+                    for entity, queryset, viewset, serializer_class, reader_class in cases:
+                        self.compare(entity, size, queryset, viewset, serializer_class, reader_class,
+                                     options['runs'])
+                    raise Rollback()
+            except Rollback:
+                pass
+
+    def seed(self, size, admin):
+        """size leads and size tasks, each task related to a lead"""
+        industry = Industry.objects.create(name=f'Bench industry {size}')
+        Lead.objects.bulk_create([
+            Lead(salutation='mr', first_name='Bench', last_name=str(i), company=f'Company {i}',
+                 email=f'bench{i}@example.com', phone='9876543210', industry=industry,
+                 annual_revenue=Decimal('125000.00'), description='Seeded for benchmark_list_serializers',
+                 address='1 Bench Road, Pune', assigned_to=admin, created_by=admin, manager_username=admin.username)
+            for i in range(size)
+        ], batch_size=1000)
+        lead_ids = list(Lead.objects.filter(created_by=admin).values_list('id', flat=True))
+        due = timezone.now() + timedelta(days=7)
+        Task.objects.bulk_create([
+            Task(subject=f'Call lead {i}', due_date=due, description='Seeded for benchmark_list_serializers',
+                 assigned_to=admin, created_by=admin, related_lead_id=lead_ids[i % len(lead_ids)])
+            for i in range(size)
+        ], batch_size=1000)
+
+    def compare(self, entity, size, queryset, viewset, serializer_class, reader_class, runs):
+        def model_serializer():
+            return serializer_class(viewset.with_profile(queryset)[:size], many=True).data
+
+        def read_serializer():
+            reader = reader_class()
+            return reader.render_many(reader.values(queryset)[:size])
+
+        timings = {}
+        for name, function in (('ModelSerializer', model_serializer), ('values() serializer', read_serializer)):
+            function()  # warm-up
+            timings[name] = []
+            for _ in range(runs):
+                started = time.perf_counter()
+                function()
+                timings[name].append(time.perf_counter() - started)
+
+        baseline = min(timings['ModelSerializer'])
+        for name, runs_taken in timings.items():
+            best = min(runs_taken)
+            self.stdout.write(
+                f'{entity:>7} {size:>7} {name:>22} {best * 1000:>9.1f} '
+                f'{sum(runs_taken) / len(runs_taken) * 1000:>9.1f} {baseline / best:>7.1f}x'
+            )
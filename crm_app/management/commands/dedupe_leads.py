@@ -0,0 +1,73 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from crm_app import dedup
+from crm_app.exports import iter_batches
+from crm_app.models import Lead
+
+
+class Command(BaseCommand):
+    help = (
+        'Store the dedup keys (normalized email / E.164 phone) of every lead, then merge leads '
+        'sharing a key into the oldest of them. Run it once after deploying the LeadDedupKey '
+        'table, and whenever LEAD_INGEST_MODE was "insert" for a while.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000, help='Leads read per query')
+        parser.add_argument('--dry-run', action='store_true', help='Report the duplicate groups without merging')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        batch_size = options['batch_size']
+        lookups = ['pk', 'email', 'phone', 'mobile']
+
+        # Pass 1: claim unclaimed keys in pk order, so the oldest lead owns each key
+        for batch in iter_batches(Lead._base_manager.all(), lookups, batch_size):
+            dedup.register_leads(batch)
+
+        # Pass 2: a lead whose key is owned by another lead is a duplicate of it.
+        # parent links every duplicate to a lead with a smaller pk.
+        parent = {}
+
+        def root(pk):
+            while pk in parent:
+                pk = parent[pk]
+            return pk
+
+        for batch in iter_batches(Lead._base_manager.all(), lookups, batch_size):
+            keys = {row[0]: dedup.dedup_keys(*row[1:]) for row in batch}
+            owners = dedup.key_owners({key for lead_keys in keys.values() for key in lead_keys})
+            for pk, lead_keys in keys.items():
+                for key in lead_keys:
+                    owner = owners.get(key)
+                    if owner is None or owner == pk:
+                        continue
+                    first, second = sorted((root(pk), root(owner)))
+                    if first != second:
+                        parent[second] = first
+
+        groups = {}
+        for pk in parent:
+            groups.setdefault(root(pk), []).append(pk)
+        duplicates = sum(len(members) for members in groups.values())
+        if options['dry_run']:
+            self.stdout.write(f'{len(groups)} leads have {duplicates} duplicates (dry run, nothing merged)')
+            return
+
+        # Pass 3: merge group by group, each in its own transaction
+        survivor_ids = sorted(groups)
+        for start in range(0, len(survivor_ids), batch_size):
+            chunk = survivor_ids[start:start + batch_size]
+            leads = Lead._base_manager.in_bulk(chunk + [pk for survivor in chunk for pk in groups[survivor]])
+            for survivor in chunk:
+                if survivor not in leads:
+                    continue
+                members = [leads[pk] for pk in sorted(groups[survivor]) if pk in leads]
+                dedup.merge_leads(leads[survivor], members)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Merged {duplicates} duplicates into {len(groups)} leads '
+            f'in {time.perf_counter() - started:.1f}s'
+        ))
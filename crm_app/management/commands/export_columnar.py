@@ -0,0 +1,158 @@
+import json
+import os
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from crm_app.exports import iter_batches
+from crm_app.models import Deal, Lead, Transaction, UserActivityLog
+
+# name -> (model, watermark field).
+#
+# updated_at is set before the row's transaction commits, so a run can't
+# export up to "now": a row stamped a moment earlier may still be invisible
+# and would fall behind the next watermark for good. Those sources are
+# exported up to COLUMNAR_EXPORT_LAG_SECONDS ago instead; each file holds
+# one row per pk and readers keep the newest version of a pk across files.
+#
+# The activity log is append-only, but its timestamp is taken when an entry
+# is logged and the buffered writer (activity.py) inserts it seconds later,
+# so it uses the id, which is assigned at insert time.
+SOURCES = {
+    'leads': (Lead, 'updated_at'),
+    'deals': (Deal, 'updated_at'),
+    'transactions': (Transaction, 'updated_at'),
+    'activity': (UserActivityLog, 'id'),
+}
+
+WATERMARK_FILE = '_watermarks.json'
+
+
+def arrow_type(pa, field):
+    """Arrow type for a concrete model field (foreign keys export their id)"""
+    if isinstance(field, models.ForeignKey):
+        return arrow_type(pa, field.target_field)
+    if isinstance(field, models.DecimalField):
+        return pa.decimal128(field.max_digits, field.decimal_places)
+    if isinstance(field, models.DateTimeField):
+        return pa.timestamp('us', tz='UTC')
+    if isinstance(field, models.DateField):
+        return pa.date32()
+    if isinstance(field, models.BooleanField):
+        return pa.bool_()
+    if isinstance(field, (models.AutoField, models.BigAutoField, models.IntegerField)):
+        return pa.int64()
+    if isinstance(field, models.FloatField):
+        return pa.float64()
+    # Char/Text/Email/URL/IP fields, and JSON serialized to text
+    return pa.string()
+
+
+class Command(BaseCommand):
+    help = (
+        'Write Lead, Deal, Transaction and UserActivityLog snapshots as Parquet files '
+        '(one directory per source) for the BI team. With --incremental only rows changed '
+        'since the previous run are written. Requires pyarrow.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output-dir', required=True,
+                            help='Target directory (keep it out of MEDIA_ROOT: it holds every row)')
+        parser.add_argument('--sources', nargs='+', choices=sorted(SOURCES), default=sorted(SOURCES))
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only rows whose watermark field moved past the last recorded run')
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Rows per query and Parquet row group')
+        parser.add_argument('--compression', default='snappy')
+
+    def handle(self, *args, **options):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise CommandError('export_columnar needs pyarrow (pip install pyarrow)')
+        self.pa, self.pq = pa, pq
+
+        output_dir = Path(options['output_dir'])
+        output_dir.mkdir(parents=True, exist_ok=True)
+        watermarks = self.read_watermarks(output_dir)
+
+        snapshot_at = timezone.now()
+        # Rows updated up to this instant are exported; it becomes the next watermark
+        settled_at = snapshot_at - timedelta(seconds=getattr(settings, 'COLUMNAR_EXPORT_LAG_SECONDS', 300))
+        for name in options['sources']:
+            model, watermark_field = SOURCES[name]
+            since = self.parse_watermark(model, watermark_field, watermarks.get(name)) \
+                if options['incremental'] else None
+            if watermark_field == 'id':
+                until = model._base_manager.aggregate(last=models.Max('id'))['last'] or 0
+            else:
+                until = settled_at
+            queryset = model._base_manager.filter(**{f'{watermark_field}__lte': until})
+            if since is not None:
+                queryset = queryset.filter(**{f'{watermark_field}__gt': since})
+
+            path, rows = self.export(name, model, queryset, output_dir, snapshot_at, since, options)
+            watermarks[name] = until if watermark_field == 'id' else until.isoformat()
+            # Record progress after each file, so a failure later on doesn't redo this source
+            self.write_watermarks(output_dir, watermarks)
+            self.stdout.write(self.style.SUCCESS(f'{name}: {rows} rows -> {path}'))
+
+    def export(self, name, model, queryset, output_dir, snapshot_at, since, options):
+        pa = self.pa
+        fields = model._meta.concrete_fields
+        schema = pa.schema([pa.field(field.attname, arrow_type(pa, field), nullable=field.null)
+                            for field in fields])
+        json_columns = {i for i, field in enumerate(fields) if isinstance(field, models.JSONField)}
+
+        target_dir = output_dir / name
+        target_dir.mkdir(exist_ok=True)
+        kind = 'full' if since is None else 'incremental'
+        path = target_dir / f'{name}-{snapshot_at:%Y%m%dT%H%M%S}-{kind}.parquet'
+        tmp_path = path.with_name(path.name + '.tmp')
+
+        # Write to a temporary file and rename it, so readers never see a
+        # half-written snapshot
+        rows = 0
+        try:
+            with self.pq.ParquetWriter(tmp_path, schema, compression=options['compression']) as writer:
+                lookups = [field.attname for field in fields]
+                for batch in iter_batches(queryset, lookups, options['chunk_size']):
+                    columns = list(zip(*batch))
+                    for i in json_columns:
+                        columns[i] = [None if value is None else json.dumps(value) for value in columns[i]]
+                    writer.write_batch(pa.record_batch(columns, schema=schema))
+                    rows += len(batch)
+            os.replace(tmp_path, path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        return path, rows
+
+    def parse_watermark(self, model, watermark_field, value):
+        """The recorded watermark as a datetime or an id (None when there is none)"""
+        if value is None:
+            return None
+        if watermark_field != 'id':
+            return parse_datetime(value)
+        if isinstance(value, str):
+            # Recorded as a timestamp by older versions: start after the last row logged by then
+            return model._base_manager.filter(timestamp__lte=parse_datetime(value)) \
+                .aggregate(last=models.Max('id'))['last'] or 0
+        return value
+
+    def read_watermarks(self, output_dir):
+        path = output_dir / WATERMARK_FILE
+        if not path.exists():
+            return {}
+        return json.loads(path.read_text())
+
+    def write_watermarks(self, output_dir, watermarks):
+        path = output_dir / WATERMARK_FILE
+        tmp_path = path.with_name(path.name + '.tmp')
+        tmp_path.write_text(json.dumps(watermarks, indent=2))
+        os.replace(tmp_path, path)
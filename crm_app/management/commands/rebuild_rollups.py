@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from crm_app.models import Lead, Deal, Task
+from crm_app.rollups import ROLLUPS, rebuild_range, source_day_range
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the DailyLeadStats/DailyDealStats/DailyTaskStats rollups for a date range'
+
+    MODELS = {'leads': Lead, 'deals': Deal, 'tasks': Task}
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='First local day to rebuild (YYYY-MM-DD). Defaults to the oldest row.')
+        parser.add_argument('--end', help='Last local day to rebuild (YYYY-MM-DD). Defaults to the newest row.')
+        parser.add_argument('--only', choices=sorted(self.MODELS), action='append',
+                            help='Limit to one rollup (can be repeated)')
+        parser.add_argument('--chunk-days', type=int, default=31,
+                            help='Days recomputed per transaction')
+
+    def parse_day(self, value):
+        try:
+            return datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError(f'Invalid date "{value}", expected YYYY-MM-DD')
+
+    def handle(self, *args, **options):
+        start = self.parse_day(options['start']) if options['start'] else None
+        end = self.parse_day(options['end']) if options['end'] else None
+        if start and end and start > end:
+            raise CommandError('--start must not be after --end')
+
+        names = options['only'] or sorted(self.MODELS)
+        for name in names:
+            model = self.MODELS[name]
+            bounds = source_day_range(model)
+            if bounds is None and not (start and end):
+                self.stdout.write(f'{name}: no rows, skipped')
+                continue
+            first = start or bounds[0]
+            last = end or bounds[1]
+
+            written = 0
+            chunk_start = first
+            while chunk_start <= last:
+                chunk_end = min(chunk_start + timedelta(days=options['chunk_days'] - 1), last)
+                written += rebuild_range(ROLLUPS[model], chunk_start, chunk_end)
+                chunk_start = chunk_end + timedelta(days=1)
+
+            self.stdout.write(self.style.SUCCESS(f'{name}: {written} rows for {first} .. {last}'))
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from crm_app.models import SearchDocument
+from crm_app.search import ENTITY_TYPES, index_queryset
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the SearchDocument/SearchToken index for leads, contacts and accounts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', choices=sorted(ENTITY_TYPES), action='append',
+                            help='Limit to one entity type (can be repeated)')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Rows indexed per transaction')
+
+    def handle(self, *args, **options):
+        for entity_type in options['only'] or sorted(ENTITY_TYPES):
+            spec = ENTITY_TYPES[entity_type]
+            started = time.perf_counter()
+            # Documents are replaced chunk by chunk, so search keeps working meanwhile
+            index_queryset(spec.model.objects.all(), chunk_size=options['chunk_size'])
+            orphans, _ = SearchDocument.objects.filter(entity_type=entity_type) \
+                .exclude(object_id__in=spec.model.objects.values('pk')).delete()
+            indexed = SearchDocument.objects.filter(entity_type=entity_type).count()
+            self.stdout.write(self.style.SUCCESS(
+                f'{entity_type}: {indexed} documents indexed, {orphans} stale rows removed '
+                f'in {time.perf_counter() - started:.1f}s'
+            ))
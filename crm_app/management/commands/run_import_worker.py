@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from crm_app.jobs import recover_stale_jobs, run_import_job
+from crm_app.models import ImportJob
+
+
+class Command(BaseCommand):
+    help = (
+        'Run pending admin CSV import jobs, oldest first. Use with '
+        'IMPORT_JOBS_RUNNER = "worker" to keep imports out of the web processes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help='Seconds to wait between polls when there is nothing to do')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once no pending job is left instead of polling forever')
+
+    def handle(self, *args, **options):
+        # Jobs left running by a worker that died before this one started
+        recover_stale_jobs()
+        while True:
+            close_old_connections()
+            job_id = ImportJob.objects.filter(status='pending').order_by('created_at') \
+                .values_list('id', flat=True).first()
+            if job_id is None:
+                recover_stale_jobs()
+                if options['once']:
+                    return
+                time.sleep(options['interval'])
+                continue
+
+            # run_import_job skips the job if another worker claimed it first
+            run_import_job(job_id)
+            job = ImportJob.objects.get(id=job_id)
+            self.stdout.write(
+                f'Job {job.id} ({job.kind}, {job.original_name}): {job.status}, '
+                f'{job.created_count} created, {job.error_count} errors, {job.rows_per_second:.0f} rows/sec'
+            )
@@ -0,0 +1,96 @@
+# Generated by Django 5.0.1 on 2026-10-17 07:07
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# Models that carry both manager_username and the new manager FK, including the
+# rollup tables whose manager_username column is replaced below.
+MANAGER_LINKED_MODELS = [
+    'Account', 'Contact', 'Lead', 'Task', 'UserProfile', 'DailyLeadStats', 'DailyTaskStats',
+]
+
+
+def backfill_manager(apps, schema_editor):
+    """Point manager at the user named by manager_username (one UPDATE per manager)"""
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    user_ids = dict(User.objects.values_list('username', 'id'))
+    for model_name in MANAGER_LINKED_MODELS:
+        model = apps.get_model('crm_app', model_name)
+        usernames = model.objects.exclude(manager_username__isnull=True).exclude(manager_username='') \
+            .values_list('manager_username', flat=True).distinct()
+        for username in list(usernames):
+            if username in user_ids:
+                model.objects.filter(manager_username=username).update(manager_id=user_ids[username])
+
+
+def clear_manager(apps, schema_editor):
+    for model_name in MANAGER_LINKED_MODELS:
+        apps.get_model('crm_app', model_name).objects.update(manager=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm_app', '0010_hot_path_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='manager',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='managed_%(class)ss', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='contact',
+            name='manager',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='managed_%(class)ss', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='dailyleadstats',
+            name='manager',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='dailytaskstats',
+            name='manager',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='lead',
+            name='manager',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='managed_%(class)ss', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='manager',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='managed_%(class)ss', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='manager',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='managed_%(class)ss', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(backfill_manager, clear_manager),
+        migrations.RemoveField(
+            model_name='dailyleadstats',
+            name='manager_username',
+        ),
+        migrations.RemoveField(
+            model_name='dailytaskstats',
+            name='manager_username',
+        ),
+        migrations.RemoveIndex(
+            model_name='lead',
+            name='lead_mgr_assignee_created_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='task',
+            name='task_manager_idx',
+        ),
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(fields=['manager', 'assigned_to', 'created_at'], name='lead_mgr_assignee_created_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.0.1 on 2026-10-17 07:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm_app', '0014_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeadDedupKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, unique=True)),
+                ('lead', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dedup_keys', to='crm_app.lead')),
+            ],
+        ),
+    ]
@@ -0,0 +1,50 @@
+from django.db import migrations
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+# The rollups as they stand at this migration: (source, stats, dimensions,
+# [(measure, date field, aggregate, condition)]). Signals only apply changes
+# from here on, so the tables are recomputed once from every existing row.
+ROLLUPS = [
+    ('Lead', 'DailyLeadStats', ['assigned_to_id', 'created_by_id', 'manager_id', 'lead_source', 'lead_status'],
+     [('lead_count', 'created_at', Count('id'), {})]),
+    ('Deal', 'DailyDealStats', ['assigned_to_id', 'created_by_id', 'stage'],
+     [('deal_count', 'created_at', Count('id'), {}), ('amount', 'created_at', Sum('amount'), {})]),
+    ('Task', 'DailyTaskStats', ['assigned_to_id', 'created_by_id', 'manager_id', 'priority'],
+     [('created_count', 'created_at', Count('id'), {}),
+      ('completed_count', 'completed_date', Count('id'), {'status': 'completed'})]),
+]
+
+
+def backfill_rollups(apps, schema_editor):
+    for source_name, stats_name, dimensions, measures in ROLLUPS:
+        source = apps.get_model('crm_app', source_name)
+        stats = apps.get_model('crm_app', stats_name)
+        rows = {}
+        for name, date_field, aggregate, condition in measures:
+            grouped = (
+                source.objects.filter(**{f'{date_field}__isnull': False}, **condition)
+                .order_by()
+                .annotate(rollup_day=TruncDate(date_field))
+                .values('rollup_day', *dimensions)
+                .annotate(value=aggregate)
+            )
+            for row in grouped.iterator():
+                key = (row['rollup_day'],) + tuple(row[dimension] for dimension in dimensions)
+                rows.setdefault(key, {})[name] = row['value'] or 0
+        stats.objects.all().delete()
+        stats.objects.bulk_create([
+            stats(day=key[0], **dict(zip(dimensions, key[1:])), **values)
+            for key, values in rows.items()
+        ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm_app', '0015_lead_dedup_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
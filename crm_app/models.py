@@ -1,9 +1,92 @@
+from datetime import timedelta
+
+from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 
 # Create your models here.
 
+def is_manager_user(user):
+    """Return True if the user's profile role is 'manager'"""
+    return bool(hasattr(user, 'profile') and user.profile and user.profile.role
+                and user.profile.role.lower() == 'manager')
+
+
+class VisibleQuerySet(models.QuerySet):
+    """
+    Row-level visibility shared by the CRM entities.
+
+    • Staff / superuser → every row.
+    • Manager          → rows assigned to / created by the manager or one of
+                         their subordinates, plus rows whose manager FK
+                         points at them (VISIBILITY_MANAGER_FIELD on the model).
+    • Regular user     → rows assigned to or created by them.
+
+    Subordinates are read through a subquery on the indexed UserProfile.manager_id
+    (ManagerHierarchy.subordinates), so the scope is still one query with no
+    join and no DISTINCT, and a reassigned profile takes effect on the next
+    request in every worker.
+    """
+
+    def visible_to(self, user):
+        if user.is_staff or user.is_superuser:
+            return self.all()
+
+        if not is_manager_user(user):
+            return self.filter(models.Q(assigned_to=user) | models.Q(created_by=user))
+
+        from .hierarchy import ManagerHierarchy
+        subordinates = ManagerHierarchy.subordinates(user)
+        scope = (
+            models.Q(assigned_to_id=user.id) | models.Q(created_by_id=user.id) |
+            models.Q(assigned_to_id__in=subordinates) | models.Q(created_by_id__in=subordinates)
+        )
+        manager_field = getattr(self.model, 'VISIBILITY_MANAGER_FIELD', None)
+        if manager_field:
+            scope |= models.Q(**{manager_field: user.id})
+        return self.filter(scope)
+
+
+class ManagerLinkedModel(models.Model):
+    """
+    Base for models that point at a manager.
+
+    manager_username is what most of the app reads and writes; manager is the
+    indexed integer FK the scope queries filter on. save() keeps the two in
+    sync from whichever one was changed since the row was loaded. Writes that
+    skip save() (QuerySet.update, bulk_create) must set both.
+    """
+    manager = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True,
+                                related_name='managed_%(class)ss')
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_manager = (instance.__dict__.get('manager_username'), instance.__dict__.get('manager_id'))
+        return instance
+
+    def sync_manager(self):
+        """Copy manager <-> manager_username, whichever side changed"""
+        loaded_username, loaded_id = getattr(self, '_loaded_manager', (None, None))
+        if self.manager_id != loaded_id and self.manager_username == loaded_username:
+            # The FK was set directly: mirror the username
+            self.manager_username = self.manager.username if self.manager_id else None
+        elif self.manager_username != loaded_username or bool(self.manager_username) != bool(self.manager_id):
+            self.manager_id = User.objects.filter(username=self.manager_username) \
+                .values_list('id', flat=True).first() if self.manager_username else None
+
+    def save(self, *args, **kwargs):
+        self.sync_manager()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'manager', 'manager_username'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'manager', 'manager_username'}
+        super().save(*args, **kwargs)
+        self._loaded_manager = (self.manager_username, self.manager_id)
+
 class Industry(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True, null=True)
@@ -16,7 +99,7 @@ class Industry(models.Model):
     class Meta:
         verbose_name_plural = "Industries"
 
-class Account(models.Model):
+class Account(ManagerLinkedModel):
     ACCOUNT_TYPES = (
         ('customer', 'Customer'),
         ('competitor', 'Competitor'),
@@ -44,10 +127,18 @@ class Account(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    VISIBILITY_MANAGER_FIELD = 'manager_id'
+    objects = VisibleQuerySet.as_manager()
+
     def __str__(self):
         return self.name
 
-class Contact(models.Model):
+    class Meta:
+        indexes = [
+            models.Index(fields=['manager_username'], name='account_manager_idx'),
+        ]
+
+class Contact(ManagerLinkedModel):
     SALUTATIONS = (
         ('mr', 'Mr.'),
         ('ms', 'Ms.'),
@@ -73,10 +164,18 @@ class Contact(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    VISIBILITY_MANAGER_FIELD = 'manager_id'
+    objects = VisibleQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
 
-class Lead(models.Model):
+    class Meta:
+        indexes = [
+            models.Index(fields=['manager_username'], name='contact_manager_idx'),
+        ]
+
+class Lead(ManagerLinkedModel):
     LEAD_SOURCES = (
         ('website_demo', 'Website - {Demo}'),
         ('website_live', 'Website - {live}'),
@@ -123,9 +222,22 @@ class Lead(models.Model):
     converted_account = models.ForeignKey(Account, on_delete=models.SET_NULL, null=True, blank=True)
     manager_username = models.CharField(max_length=150, blank=True, null=True)
 
+    # Leads are only scoped by owner, not by their manager
+    VISIBILITY_MANAGER_FIELD = None
+    objects = VisibleQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
 
+    class Meta:
+        indexes = [
+            # Manager scope (unassigned leads of the manager) and per-assignee lists, newest first
+            models.Index(fields=['manager', 'assigned_to', 'created_at'], name='lead_mgr_assignee_created_idx'),
+            # Default list ordering and date-range rollups
+            models.Index(fields=['created_at'], name='lead_created_idx'),
+            models.Index(fields=['lead_status', 'created_at'], name='lead_status_created_idx'),
+        ]
+
 class Deal(models.Model):
     DEAL_STAGES = (
         ('qualification', 'Qualification'),
@@ -151,10 +263,20 @@ class Deal(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    VISIBILITY_MANAGER_FIELD = 'account__manager_id'
+    objects = VisibleQuerySet.as_manager()
+
     def __str__(self):
         return self.name
 
-class Task(models.Model):
+    class Meta:
+        indexes = [
+            # Stage distribution and closed-won revenue by period
+            models.Index(fields=['stage', 'created_at'], name='deal_stage_created_idx'),
+            models.Index(fields=['created_at'], name='deal_created_idx'),
+        ]
+
+class Task(ManagerLinkedModel):
     TASK_PRIORITIES = (
         ('high', 'High'),
         ('medium', 'Medium'),
@@ -186,9 +308,21 @@ class Task(models.Model):
     related_deal = models.ForeignKey(Deal, on_delete=models.CASCADE, null=True, blank=True, related_name='tasks')
     manager_username = models.CharField(max_length=150, blank=True, null=True)
 
+    VISIBILITY_MANAGER_FIELD = 'manager_id'
+    objects = VisibleQuerySet.as_manager()
+
     def __str__(self):
         return self.subject
 
+    class Meta:
+        indexes = [
+            # "My open tasks by due date" (dashboard, calendar, task lists)
+            models.Index(fields=['assigned_to', 'status', 'due_date'], name='task_assignee_status_due_idx'),
+            # Date-range rollups for the created/completed charts
+            models.Index(fields=['created_at'], name='task_created_idx'),
+            models.Index(fields=['completed_date'], name='task_completed_idx'),
+        ]
+
 class Event(models.Model):
     title = models.CharField(max_length=200)
     start_time = models.DateTimeField()
@@ -295,7 +429,7 @@ class DealProduct(models.Model):
         self.total_price = self.quantity * self.unit_price * (1 - self.discount_percentage / 100)
         super().save(*args, **kwargs)
 
-class UserProfile(models.Model):
+class UserProfile(ManagerLinkedModel):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     phone = models.CharField(max_length=20, blank=True, null=True)
     address = models.TextField(blank=True, null=True)
@@ -369,6 +503,54 @@ class AllotManager(models.Model):
         return f"{self.get_country_display()} - {self.manager_username if self.manager_username else 'Unassigned'}"
 
 
+def month_start(value):
+    """First instant of the local calendar month containing `value` (aware datetime)"""
+    local = timezone.localtime(value)
+    return local.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month_start(value):
+    """First instant of the local month after the one starting at `value`"""
+    first = month_start(value)
+    following = (first + timedelta(days=32)).replace(day=1)
+    # Re-localize so a DST change between the two months keeps midnight
+    return timezone.make_aware(following.replace(tzinfo=None))
+
+
+class ActivityLogQuerySet(models.QuerySet):
+    """
+    Monthly partitions of the activity log.
+
+    A partition is the rows of one local calendar month. Bounding queries
+    with partition() turns them into a range scan over the timestamp
+    indexes instead of a walk over the whole (ever-growing) table; months
+    past the retention window are moved out by `archive_activity_logs`.
+    """
+
+    def partition(self, when=None):
+        """Rows of the month containing `when` (default: the current month)"""
+        start = month_start(when or timezone.now())
+        return self.filter(timestamp__gte=start, timestamp__lt=next_month_start(start))
+
+    def recent(self, limit, max_partitions=None):
+        """
+        Newest `limit` rows, newest first, reading one partition at a time.
+
+        The current month is usually enough; older months are only read when
+        it holds fewer than `limit` matching rows.
+        """
+        if max_partitions is None:
+            max_partitions = getattr(settings, 'ACTIVITY_LOG_RETENTION_MONTHS', 12) + 1
+        rows = []
+        start = month_start(timezone.now())
+        for _ in range(max_partitions):
+            rows.extend(self.partition(start).order_by('-timestamp')[:limit - len(rows)])
+            if len(rows) >= limit:
+                break
+            start = month_start(start - timedelta(days=1))
+        return rows
+
+
 class UserActivityLog(models.Model):
     ACTION_TYPES = (
         ('login', 'Login'),
@@ -386,11 +568,19 @@ class UserActivityLog(models.Model):
     model_affected = models.CharField(max_length=100, blank=True, null=True)
     object_id = models.PositiveIntegerField(blank=True, null=True)
     ip_address = models.GenericIPAddressField(blank=True, null=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the row is built, not when the buffered writer inserts it
+    timestamp = models.DateTimeField(default=timezone.now)
     additional_data = models.JSONField(blank=True, null=True)
+
+    objects = ActivityLogQuerySet.as_manager()
     
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            # Per-user activity history, newest first
+            models.Index(fields=['user', 'timestamp'], name='activity_user_timestamp_idx'),
+            models.Index(fields=['timestamp'], name='activity_timestamp_idx'),
+        ]
 
 class UserSettings(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='settings')
@@ -430,3 +620,165 @@ class UserSettings(models.Model):
         
     def __str__(self):
         return f"{self.user.username} - {self.action_type} - {self.timestamp.strftime('%Y-%m-%d %H:%M:%S')}"
+
+
+class ImportJob(models.Model):
+    """An admin CSV upload, imported in the background (see jobs.py)"""
+    KINDS = (
+        ('leads', 'Leads'),
+        ('contacts', 'Contacts'),
+        ('accounts', 'Accounts'),
+        ('deals', 'Deals'),
+        ('products', 'Products'),
+        ('transactions', 'Transactions'),
+    )
+    STATUSES = (
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    )
+
+    kind = models.CharField(max_length=20, choices=KINDS)
+    file = models.FileField(upload_to='imports/', blank=True)
+    original_name = models.CharField(max_length=255)
+    has_header = models.BooleanField(default=True)
+    status = models.CharField(max_length=20, choices=STATUSES, default='pending')
+    rows_processed = models.PositiveIntegerField(default=0)
+    created_count = models.PositiveIntegerField(default=0)
+    error_count = models.PositiveIntegerField(default=0)
+    # First MAX_REPORTED_ERRORS row errors: [{'line': ..., 'error': ...}]
+    errors = models.JSONField(default=list, blank=True)
+    # Why a failed job stopped
+    message = models.TextField(blank=True, null=True)
+    elapsed = models.FloatField(default=0)  # seconds spent importing
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='import_jobs')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    # Touched by the runner on claim and after every chunk; a running job
+    # whose heartbeat stops is failed by jobs.recover_stale_jobs()
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # The worker polls for the oldest pending job
+            models.Index(fields=['status', 'created_at'], name='importjob_status_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} import {self.original_name} ({self.status})"
+
+    @property
+    def is_finished(self):
+        return self.status in ('completed', 'failed')
+
+    @property
+    def rows_per_second(self):
+        return self.rows_processed / self.elapsed if self.elapsed else 0.0
+
+
+# Search index
+# One SearchDocument per indexed lead, contact and account, with its owner
+# columns copied so VisibleQuerySet can scope hits without touching the
+# source tables, and one SearchToken row per normalized token. Queries are
+# prefix range scans on the (token, document) index. Maintained by
+# signals and search.py; rebuilt with `manage.py rebuild_search_index`.
+
+class SearchDocument(models.Model):
+    ENTITY_TYPES = (
+        ('lead', 'Lead'),
+        ('contact', 'Contact'),
+        ('account', 'Account'),
+    )
+
+    # "<entity_type>:<object_id>", known before insert so tokens can be
+    # bulk-created on backends that don't return primary keys
+    key = models.CharField(max_length=32, primary_key=True)
+    entity_type = models.CharField(max_length=10, choices=ENTITY_TYPES)
+    object_id = models.BigIntegerField()
+    title = models.CharField(max_length=255)
+    subtitle = models.CharField(max_length=255, blank=True)
+    assigned_to = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='+')
+    created_by = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='+')
+    # Only set for entity types whose visibility includes their manager
+    manager = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='+')
+    updated_at = models.DateTimeField()  # the source row's, for recency ranking
+
+    VISIBILITY_MANAGER_FIELD = 'manager_id'
+    objects = VisibleQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.entity_type} {self.object_id}: {self.title}"
+
+
+class SearchToken(models.Model):
+    document = models.ForeignKey(SearchDocument, on_delete=models.CASCADE, related_name='tokens')
+    token = models.CharField(max_length=64)
+
+    class Meta:
+        indexes = [
+            # Covering index: a prefix query reads document keys straight from it
+            models.Index(fields=['token', 'document'], name='search_token_prefix_idx'),
+        ]
+
+
+class LeadDedupKey(models.Model):
+    """
+    Normalized identity of a lead ("email:ann@example.com",
+    "phone:+919876543210"). The unique key makes "is this lead already
+    here?" a single index lookup; see dedup.py.
+    """
+    key = models.CharField(max_length=255, unique=True)
+    lead = models.ForeignKey(Lead, on_delete=models.CASCADE, related_name='dedup_keys')
+
+    def __str__(self):
+        return f"{self.key} -> lead {self.lead_id}"
+
+
+# Daily rollups
+# One row per local day and combination of the columns the dashboards filter
+# or group on. The owner/manager columns keep the names of the source model so the
+# same visibility Q objects work on both. Signals keep them current with F()
+# updates (see rollups.py); `manage.py rebuild_rollups` recomputes a range.
+
+class DailyLeadStats(models.Model):
+    day = models.DateField()
+    assigned_to = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='+')
+    created_by = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='+')
+    manager = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='+')
+    lead_source = models.CharField(max_length=20)
+    lead_status = models.CharField(max_length=20)
+    lead_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=['day'])]
+        verbose_name_plural = "Daily lead stats"
+
+
+class DailyDealStats(models.Model):
+    day = models.DateField()
+    assigned_to = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='+')
+    created_by = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='+')
+    stage = models.CharField(max_length=30)
+    deal_count = models.PositiveIntegerField(default=0)
+    amount = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=['day'])]
+        verbose_name_plural = "Daily deal stats"
+
+
+class DailyTaskStats(models.Model):
+    day = models.DateField()
+    assigned_to = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='+')
+    created_by = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='+')
+    manager = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='+')
+    priority = models.CharField(max_length=10)
+    created_count = models.PositiveIntegerField(default=0)  # tasks created that day
+    completed_count = models.PositiveIntegerField(default=0)  # tasks completed that day
+
+    class Meta:
+        indexes = [models.Index(fields=['day'])]
+        verbose_name_plural = "Daily task stats"
@@ -0,0 +1,157 @@
+"""
+Pagination for the REST list endpoints.
+
+Lists are page-number paginated by default (``?page=3&page_size=100``).
+Passing ``?cursor=`` (empty for the first page) switches to keyset paging
+on ``(created_at, id)``: each page is fetched with a WHERE on the last row
+seen instead of an OFFSET, so deep pages cost the same as the first one
+and rows inserted while a client is paging do not shift it.
+"""
+import base64
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetCursorPagination(BasePagination):
+    """
+    Forward-only cursor over a unique ordering (newest first by default).
+
+    The cursor is the ordering values of the last row of the previous page.
+    Views can override the ordering with a ``cursor_ordering`` attribute;
+    models without ``created_at`` fall back to ``-id``.
+    """
+    cursor_query_param = 'cursor'
+    default_ordering = ('-created_at', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self, page_size, page_size_query_param=None, max_page_size=None):
+        self.page_size = page_size
+        self.page_size_query_param = page_size_query_param
+        self.max_page_size = max_page_size
+
+    @classmethod
+    def get_ordering(cls, queryset, view):
+        ordering = getattr(view, 'cursor_ordering', None)
+        if ordering:
+            return tuple(ordering)
+        try:
+            queryset.model._meta.get_field('created_at')
+        except FieldDoesNotExist:
+            return ('-id',)
+        return cls.default_ordering
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                size = int(request.query_params[self.page_size_query_param])
+                if size > 0:
+                    return min(size, self.max_page_size) if self.max_page_size else size
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset, view)
+        self.fields = [name.lstrip('-') for name in self.ordering]
+
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(queryset.model, request.query_params.get(self.cursor_query_param))
+        if position is not None:
+            queryset = queryset.filter(self.after(position))
+
+        # One extra row tells us whether there is a next page
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def after(self, position):
+        """
+        Rows strictly after `position` in the ordering, as a tuple comparison
+        spelled out with Q objects: (a < x) OR (a = x AND b < y) OR ...
+        """
+        condition = Q()
+        for index, name in enumerate(self.ordering):
+            field = self.fields[index]
+            lookup = 'lt' if name.startswith('-') else 'gt'
+            step = Q(**{f'{field}__{lookup}': position[index]})
+            for previous in range(index):
+                step &= Q(**{self.fields[previous]: position[previous]})
+            condition |= step
+        return condition
+
+    def encode_cursor(self, row):
+        values = []
+        for field in self.fields:
+            value = getattr(row, field) if not isinstance(row, dict) else row[field]
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def decode_cursor(self, model, encoded):
+        if not encoded:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            if not isinstance(values, list) or len(values) != len(self.fields):
+                raise ValueError
+            return [
+                model._meta.get_field(field).to_python(value)
+                for field, value in zip(self.fields, values)
+            ]
+        except (TypeError, ValueError, UnicodeDecodeError, ValidationError, FieldDoesNotExist):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class StandardPagination(PageNumberPagination):
+    """
+    Default pagination for every ViewSet: page numbers, or keyset cursors
+    when the request carries a ``cursor`` parameter.
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    cursor_class = KeysetCursorPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor = None
+        if self.cursor_class.cursor_query_param in request.query_params:
+            self.cursor = self.cursor_class(self.page_size, self.page_size_query_param, self.max_page_size)
+            return self.cursor.paginate_queryset(queryset, request, view)
+        if not queryset.ordered:
+            # Pages of an unordered queryset can overlap; use the cursor order
+            queryset = queryset.order_by(*self.cursor_class.get_ordering(queryset, view))
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor is not None:
+            return self.cursor.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,140 @@
+"""
+values()-based read serializers for the high-volume list endpoints.
+
+Once lists are paginated, most of the time spent on a large GET /api/leads/,
+/api/tasks/ or /api/transactions/ page goes to the ModelSerializer: every row
+walks a dozen field objects (get_attribute, to_representation) and builds
+an OrderedDict. For plain GET list requests those ViewSets use the
+ValuesSerializer in read_serializer_class instead. The page is read with
+QuerySet.values(), and each row is turned into its dict by one function
+compiled per field selection (fieldsets.compile_renderer). Each class keeps
+the RENDERER_CACHE_SIZE most recently used selections; ?fields= is client
+input, so the set of selections isn't bounded by anything else.
+
+A ValuesSerializer returns exactly what its serializer_class would: the
+same keys in the same order, the same values, and no key where the
+serializer skips one (a name read through an empty relation). Fields
+backed by one column are derived from serializer_class. The rest are
+listed in `computed`, and a field that can't be read raises
+ImproperlyConfigured the first time the class is used.
+
+`manage.py benchmark_list_serializers` compares both paths.
+"""
+from functools import lru_cache
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .fieldsets import Column, compile_renderer, lean_column, resolve_source, serializer_fields
+from .models import Lead
+from .serializers import LeadSerializer, TaskSerializer, TransactionSerializer
+
+# Compiled renderers kept per ValuesSerializer class, one per field selection
+RENDERER_CACHE_SIZE = 64
+
+
+def person_name(relation, guards=()):
+    """Column for "<relation>.get_full_name" (User.get_full_name on .values() rows)"""
+    first, last = f'{relation}__first_name', f'{relation}__last_name'
+    return Column((first, last), function=lambda row: f'{row[first]} {row[last]}'.strip(), guards=guards)
+
+
+class ValuesSerializer:
+    """Renders .values() rows the way serializer_class renders instances"""
+    serializer_class = None
+    # {field name: Column} for fields that aren't a single column
+    computed = {}
+
+    def __init__(self, fields=None):
+        columns = self.get_columns()
+        names = tuple(name for name in columns if not fields or name in fields)
+        self.columns = {name: columns[name] for name in names}
+        self.render = self.get_renderer(names)
+
+    @classmethod
+    def get_renderer(cls, names):
+        """The compiled renderer for a tuple of field names (LRU-cached per class)"""
+        renderer = cls.__dict__.get('_renderer')
+        if renderer is None:
+            columns = cls.get_columns()
+            renderer = cls._renderer = lru_cache(maxsize=RENDERER_CACHE_SIZE)(
+                lambda names: compile_renderer({name: columns[name] for name in names})
+            )
+        return renderer(names)
+
+    @classmethod
+    def get_columns(cls):
+        """Every serializer field's Column, in the serializer's order (built once per class)"""
+        columns = cls.__dict__.get('_columns')
+        if columns is None:
+            columns = cls._columns = {
+                name: cls.get_column(name) for name in serializer_fields(cls.serializer_class)
+            }
+        return columns
+
+    @classmethod
+    def get_column(cls, name):
+        if name in cls.computed:
+            return cls.computed[name]
+        column = lean_column(cls.serializer_class, name)
+        if column is not None:
+            return column
+        parts = serializer_fields(cls.serializer_class)[name].source.split('.')
+        if len(parts) > 1 and parts[-1] == 'get_full_name':
+            relation = resolve_source(cls.serializer_class.Meta.model, '.'.join(parts[:-1]))
+            if relation is not None:
+                return person_name(relation[0], guards=relation[3] + (relation[0],))
+        raise ImproperlyConfigured(f'{cls.__name__} has no Column for {cls.serializer_class.__name__}.{name}')
+
+    def values(self, queryset, extra=()):
+        """queryset as the .values() rows render() reads; extra lookups are fetched too"""
+        lookups = [lookup for column in self.columns.values() for lookup in column.lookups + column.guards]
+        return queryset.values(*dict.fromkeys(lookups + list(extra)))
+
+    def render_many(self, rows):
+        return list(map(self.render, rows))
+
+
+SALUTATIONS = dict(Lead._meta.get_field('salutation').flatchoices)
+
+
+def lead_full_name(row):
+    salutation = SALUTATIONS.get(row['salutation'], row['salutation']) if row['salutation'] else ''
+    return f"{salutation} {row['first_name']} {row['last_name']}".strip()
+
+
+def related_to(row):
+    """TaskSerializer.get_related_to() for a .values() row"""
+    if row['related_lead'] is not None:
+        return {'type': 'lead', 'id': row['related_lead'],
+                'name': f"{row['related_lead__first_name']} {row['related_lead__last_name']}"}
+    elif row['related_contact'] is not None:
+        return {'type': 'contact', 'id': row['related_contact'],
+                'name': f"{row['related_contact__first_name']} {row['related_contact__last_name']}"}
+    elif row['related_account'] is not None:
+        return {'type': 'account', 'id': row['related_account'], 'name': row['related_account__name']}
+    elif row['related_deal'] is not None:
+        return {'type': 'deal', 'id': row['related_deal'], 'name': row['related_deal__name']}
+    return None
+
+
+class LeadReadSerializer(ValuesSerializer):
+    serializer_class = LeadSerializer
+    computed = {
+        'full_name': Column(('salutation', 'first_name', 'last_name'), function=lead_full_name),
+    }
+
+
+class TaskReadSerializer(ValuesSerializer):
+    serializer_class = TaskSerializer
+    computed = {
+        'related_to': Column(
+            ('related_lead', 'related_lead__first_name', 'related_lead__last_name',
+             'related_contact', 'related_contact__first_name', 'related_contact__last_name',
+             'related_account', 'related_account__name', 'related_deal', 'related_deal__name'),
+            function=related_to,
+        ),
+    }
+
+
+class TransactionReadSerializer(ValuesSerializer):
+    serializer_class = TransactionSerializer
@@ -0,0 +1,246 @@
+"""
+Maintenance of the Daily*Stats rollup tables.
+
+Each RollupSpec describes how one source model (Lead, Deal, Task) folds into
+its stats model: the dimension columns copied as-is and the measures, each
+bucketed by the local day of a date field.
+
+Saves and deletes are applied incrementally. pre_save reads the row's stored
+values (one query by pk), and post_save/post_delete subtracts what the row
+used to contribute and adds what it contributes now, as F() updates on the
+matching (day, dimensions) stats rows. A save therefore costs a couple of
+single-row UPDATEs whatever the size of the day, and concurrent saves can't
+lose each other's counts. Stats rows are only ever summed by the readers, so
+a key that ends up on two rows (two first saves racing) still adds up.
+
+Anything that writes without signals (bulk_create, QuerySet.update) calls
+rebuild_days() for the days it touched, which recomputes those days with one
+GROUP BY. `manage.py rebuild_rollups` does the same for any range and is the
+repair tool if the tables ever drift; migration 0016 runs it once over all
+existing rows.
+"""
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Case, Count, F, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Lead, Deal, Task, DailyLeadStats, DailyDealStats, DailyTaskStats
+
+
+class Measure:
+    def __init__(self, name, date_field, aggregate, condition=None):
+        self.name = name
+        self.date_field = date_field
+        self.aggregate = aggregate
+        # {field: value} a source row must match to be counted
+        self.condition = condition or {}
+        # Source column a Sum adds up; a Count adds 1 per row
+        self.column = None if isinstance(aggregate, Count) else aggregate.source_expressions[0].name
+
+    def contribution(self, values):
+        """What one source row (a dict of its column values) adds to this measure"""
+        if values[self.date_field] is None:
+            return 0
+        if any(values[name] != expected for name, expected in self.condition.items()):
+            return 0
+        return 1 if self.column is None else values[self.column] or 0
+
+
+class RollupSpec:
+    def __init__(self, source, stats, dimensions, measures):
+        self.source = source
+        self.stats = stats
+        self.dimensions = dimensions
+        self.measures = measures
+
+    @property
+    def date_fields(self):
+        return sorted({measure.date_field for measure in self.measures})
+
+    @property
+    def columns(self):
+        """Source columns that decide a row's contribution"""
+        names = list(self.dimensions) + self.date_fields
+        for measure in self.measures:
+            names += list(measure.condition) + [measure.column]
+        return list(dict.fromkeys(name for name in names if name))
+
+
+ROLLUPS = {
+    Lead: RollupSpec(
+        Lead, DailyLeadStats,
+        dimensions=['assigned_to_id', 'created_by_id', 'manager_id', 'lead_source', 'lead_status'],
+        measures=[Measure('lead_count', 'created_at', Count('id'))],
+    ),
+    Deal: RollupSpec(
+        Deal, DailyDealStats,
+        dimensions=['assigned_to_id', 'created_by_id', 'stage'],
+        measures=[
+            Measure('deal_count', 'created_at', Count('id')),
+            Measure('amount', 'created_at', Sum('amount')),
+        ],
+    ),
+    Task: RollupSpec(
+        Task, DailyTaskStats,
+        dimensions=['assigned_to_id', 'created_by_id', 'manager_id', 'priority'],
+        measures=[
+            Measure('created_count', 'created_at', Count('id')),
+            Measure('completed_count', 'completed_date', Count('id'), {'status': 'completed'}),
+        ],
+    ),
+}
+
+
+def local_day(value):
+    """Local calendar day of an aware datetime (None stays None)"""
+    if value is None:
+        return None
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    return value.date()
+
+
+def _day_bounds(start_day, end_day):
+    """Aware [start, end) datetimes covering local days start_day..end_day inclusive"""
+    start = timezone.make_aware(datetime.combine(start_day, time.min))
+    end = timezone.make_aware(datetime.combine(end_day + timedelta(days=1), time.min))
+    return start, end
+
+
+def _collect(spec, start_day, end_day):
+    """Aggregate source rows into {(day, *dimensions): {measure: value}}"""
+    start, end = _day_bounds(start_day, end_day)
+    rows = {}
+    for measure in spec.measures:
+        queryset = spec.source.objects.filter(**{
+            f'{measure.date_field}__gte': start,
+            f'{measure.date_field}__lt': end,
+        })
+        if measure.condition:
+            queryset = queryset.filter(**measure.condition)
+        grouped = (
+            queryset.order_by()
+            .annotate(rollup_day=TruncDate(measure.date_field))
+            .values('rollup_day', *spec.dimensions)
+            .annotate(value=measure.aggregate)
+        )
+        for row in grouped:
+            key = (row['rollup_day'],) + tuple(row[name] for name in spec.dimensions)
+            rows.setdefault(key, {})[measure.name] = row['value'] or 0
+    return rows
+
+
+def rebuild_range(spec, start_day, end_day, batch_size=1000):
+    """Recompute every stats row of spec for local days start_day..end_day"""
+    with transaction.atomic():
+        # Lock the days first so incremental updates to them wait for the rebuild
+        list(spec.stats.objects.select_for_update().filter(day__gte=start_day, day__lte=end_day)
+             .values_list('pk', flat=True))
+        rows = _collect(spec, start_day, end_day)
+        stats = [
+            spec.stats(day=key[0], **dict(zip(spec.dimensions, key[1:])), **values)
+            for key, values in rows.items()
+        ]
+        spec.stats.objects.filter(day__gte=start_day, day__lte=end_day).delete()
+        spec.stats.objects.bulk_create(stats, batch_size=batch_size)
+    return len(stats)
+
+
+def rebuild_days(model, days):
+    """Recompute the given local days (an iterable of dates) for a source model"""
+    spec = ROLLUPS[model]
+    for day in sorted({day for day in days if day is not None}):
+        rebuild_range(spec, day, day)
+
+
+def contributions(spec, values):
+    """{(day, *dimensions): {measure: amount}} one source row adds to the stats"""
+    keys = {}
+    for measure in spec.measures:
+        amount = measure.contribution(values)
+        if amount:
+            key = (local_day(values[measure.date_field]),) + tuple(values[name] for name in spec.dimensions)
+            keys.setdefault(key, {})[measure.name] = amount
+    return keys
+
+
+def instance_contributions(instance):
+    spec = ROLLUPS[type(instance)]
+    values = {name: getattr(instance, name) for name in spec.columns}
+    for measure in spec.measures:
+        if measure.column:
+            # An unsaved value may still be what was assigned ('1500.00' for a Decimal)
+            field = spec.source._meta.get_field(measure.column)
+            values[measure.column] = field.to_python(values[measure.column])
+    return contributions(spec, values)
+
+
+def remember_old_contributions(instance):
+    """Store what the row contributed before this save or delete (pre_save/pre_delete)"""
+    spec = ROLLUPS[type(instance)]
+    instance._rollup_old = {}
+    if instance.pk and not instance._state.adding:
+        old = spec.source.objects.filter(pk=instance.pk).values(*spec.columns).first()
+        if old:
+            instance._rollup_old = contributions(spec, old)
+
+
+def _shifted(field, delta):
+    """F() expression adding delta to a stats column, never below zero"""
+    shifted = F(field.name) + Value(delta, output_field=field)
+    if delta > 0:
+        return shifted
+    # Should the row have drifted, stop at zero instead of going negative
+    return Case(When(**{f'{field.name}__gte': -delta}, then=shifted), default=Value(0), output_field=field)
+
+
+def apply_changes(spec, old, new):
+    """Move the stats from the old contributions to the new ones with F() updates"""
+    changes = {}
+    for sign, keys in ((-1, old), (1, new)):
+        for key, amounts in keys.items():
+            for name, amount in amounts.items():
+                changes.setdefault(key, {})
+                changes[key][name] = changes[key].get(name, 0) + sign * amount
+
+    with transaction.atomic():
+        for key, deltas in changes.items():
+            deltas = {name: delta for name, delta in deltas.items() if delta}
+            if not deltas:
+                continue
+            lookup = dict(zip(spec.dimensions, key[1:]), day=key[0])
+            pk = spec.stats.objects.filter(**lookup).values_list('pk', flat=True).first()
+            if pk is not None:
+                spec.stats.objects.filter(pk=pk).update(**{
+                    name: _shifted(spec.stats._meta.get_field(name), delta) for name, delta in deltas.items()
+                })
+            elif any(delta > 0 for delta in deltas.values()):
+                spec.stats.objects.create(**lookup, **{
+                    name: max(delta, 0) for name, delta in deltas.items()
+                })
+
+
+def refresh_for_instance(instance, deleted=False):
+    """Apply a saved or deleted row's change to the stats (post_save/post_delete)"""
+    new = {} if deleted else instance_contributions(instance)
+    apply_changes(ROLLUPS[type(instance)], getattr(instance, '_rollup_old', {}), new)
+    instance._rollup_old = new
+
+
+def source_day_range(model):
+    """(first_day, last_day) covered by a source model's rows, or None if empty"""
+    spec = ROLLUPS[model]
+    first = last = None
+    for name in spec.date_fields:
+        ordered = spec.source.objects.exclude(**{f'{name}__isnull': True}).order_by(name)
+        earliest = ordered.values_list(name, flat=True).first()
+        latest = ordered.reverse().values_list(name, flat=True).first()
+        if earliest is None:
+            continue
+        first = min(filter(None, [first, local_day(earliest)]))
+        last = max(filter(None, [last, local_day(latest)]))
+    if first is None:
+        return None
+    return first, last
@@ -0,0 +1,185 @@
+"""
+Country -> manager routing for leads posted to allot_lead_manager.
+
+The web form sends either a country code or just a free-text address.
+Routing used to load every AllotManager row per lead and test each
+country name as a substring of the address, then query again for the
+manager. CountryRouter compiles the routing table once:
+
+    managers   {country code: manager_username}, first row per country
+    matcher    an Aho-Corasick automaton over the names and aliases of the
+               routed countries, so one pass over the address finds every
+               mention (linear in the address length)
+
+Names only match whole words ("Oman" is not found in "Romania", nor
+"India" in "Indiana"). When several countries are mentioned, the one
+ending last wins, since addresses end with the country ("Georgia, USA"
+routes to US). For ties, the longer name wins ("Papua New Guinea" beats
+"Guinea"). A trailing ISO code segment ("Pune, IN") is recognised as well.
+
+The compiled router is kept per process. Each call compares it with a
+version read from the table itself (row count, highest id and latest
+updated_at, one aggregate over a few hundred rows at most), so a change
+saved by any process is picked up by every other one on its next lead,
+without relying on a cache shared between them. The table is only
+reloaded when that version moves.
+"""
+import re
+import threading
+from collections import deque
+
+from django.db.models import Count, Max
+
+from .models import AllotManager
+from .search import word_tokens
+
+# Common names that differ from AllotManager.COUNTRIES
+ALIASES = {
+    'AE': ['uae'],
+    'BN': ['brunei'],
+    'CD': ['drc', 'democratic republic of the congo'],
+    'CI': ['ivory coast'],
+    'CV': ['cabo verde'],
+    'CZ': ['czechia'],
+    'GB': ['uk', 'great britain', 'britain', 'england', 'scotland', 'wales', 'northern ireland'],
+    'IR': ['islamic republic of iran'],
+    'KR': ['south korea', 'republic of korea'],
+    'LA': ['laos'],
+    'LY': ['libya'],
+    'MK': ['north macedonia'],
+    'MM': ['burma'],
+    'MO': ['macau'],
+    'NL': ['holland'],
+    'PS': ['palestine'],
+    'RU': ['russia'],
+    'SY': ['syria'],
+    'SZ': ['eswatini'],
+    'TL': ['east timor'],
+    'TR': ['turkiye'],
+    'TZ': ['united republic of tanzania'],
+    'US': ['usa', 'united states of america', 'u s a', 'u s'],
+    'VA': ['vatican', 'vatican city', 'holy see'],
+    'VN': ['vietnam'],
+}
+COUNTRY_NAMES = dict(AllotManager.COUNTRIES)
+
+_SEGMENT = re.compile(r'[,\n;]')
+
+
+def normalize_phrase(text):
+    """Lowercase, accent-free words separated by single spaces, padded with spaces"""
+    return ' ' + ' '.join(word_tokens(text)) + ' '
+
+
+class CountryMatcher:
+    """Aho-Corasick automaton over space-padded country phrases"""
+
+    def __init__(self, phrases):
+        # phrases: {normalized phrase: country code}
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for phrase, code in phrases.items():
+            state = 0
+            for char in phrase:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.output[state].append((len(phrase), code))
+
+        # Breadth-first: fail links point at the longest proper suffix in the trie
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, target in self.goto[state].items():
+                queue.append(target)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[target] = self.goto[fallback].get(char, 0)
+                self.output[target] = self.output[target] + self.output[self.fail[target]]
+
+    def find(self, text):
+        """Country code of the mention ending last (longest on ties), or None"""
+        best = None
+        state = 0
+        for end, char in enumerate(normalize_phrase(text)):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for length, code in self.output[state]:
+                if best is None or (end, length) > best[:2]:
+                    best = (end, length, code)
+        return best[2] if best else None
+
+
+class CountryRouter:
+    """Compiled AllotManager table: country code / address -> manager username"""
+
+    def __init__(self, managers):
+        self.managers = managers
+        phrases = {}
+        for code in managers:
+            names = [COUNTRY_NAMES.get(code, '')] + ALIASES.get(code, [])
+            for name in names:
+                phrase = normalize_phrase(name)
+                if phrase.strip():
+                    phrases.setdefault(phrase, code)
+        self.matcher = CountryMatcher(phrases)
+
+    @classmethod
+    def build(cls):
+        managers = {}
+        for code, username in AllotManager.objects.order_by('pk').values_list('country', 'manager_username'):
+            managers.setdefault(code, username)
+        return cls(managers)
+
+    def country_for(self, country=None, address=None):
+        """
+        Routed country code for an explicit country (code or name) or, when
+        none was given, the address. None if that country has no row.
+        """
+        text = country or address
+        if not text:
+            return None
+        # "IN", or "..., Mumbai, IN": a trailing ISO code segment
+        code = _SEGMENT.split(text)[-1].strip().upper()
+        if code in self.managers:
+            return code
+        return self.matcher.find(text)
+
+    def manager_for(self, country=None, address=None):
+        """(country code, manager_username) for a lead; either may be None"""
+        code = self.country_for(country, address)
+        return code, self.managers.get(code)
+
+
+_router = None
+_router_version = None
+_router_lock = threading.Lock()
+
+
+def table_version():
+    """Changes whenever an AllotManager row is added, deleted or saved"""
+    version = AllotManager.objects.aggregate(rows=Count('id'), last_id=Max('id'), last_update=Max('updated_at'))
+    return version['rows'], version['last_id'], version['last_update']
+
+
+def get_router():
+    global _router, _router_version
+    version = table_version()
+    with _router_lock:
+        if _router is None or _router_version != version:
+            _router = CountryRouter.build()
+            _router_version = version
+        return _router
+
+
+def invalidate():
+    """Rebuild this process's router on its next lead (the others notice the new version)"""
+    global _router
+    with _router_lock:
+        _router = None
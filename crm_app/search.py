@@ -0,0 +1,216 @@
+"""
+Full-text search over leads, contacts and accounts.
+
+DRF's SearchFilter turns ?search= into icontains on five or six columns,
+a leading-wildcard LIKE that scans the whole table. Instead every indexed
+row gets a SearchDocument (display text plus the owner columns the
+visibility scope needs) and one SearchToken per normalized token:
+
+    names, company    lowercased, accents stripped, split on punctuation
+    email             the full address, its local part and domain, and
+                      the words inside them
+    phone numbers     the digits only, and the last ten digits so numbers
+                      match with or without a country code
+
+A query is tokenized the same way and every term must prefix-match a
+token of the document (WHERE token LIKE 'term%' is a range scan on the
+(token, document) index). Hits are ranked by how many terms matched a
+token exactly, then by recency.
+
+signals.py keeps the index current on save/delete. Writes that skip
+signals (bulk_create, QuerySet.update) must call index_queryset() for the
+rows they touched, or run `manage.py rebuild_search_index`.
+"""
+import re
+import unicodedata
+
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .models import Account, Contact, Lead, SearchDocument, SearchToken
+
+# Longest token stored (matches SearchToken.token)
+MAX_TOKEN_LENGTH = 64
+# Terms shorter than this would match most of the index
+MIN_TERM_LENGTH = 2
+MAX_QUERY_TERMS = 5
+# Phone numbers are also indexed by their national part
+NATIONAL_DIGITS = 10
+
+_WORD = re.compile(r'[a-z0-9]+')
+_PHONE = re.compile(r'^[\d\s()+.\-]{6,}$')
+
+
+def normalize(text):
+    """Lowercase and strip accents"""
+    text = unicodedata.normalize('NFKD', str(text))
+    return ''.join(char for char in text if not unicodedata.combining(char)).lower()
+
+
+def word_tokens(text):
+    return _WORD.findall(normalize(text)) if text else []
+
+
+def email_tokens(email):
+    if not email:
+        return []
+    email = normalize(email).strip()
+    local, _, domain = email.partition('@')
+    return [email, local, domain] + _WORD.findall(email)
+
+
+def phone_tokens(phone):
+    digits = re.sub(r'\D', '', phone or '')
+    if not digits:
+        return []
+    return [digits, digits[-NATIONAL_DIGITS:]]
+
+
+def website_tokens(website):
+    if not website:
+        return []
+    host = re.sub(r'^[a-z]+://', '', normalize(website)).split('/')[0]
+    host = host[4:] if host.startswith('www.') else host
+    return [host] + _WORD.findall(host)
+
+
+def query_terms(query):
+    """Normalized search terms; a phone-looking query is one digits-only term"""
+    query = (query or '').strip()
+    if _PHONE.match(query):
+        digits = re.sub(r'\D', '', query)
+        return [digits[-NATIONAL_DIGITS:]] if len(digits) > NATIONAL_DIGITS else [digits]
+    terms = []
+    for term in word_tokens(query):
+        if len(term) >= MIN_TERM_LENGTH and term not in terms:
+            terms.append(term[:MAX_TOKEN_LENGTH])
+    return terms[:MAX_QUERY_TERMS]
+
+
+class IndexSpec:
+    """How one model becomes a SearchDocument"""
+
+    def __init__(self, entity_type, model, title, subtitle, tokens, select_related=()):
+        self.entity_type = entity_type
+        self.model = model
+        self.title = title
+        self.subtitle = subtitle
+        self.tokens = tokens
+        self.select_related = select_related
+
+    def key(self, pk):
+        return f'{self.entity_type}:{pk}'
+
+    def document(self, obj):
+        manager_field = getattr(self.model, 'VISIBILITY_MANAGER_FIELD', None)
+        return SearchDocument(
+            key=self.key(obj.pk),
+            entity_type=self.entity_type,
+            object_id=obj.pk,
+            title=(self.title(obj) or '')[:255],
+            subtitle=(self.subtitle(obj) or '')[:255],
+            assigned_to_id=obj.assigned_to_id,
+            created_by_id=obj.created_by_id,
+            manager_id=obj.manager_id if manager_field == 'manager_id' else None,
+            updated_at=obj.updated_at,
+        )
+
+    def token_set(self, obj):
+        return {token[:MAX_TOKEN_LENGTH] for token in self.tokens(obj) if token}
+
+
+def full_name(obj):
+    return ' '.join(part for part in (obj.first_name, obj.last_name) if part)
+
+
+INDEXES = {
+    Lead: IndexSpec(
+        'lead', Lead,
+        title=full_name,
+        subtitle=lambda lead: lead.company or lead.email,
+        tokens=lambda lead: (
+            word_tokens(lead.first_name) + word_tokens(lead.last_name) + word_tokens(lead.company)
+            + email_tokens(lead.email) + phone_tokens(lead.phone) + phone_tokens(lead.mobile)
+        ),
+    ),
+    Contact: IndexSpec(
+        'contact', Contact,
+        title=full_name,
+        subtitle=lambda contact: contact.account.name if contact.account_id else contact.email,
+        tokens=lambda contact: (
+            word_tokens(contact.first_name) + word_tokens(contact.last_name)
+            + word_tokens(contact.account.name if contact.account_id else '')
+            + email_tokens(contact.email) + phone_tokens(contact.phone) + phone_tokens(contact.mobile)
+        ),
+        select_related=('account',),
+    ),
+    Account: IndexSpec(
+        'account', Account,
+        title=lambda account: account.name,
+        subtitle=lambda account: account.website or account.email,
+        tokens=lambda account: (
+            word_tokens(account.name) + email_tokens(account.email) + phone_tokens(account.phone)
+            + website_tokens(account.website)
+        ),
+    ),
+}
+ENTITY_TYPES = {spec.entity_type: spec for spec in INDEXES.values()}
+
+
+def index_objects(model, objects):
+    """(Re)write the documents and tokens of saved model instances"""
+    spec = INDEXES[model]
+    objects = list(objects)
+    if not objects:
+        return
+    documents = [spec.document(obj) for obj in objects]
+    tokens = [
+        SearchToken(document_id=document.key, token=token)
+        for obj, document in zip(objects, documents)
+        for token in spec.token_set(obj)
+    ]
+    with transaction.atomic():
+        remove_keys([document.key for document in documents])
+        SearchDocument.objects.bulk_create(documents, batch_size=1000)
+        SearchToken.objects.bulk_create(tokens, batch_size=2000)
+
+
+def index_queryset(queryset, chunk_size=1000):
+    """Index every row of a queryset of an indexed model, chunk by chunk"""
+    spec = INDEXES[queryset.model]
+    queryset = queryset.select_related(*spec.select_related).order_by('pk')
+    last_pk = None
+    while True:
+        page = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        objects = list(page[:chunk_size])
+        if not objects:
+            return
+        index_objects(queryset.model, objects)
+        last_pk = objects[-1].pk
+
+
+def remove_keys(keys):
+    SearchToken.objects.filter(document_id__in=keys).delete()
+    SearchDocument.objects.filter(key__in=keys).delete()
+
+
+def remove_object(model, pk):
+    remove_keys([INDEXES[model].key(pk)])
+
+
+def search(user, query, entity_types=None, limit=20):
+    """Ranked documents visible to user whose tokens match every query term"""
+    terms = query_terms(query)
+    if not terms:
+        return []
+    documents = SearchDocument.objects.visible_to(user)
+    if entity_types:
+        documents = documents.filter(entity_type__in=entity_types)
+    for term in terms:
+        documents = documents.filter(
+            key__in=SearchToken.objects.filter(token__startswith=term).values('document_id')
+        )
+    return list(
+        documents.annotate(exact=Count('tokens', filter=Q(tokens__token__in=terms)))
+        .order_by('-exact', '-updated_at')[:limit]
+    )
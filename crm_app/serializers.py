@@ -19,11 +19,24 @@ class UserProfileSerializer(serializers.ModelSerializer):
         model = UserProfile
         fields = ['id', 'user', 'phone', 'address', 'profile_picture', 'role', 'department', 'manager_username']
 
+# Columns get_related_to() reads (see fieldsets.py)
+RELATED_TO_SOURCES = (
+    'related_lead__first_name', 'related_lead__last_name',
+    'related_contact__first_name', 'related_contact__last_name',
+    'related_account__name', 'related_deal__name',
+)
+
 class IndustrySerializer(serializers.ModelSerializer):
     class Meta:
         model = Industry
         fields = '__all__'
 
+class AccountSummarySerializer(serializers.ModelSerializer):
+    """Nested form of an account for ?expand=account"""
+    class Meta:
+        model = Account
+        fields = ['id', 'name', 'website', 'phone', 'email']
+
 class AccountSerializer(serializers.ModelSerializer):
     industry_name = serializers.CharField(source='industry.name', read_only=True)
     assigned_to_name = serializers.CharField(source='assigned_to.get_full_name', read_only=True)
@@ -32,6 +45,7 @@ class AccountSerializer(serializers.ModelSerializer):
         model = Account
         fields = '__all__'
         extra_fields = ['industry_name', 'assigned_to_name']
+        expandable = {'assigned_to': UserSerializer, 'industry': IndustrySerializer}
 
 class ContactSerializer(serializers.ModelSerializer):
     account_name = serializers.CharField(source='account.name', read_only=True)
@@ -42,6 +56,8 @@ class ContactSerializer(serializers.ModelSerializer):
         model = Contact
         fields = '__all__'
         extra_fields = ['account_name', 'assigned_to_name', 'full_name']
+        field_sources = {'full_name': ('salutation', 'first_name', 'last_name')}
+        expandable = {'assigned_to': UserSerializer, 'account': AccountSummarySerializer}
     
     def get_full_name(self, obj):
         salutation = obj.get_salutation_display() if obj.salutation else ''
@@ -56,6 +72,8 @@ class LeadSerializer(serializers.ModelSerializer):
         model = Lead
         fields = '__all__'
         extra_fields = ['industry_name', 'assigned_to_name', 'full_name']
+        field_sources = {'full_name': ('salutation', 'first_name', 'last_name')}
+        expandable = {'assigned_to': UserSerializer, 'industry': IndustrySerializer}
     
     def get_full_name(self, obj):
         salutation = obj.get_salutation_display() if obj.salutation else ''
@@ -71,10 +89,21 @@ class DealSerializer(serializers.ModelSerializer):
         model = Deal
         fields = '__all__'
         extra_fields = ['account_name', 'assigned_to_name', 'stage_display', 'contacts_count']
+        expandable = {'assigned_to': UserSerializer, 'account': AccountSummarySerializer}
     
     def get_contacts_count(self, obj):
+        # DealViewSet annotates contacts_count; fall back to a COUNT elsewhere
+        if hasattr(obj, 'contacts_count'):
+            return obj.contacts_count
         return obj.contacts.count()
 
+    def update(self, instance, validated_data):
+        instance = super().update(instance, validated_data)
+        # The annotated count is stale once the contacts have been rewritten
+        if 'contacts' in validated_data:
+            instance.__dict__.pop('contacts_count', None)
+        return instance
+
 class TaskSerializer(serializers.ModelSerializer):
     assigned_to_name = serializers.CharField(source='assigned_to.get_full_name', read_only=True)
     status_display = serializers.CharField(source='get_status_display', read_only=True)
@@ -85,6 +114,8 @@ class TaskSerializer(serializers.ModelSerializer):
         model = Task
         fields = '__all__'
         extra_fields = ['assigned_to_name', 'status_display', 'priority_display', 'related_to']
+        field_sources = {'related_to': RELATED_TO_SOURCES}
+        expandable = {'assigned_to': UserSerializer}
     
     def get_related_to(self, obj):
         if obj.related_lead:
@@ -106,6 +137,10 @@ class EventSerializer(serializers.ModelSerializer):
         model = Event
         fields = '__all__'
         extra_fields = ['created_by_name', 'attendees_names', 'related_to']
+        field_sources = {
+            'attendees_names': ('attendees__first_name', 'attendees__last_name'),
+            'related_to': RELATED_TO_SOURCES,
+        }
     
     def get_attendees_names(self, obj):
         return [{'id': user.id, 'name': user.get_full_name()} for user in obj.attendees.all()]
@@ -129,6 +164,7 @@ class NoteSerializer(serializers.ModelSerializer):
         model = Note
         fields = '__all__'
         extra_fields = ['created_by_name', 'related_to']
+        field_sources = {'related_to': RELATED_TO_SOURCES}
     
     def get_related_to(self, obj):
         if obj.related_lead:
@@ -150,6 +186,10 @@ class DocumentSerializer(serializers.ModelSerializer):
         model = Document
         fields = '__all__'
         extra_fields = ['created_by_name', 'related_to', 'file_url']
+        field_sources = {
+            'related_to': RELATED_TO_SOURCES,
+            'file_url': ('file',),
+        }
     
     def get_file_url(self, obj):
         request = self.context.get('request')
@@ -177,6 +217,7 @@ class TransactionSerializer(serializers.ModelSerializer):
         model = Transaction
         fields = '__all__'
         extra_fields = ['account_name', 'deal_name', 'transaction_type_display']
+        expandable = {'account': AccountSummarySerializer}
 
 class ProductSerializer(serializers.ModelSerializer):
     class Meta:
@@ -0,0 +1,92 @@
+from django.db.models.signals import pre_save, pre_delete, post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Account, Contact, Lead, Deal, Task, AllotManager
+from . import autocomplete, dedup, rollups, routing, search
+
+
+@receiver(post_save, sender=AllotManager)
+@receiver(post_delete, sender=AllotManager)
+def invalidate_country_router(sender, **kwargs):
+    """Recompile the lead routing table after the country assignments change"""
+    routing.invalidate()
+
+
+@receiver(pre_save, sender=Lead)
+@receiver(pre_save, sender=Deal)
+@receiver(pre_save, sender=Task)
+@receiver(pre_delete, sender=Lead)
+@receiver(pre_delete, sender=Deal)
+@receiver(pre_delete, sender=Task)
+def remember_rollup_contributions(sender, instance, raw=False, **kwargs):
+    """Capture what the stored row counts towards before it changes"""
+    if not raw:
+        rollups.remember_old_contributions(instance)
+
+
+@receiver(post_save, sender=Lead)
+@receiver(post_save, sender=Deal)
+@receiver(post_save, sender=Task)
+def update_daily_rollups(sender, instance, raw=False, **kwargs):
+    """Move the daily stats from the row's old values to its new ones"""
+    if not raw:
+        rollups.refresh_for_instance(instance)
+
+
+@receiver(post_delete, sender=Lead)
+@receiver(post_delete, sender=Deal)
+@receiver(post_delete, sender=Task)
+def remove_from_daily_rollups(sender, instance, **kwargs):
+    """Take a deleted row out of the daily stats"""
+    rollups.refresh_for_instance(instance, deleted=True)
+
+
+@receiver(pre_save, sender=Account)
+def remember_account_name(sender, instance, raw=False, **kwargs):
+    """Contacts are indexed under their account's name; note renames"""
+    instance._search_old_name = None
+    if not raw and instance.pk:
+        instance._search_old_name = Account.objects.filter(pk=instance.pk).values_list('name', flat=True).first()
+
+
+@receiver(post_save, sender=Lead)
+@receiver(post_save, sender=Contact)
+@receiver(post_save, sender=Account)
+def update_search_index(sender, instance, raw=False, created=False, **kwargs):
+    """Rewrite the row's SearchDocument and tokens"""
+    if raw:
+        return
+    search.index_objects(sender, [instance])
+    if sender is Account and not created and instance._search_old_name != instance.name:
+        search.index_queryset(Contact.objects.filter(account=instance))
+
+
+@receiver(post_delete, sender=Lead)
+@receiver(post_delete, sender=Contact)
+@receiver(post_delete, sender=Account)
+def remove_from_search_index(sender, instance, **kwargs):
+    search.remove_object(sender, instance.pk)
+
+
+@receiver(post_save, sender=Lead)
+@receiver(post_save, sender=Contact)
+@receiver(post_save, sender=Account)
+@receiver(post_save, sender=Deal)
+def update_autocomplete_index(sender, instance, raw=False, **kwargs):
+    if not raw:
+        autocomplete.object_saved(sender, instance)
+
+
+@receiver(post_delete, sender=Lead)
+@receiver(post_delete, sender=Contact)
+@receiver(post_delete, sender=Account)
+@receiver(post_delete, sender=Deal)
+def remove_from_autocomplete_index(sender, instance, **kwargs):
+    autocomplete.object_deleted(sender, instance.pk)
+
+
+@receiver(post_save, sender=Lead)
+def register_dedup_keys(sender, instance, raw=False, **kwargs):
+    """Keep the lead's LeadDedupKey rows in step with its email and phones"""
+    if not raw:
+        dedup.register(instance)
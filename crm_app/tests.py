@@ -1,3 +1,1788 @@
-from django.test import TestCase
+import csv
+import gzip
+import importlib.util
+import json
+import tempfile
+import threading
+import zipfile
+from datetime import date, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.db.models import Q, Sum
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from .models import (
+    month_start,
+    Account, Contact, Lead, Deal, Task, Event, Note, Document, Transaction, Product, DealProduct,
+    Industry, UserProfile, UserActivityLog, DailyLeadStats, DailyDealStats, DailyTaskStats, ImportJob, SearchDocument, SearchToken,
+    AllotManager, LeadDedupKey,
+)
+from . import autocomplete, conversion, dashboard, dedup, rollups, routing, timeseries
+from .activity import ActivityLogBuffer
+from .exports import EXPORTS, stream_csv
+from .hierarchy import ManagerHierarchy
+from .jobs import recover_stale_jobs, run_import_job
+from .importers import LeadImporter, DealImporter, iter_csv_rows
+from .utils import log_user_activity
+from .read_serializers import RENDERER_CACHE_SIZE, LeadReadSerializer, TaskReadSerializer, TransactionReadSerializer
+from .views import AccountViewSet, ContactViewSet, LeadViewSet, DealViewSet, TaskViewSet, TransactionViewSet
+
+class VisibilityScopeTests(TestCase):
+    """Row-level visibility shared by the five CRM ViewSets"""
+
+    VIEWSETS = (
+        (AccountViewSet, Account),
+        (ContactViewSet, Contact),
+        (LeadViewSet, Lead),
+        (DealViewSet, Deal),
+        (TaskViewSet, Task),
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = User.objects.create_user('manager1', password='x')
+        UserProfile.objects.create(user=cls.manager, role='Manager')
+        cls.rep = User.objects.create_user('rep1', password='x')
+        UserProfile.objects.create(user=cls.rep, role='Sales', manager_username='manager1')
+        cls.outsider = User.objects.create_user('outsider', password='x')
+        UserProfile.objects.create(user=cls.outsider, role='Sales')
+
+        for owner in (cls.manager, cls.rep, cls.outsider):
+            account = Account.objects.create(name=f'{owner.username} account', assigned_to=owner, created_by=owner)
+            Contact.objects.create(first_name='C', last_name=owner.username, account=account,
+                                   assigned_to=owner, created_by=owner)
+            Lead.objects.create(first_name='L', last_name=owner.username, assigned_to=owner, created_by=owner)
+            Deal.objects.create(name=f'{owner.username} deal', account=account, amount=100,
+                                closing_date=date.today() + timedelta(days=30),
+                                assigned_to=owner, created_by=owner)
+            Task.objects.create(subject=f'{owner.username} task', due_date=timezone.now(),
+                                assigned_to=owner, created_by=owner)
+
+    def setUp(self):
+        cache.clear()
+
+    def get_viewset_queryset(self, viewset_class, user):
+        request = APIRequestFactory().get('/')
+        force_authenticate(request, user=user)
+        view = viewset_class(action_map={'get': 'list'}, format_kwarg=None)
+        view.request = view.initialize_request(request)
+        return view.get_queryset()
+
+    def test_manager_sees_own_and_subordinate_rows(self):
+        for viewset_class, model in self.VIEWSETS:
+            with self.subTest(model=model.__name__):
+                queryset = self.get_viewset_queryset(viewset_class, self.manager)
+                owners = set(queryset.values_list('assigned_to__username', flat=True))
+                self.assertEqual(owners, {'manager1', 'rep1'})
+
+    def test_regular_user_sees_only_own_rows(self):
+        for viewset_class, model in self.VIEWSETS:
+            with self.subTest(model=model.__name__):
+                queryset = self.get_viewset_queryset(viewset_class, self.rep)
+                owners = set(queryset.values_list('assigned_to__username', flat=True))
+                self.assertEqual(owners, {'rep1'})
+
+    def test_manager_scope_is_single_query_without_distinct(self):
+        manager = User.objects.select_related('profile').get(pk=self.manager.pk)
+        for viewset_class, model in self.VIEWSETS:
+            with self.subTest(model=model.__name__):
+                with CaptureQueriesContext(connection) as ctx:
+                    list(self.get_viewset_queryset(viewset_class, manager))
+                self.assertEqual(len(ctx.captured_queries), 1)
+                sql = ctx.captured_queries[0]['sql'].upper()
+                self.assertNotIn('DISTINCT', sql)
+                # Subordinates come from a subquery, not a join on the profiles
+                self.assertNotIn('JOIN "CRM_APP_USERPROFILE"', sql)
+
+    def test_scope_follows_profile_changes(self):
+        manager = User.objects.select_related('profile').get(pk=self.manager.pk)
+        self.assertEqual(Lead.objects.visible_to(manager).count(), 2)
+        profile = self.outsider.profile
+        profile.manager_username = 'manager1'
+        profile.save()
+        self.assertEqual(Lead.objects.visible_to(manager).count(), 3)
+        # Reassigned away: the old manager loses the rows straight away
+        profile.manager_username = None
+        profile.save()
+        self.assertEqual(Lead.objects.visible_to(manager).count(), 2)
+
+    def test_scope_survives_manager_rename(self):
+        manager = User.objects.select_related('profile').get(pk=self.manager.pk)
+        manager.username = 'manager1-renamed'
+        manager.save()
+        self.assertEqual(Lead.objects.visible_to(manager).count(), 2)
+
+
+class ManagerHierarchyTests(TestCase):
+    """Subordinates resolved from UserProfile.manager"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = User.objects.create_user('boss', password='x')
+        UserProfile.objects.create(user=cls.manager, role='Manager')
+        cls.reps = [User.objects.create_user(f'rep{i}', password='x') for i in range(3)]
+        for rep in cls.reps[:2]:
+            UserProfile.objects.create(user=rep, role='Sales', manager_username='boss')
+        UserProfile.objects.create(user=cls.reps[2], role='Sales')
+
+    def test_subordinate_ids(self):
+        self.assertEqual(sorted(ManagerHierarchy.subordinate_ids(self.manager)),
+                         sorted(rep.id for rep in self.reps[:2]))
+        self.assertEqual(ManagerHierarchy.subordinate_ids(self.reps[0]), [])
+
+    def test_profile_changes_apply_immediately(self):
+        profile = self.reps[2].profile
+        profile.manager = self.manager
+        profile.save()
+        self.assertIn(self.reps[2].id, ManagerHierarchy.subordinate_ids(self.manager))
+        self.reps[0].profile.delete()
+        self.assertNotIn(self.reps[0].id, ManagerHierarchy.subordinate_ids(self.manager))
+
+    def test_manager_rename_keeps_subordinates(self):
+        self.manager.username = 'boss2'
+        self.manager.save()
+        self.assertEqual(len(ManagerHierarchy.subordinate_ids(self.manager)), 2)
+
+
+class AdminUsersTests(TestCase):
+    """admin_users lists a manager's subordinates from ManagerHierarchy"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = User.objects.create_user('users_manager', password='x')
+        UserProfile.objects.create(user=cls.manager, role='Manager')
+        cls.outsider = User.objects.create_user('users_outsider', password='x')
+        UserProfile.objects.create(user=cls.outsider, role='Sales')
+
+    def add_reps(self, count):
+        for i in range(count):
+            rep = User.objects.create_user(f'users_rep{User.objects.count()}', password='x')
+            UserProfile.objects.create(user=rep, role='Sales', manager_username='users_manager')
+
+    def get_users_page(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/admin/users/')
+        self.assertEqual(response.status_code, 200)
+        return response, len(ctx.captured_queries)
+
+    def test_manager_sees_only_subordinates_in_constant_queries(self):
+        self.client.force_login(self.manager)
+        self.add_reps(2)
+        response, queries = self.get_users_page()
+        self.assertEqual(len(response.context['users']), 2)
+        self.assertNotIn('users_outsider', {user['username'] for user in response.context['users']})
+
+        self.add_reps(5)
+        response, more_queries = self.get_users_page()
+        self.assertEqual(len(response.context['users']), 7)
+        self.assertEqual(more_queries, queries)
+
+
+class IndexUsageTests(TestCase):
+    """EXPLAIN the hot queries and fail if one of them falls back to a full table scan"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('indexed', password='x')
+        UserProfile.objects.create(user=cls.user, role='Manager')
+
+    def assertUsesIndex(self, queryset, table):
+        vendor = connection.vendor
+        if vendor == 'sqlite':
+            plan = queryset.explain()
+            self.assertNotRegex(plan, rf'SCAN {table}(?! USING)', plan)
+        elif vendor == 'mysql':
+            plan = queryset.explain(format='json')
+            self.assertNotIn('"access_type": "ALL"', plan, plan)
+        elif vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan = off')
+            plan = queryset.explain()
+            self.assertNotIn(f'Seq Scan on {table}', plan, plan)
+        else:
+            self.skipTest(f'No EXPLAIN check for {vendor}')
+
+    def test_manager_unassigned_leads(self):
+        queryset = Lead.objects.filter(manager=self.user, assigned_to__isnull=True).order_by('-created_at')
+        self.assertUsesIndex(queryset, 'crm_app_lead')
+
+    def test_lead_date_range(self):
+        since = timezone.now() - timedelta(days=30)
+        self.assertUsesIndex(Lead.objects.filter(created_at__gte=since), 'crm_app_lead')
+
+    def test_upcoming_tasks(self):
+        queryset = Task.objects.filter(
+            assigned_to=self.user,
+            status__in=['not_started', 'in_progress', 'waiting'],
+            due_date__gte=timezone.now(),
+        ).order_by('due_date')
+        self.assertUsesIndex(queryset, 'crm_app_task')
+
+    def test_completed_task_range(self):
+        since = timezone.now() - timedelta(days=7)
+        self.assertUsesIndex(Task.objects.filter(completed_date__gte=since, status='completed'), 'crm_app_task')
+
+    def test_closed_won_deals_by_period(self):
+        since = timezone.now() - timedelta(days=365)
+        self.assertUsesIndex(Deal.objects.filter(stage='closed_won', created_at__gte=since), 'crm_app_deal')
+
+    def test_user_activity_history(self):
+        queryset = UserActivityLog.objects.filter(user=self.user).order_by('-timestamp')[:20]
+        self.assertUsesIndex(queryset, 'crm_app_useractivitylog')
+
+
+class ManagerLinkTests(TestCase):
+    """manager and manager_username stay in sync on save"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.boss = User.objects.create_user('boss', password='x')
+        cls.other_boss = User.objects.create_user('other_boss', password='x')
+
+    def test_username_sets_fk(self):
+        lead = Lead.objects.create(first_name='A', last_name='B', manager_username='boss')
+        self.assertEqual(lead.manager_id, self.boss.id)
+
+        lead = Lead.objects.get(pk=lead.pk)
+        lead.manager_username = 'other_boss'
+        lead.save()
+        self.assertEqual(Lead.objects.get(pk=lead.pk).manager_id, self.other_boss.id)
+
+    def test_fk_sets_username(self):
+        account = Account.objects.create(name='Acme', manager=self.boss)
+        self.assertEqual(account.manager_username, 'boss')
+
+        account = Account.objects.get(pk=account.pk)
+        account.manager = None
+        account.save()
+        account = Account.objects.get(pk=account.pk)
+        self.assertIsNone(account.manager_username)
+        self.assertIsNone(account.manager_id)
+
+    def test_unknown_username_leaves_fk_empty(self):
+        contact_account = Account.objects.create(name='Acme')
+        contact = Contact.objects.create(first_name='C', last_name='D', account=contact_account, manager_username='ghost')
+        self.assertIsNone(contact.manager_id)
+        self.assertEqual(contact.manager_username, 'ghost')
+
+
+class PaginationTests(TestCase):
+    """Page-number pagination by default, keyset cursors with ?cursor="""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('paging_admin', password='x', is_staff=True)
+        Lead.objects.bulk_create([
+            Lead(first_name='P', last_name=str(i), created_by=cls.admin, assigned_to=cls.admin)
+            for i in range(7)
+        ])
+        # Give several rows the same created_at so the id tie-breaker matters
+        Lead.objects.filter(last_name__in=['2', '3', '4']).update(created_at=timezone.now() - timedelta(days=1))
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def test_page_number_is_default(self):
+        response = self.client.get('/api/leads/', {'page_size': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 7)
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertIn('page=2', response.data['next'])
+
+    def test_cursor_walks_every_row_once_without_offset(self):
+        seen = []
+        url, params = '/api/leads/', {'cursor': '', 'page_size': 2}
+        while url:
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            self.assertFalse(any('OFFSET' in query['sql'].upper() for query in ctx.captured_queries))
+            seen.extend(row['id'] for row in response.data['results'])
+            url, params = response.data['next'], None
+
+        expected = list(Lead.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get('/api/leads/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+
+class ListQueryCountTests(TestCase):
+    """Every list endpoint costs the same number of queries whatever the page size"""
+
+    ENDPOINTS = (
+        'accounts', 'contacts', 'leads', 'deals', 'tasks', 'events',
+        'notes', 'documents', 'transactions', 'deal-products',
+    )
+    ROWS = 6
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('n1_admin', password='x', is_staff=True)
+        industry = Industry.objects.create(name='Software')
+        product = Product.objects.create(name='Widget', product_code='W-1', unit_price=10)
+        closing = date.today() + timedelta(days=30)
+
+        for i in range(cls.ROWS):
+            owner = User.objects.create_user(f'n1_user{i}', password='x', first_name='U', last_name=str(i))
+            account = Account.objects.create(name=f'Account {i}', industry=industry, assigned_to=owner, created_by=owner)
+            contact = Contact.objects.create(first_name='C', last_name=str(i), account=account,
+                                             assigned_to=owner, created_by=owner)
+            lead = Lead.objects.create(first_name='L', last_name=str(i), industry=industry,
+                                       assigned_to=owner, created_by=owner)
+            deal = Deal.objects.create(name=f'Deal {i}', account=account, amount=100, closing_date=closing,
+                                       assigned_to=owner, created_by=owner)
+            deal.contacts.add(contact)
+            # Spread related_to over all four kinds of parent
+            related = [
+                {'related_lead': lead}, {'related_contact': contact},
+                {'related_account': account}, {'related_deal': deal},
+            ][i % 4]
+            Task.objects.create(subject=f'Task {i}', due_date=timezone.now(), assigned_to=owner,
+                                created_by=owner, **related)
+            event = Event.objects.create(title=f'Event {i}', start_time=timezone.now(), end_time=timezone.now(),
+                                         created_by=owner, **related)
+            event.attendees.add(owner, cls.admin)
+            Note.objects.create(subject=f'Note {i}', content='-', created_by=owner, **related)
+            Document.objects.create(title=f'Doc {i}', file='documents/x.txt', created_by=owner, **related)
+            Transaction.objects.create(transaction_type='invoice', amount=10, date=date.today(),
+                                       account=account, deal=deal, created_by=owner)
+            DealProduct.objects.create(deal=deal, product=product, unit_price=10, total_price=10)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def count_queries(self, endpoint, page_size):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(f'/api/{endpoint}/', {'page_size': page_size})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), page_size)
+        return len(ctx.captured_queries)
+
+    def test_list_endpoints_have_constant_query_count(self):
+        for endpoint in self.ENDPOINTS:
+            with self.subTest(endpoint=endpoint):
+                single_row = self.count_queries(endpoint, 1)
+                with self.assertNumQueries(single_row):
+                    self.client.get(f'/api/{endpoint}/', {'page_size': self.ROWS})
+
+    def test_deal_contacts_count_is_annotated(self):
+        response = self.client.get('/api/deals/')
+        self.assertEqual({row['contacts_count'] for row in response.data['results']}, {1})
+
+
+class InlineActivityLogBuffer(ActivityLogBuffer):
+    """Buffer without the drain thread, so the test drives every flush"""
+
+    def start(self):
+        pass
+
+
+class ActivityLogBufferTests(TestCase):
+    """Activity rows are batched off the request path and never dropped"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('active', password='x')
+
+    def entry(self, detail):
+        return UserActivityLog(user=self.user, action_type='view', action_detail=detail)
+
+    def test_batches_are_bulk_inserted(self):
+        buffer = InlineActivityLogBuffer(batch_size=3, flush_interval=0.01)
+        for i in range(5):
+            buffer.add(self.entry(f'view {i}'))
+        self.assertEqual(UserActivityLog.objects.count(), 0)
+
+        batch = buffer._take_batch(timeout=0.01)
+        self.assertEqual(len(batch), 3)
+        with CaptureQueriesContext(connection) as ctx:
+            buffer.write(batch)
+        # One INSERT (inside a savepoint, so a failure can't break an outer transaction)
+        self.assertEqual(len([query for query in ctx.captured_queries if query['sql'].startswith('INSERT')]), 1)
+        buffer.flush()
+        self.assertEqual(UserActivityLog.objects.count(), 5)
+
+    def test_bad_row_only_drops_itself(self):
+        batch = [self.entry('before'), self.entry(None), self.entry('after')]
+        with self.assertLogs('crm_app.activity', 'WARNING') as logs:
+            InlineActivityLogBuffer().write(batch)
+        self.assertEqual(sorted(UserActivityLog.objects.values_list('action_detail', flat=True)), ['after', 'before'])
+        self.assertIn('Dropped 1 of 3', '\n'.join(logs.output))
+
+    def test_full_queue_falls_back_to_sync_write(self):
+        buffer = InlineActivityLogBuffer(queue_size=1)
+        buffer.add(self.entry('queued'))
+        with self.assertLogs('crm_app.activity', 'WARNING'):
+            buffer.add(self.entry('overflow'))
+        self.assertEqual(list(UserActivityLog.objects.values_list('action_detail', flat=True)), ['overflow'])
+
+    def test_timestamp_is_taken_when_logged(self):
+        before = timezone.now()
+        entry = self.entry('late')
+        InlineActivityLogBuffer().write([entry])
+        saved = UserActivityLog.objects.get()
+        self.assertEqual(saved.timestamp, entry.timestamp)
+        self.assertGreaterEqual(saved.timestamp, before)
+
+    @override_settings(ACTIVITY_LOG_ASYNC=False)
+    def test_sync_mode_writes_immediately(self):
+        log_user_activity(self.user, 'login', 'Logged in')
+        self.assertTrue(UserActivityLog.objects.filter(user=self.user, action_type='login').exists())
+
+
+class ActivityPartitionTests(TestCase):
+    """Monthly activity log partitions, recent() and the archive command"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('partitioned', password='x')
+        this_month = month_start(timezone.now())
+        cls.last_month = month_start(this_month - timedelta(days=1))
+        cls.old_month = month_start(this_month - timedelta(days=400))
+        UserActivityLog.objects.bulk_create(
+            [UserActivityLog(user=cls.user, action_type='view', action_detail=f'now {i}',
+                             timestamp=this_month + timedelta(hours=i)) for i in range(2)] +
+            [UserActivityLog(user=cls.user, action_type='view', action_detail=f'last {i}',
+                             timestamp=cls.last_month + timedelta(hours=i)) for i in range(3)] +
+            [UserActivityLog(user=cls.user, action_type='login', action_detail='old',
+                             timestamp=cls.old_month + timedelta(days=2))]
+        )
+
+    def test_partition_is_one_calendar_month(self):
+        self.assertEqual(UserActivityLog.objects.partition().count(), 2)
+        self.assertEqual(UserActivityLog.objects.partition(self.last_month).count(), 3)
+
+    def test_recent_reads_older_partitions_only_when_needed(self):
+        with self.assertNumQueries(1):
+            rows = UserActivityLog.objects.recent(2)
+        self.assertEqual([row.action_detail for row in rows], ['now 1', 'now 0'])
+
+        rows = UserActivityLog.objects.recent(4)
+        self.assertEqual([row.action_detail for row in rows], ['now 1', 'now 0', 'last 2', 'last 1'])
+
+    def test_archive_moves_expired_partitions_to_jsonl(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            call_command('archive_activity_logs', keep_months=12, output_dir=output_dir, stdout=StringIO())
+            archives = list(Path(output_dir).glob('*.jsonl.gz'))
+            self.assertEqual([path.name for path in archives], [f'activity-{self.old_month:%Y-%m}.jsonl.gz'])
+            with gzip.open(archives[0], 'rt') as archive:
+                rows = [json.loads(line) for line in archive]
+
+        self.assertEqual([row['action_detail'] for row in rows], ['old'])
+        self.assertEqual(rows[0]['user__username'], 'partitioned')
+        self.assertFalse(UserActivityLog.objects.filter(action_detail='old').exists())
+        self.assertEqual(UserActivityLog.objects.count(), 5)
+
+
+class RollupTests(TestCase):
+    """The Daily*Stats tables against the per-row GROUP BY they replace"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.rep = User.objects.create_user('rollup_rep', password='x')
+        cls.other = User.objects.create_user('rollup_other', password='x')
+        cls.account = Account.objects.create(name='Rollup account', created_by=cls.rep)
+
+    def stats_by_key(self, model):
+        """{(day, *dimensions): {measure: total}} read from the stats table, zero rows dropped"""
+        spec = rollups.ROLLUPS[model]
+        names = [measure.name for measure in spec.measures]
+        rows = spec.stats.objects.order_by().values('day', *spec.dimensions) \
+            .annotate(**{f'total_{name}': Sum(name) for name in names})
+        result = {}
+        for row in rows:
+            values = {name: row[f'total_{name}'] for name in names if row[f'total_{name}']}
+            if values:
+                result[(row['day'],) + tuple(row[name] for name in spec.dimensions)] = values
+        return result
+
+    def assertMatchesSource(self, model):
+        spec = rollups.ROLLUPS[model]
+        bounds = rollups.source_day_range(model)
+        expected = rollups._collect(spec, *bounds) if bounds else {}
+        expected = {key: {name: value for name, value in values.items() if value}
+                    for key, values in expected.items()}
+        self.assertEqual(self.stats_by_key(model), {key: values for key, values in expected.items() if values})
+
+    def test_lead_saves_and_deletes(self):
+        leads = [Lead.objects.create(first_name='R', last_name=str(i), lead_source='web',
+                                     assigned_to=self.rep, created_by=self.rep) for i in range(4)]
+        self.assertEqual(DailyLeadStats.objects.aggregate(total=Sum('lead_count'))['total'], 4)
+        leads[0].lead_status = 'contacted'
+        leads[0].save()
+        leads[1].assigned_to = self.other
+        leads[1].save()
+        leads[2].delete()
+        self.assertMatchesSource(Lead)
+        self.assertEqual(DailyLeadStats.objects.filter(lead_status='contacted')
+                         .aggregate(total=Sum('lead_count'))['total'], 1)
+
+    def test_deal_amount_follows_edits(self):
+        deal = Deal.objects.create(name='Rollup deal', account=self.account, amount='1500.00', stage='prospecting',
+                                   closing_date=date.today(), assigned_to=self.rep, created_by=self.rep)
+        Deal.objects.create(name='Second deal', account=self.account, amount=500, stage='prospecting',
+                            closing_date=date.today(), assigned_to=self.rep, created_by=self.rep)
+        deal.amount = Decimal('2000.00')
+        deal.stage = 'negotiation'
+        deal.save()
+        self.assertMatchesSource(Deal)
+        self.assertEqual(DailyDealStats.objects.aggregate(total=Sum('amount'))['total'], Decimal('2500.00'))
+
+    def test_task_completion_counts_on_completed_day(self):
+        task = Task.objects.create(subject='Rollup task', due_date=timezone.now(), priority='high',
+                                   assigned_to=self.rep, created_by=self.rep)
+        task.status = 'completed'
+        task.completed_date = timezone.now() - timedelta(days=3)
+        task.save()
+        self.assertMatchesSource(Task)
+        completed = DailyTaskStats.objects.filter(completed_count__gt=0).get()
+        self.assertEqual(completed.day, rollups.local_day(task.completed_date))
+        task.status = 'pending'
+        task.save()
+        self.assertMatchesSource(Task)
+        self.assertFalse(DailyTaskStats.objects.filter(completed_count__gt=0).exists())
+
+    def test_save_cost_does_not_grow_with_the_day(self):
+        Lead.objects.bulk_create([Lead(first_name='Bulk', last_name=str(i), assigned_to=self.rep,
+                                       created_by=self.rep) for i in range(200)])
+        rollups.rebuild_days(Lead, [timezone.localdate()])
+        lead = Lead.objects.create(first_name='Edited', last_name='Lead', assigned_to=self.rep, created_by=self.rep)
+        lead.lead_status = 'qualified'
+        with CaptureQueriesContext(connection) as ctx:
+            lead.save()
+        statements = [query['sql'] for query in ctx.captured_queries]
+        rollup_sql = [sql for sql in statements if 'crm_app_daily' in sql]
+        self.assertTrue(rollup_sql)
+        self.assertFalse([sql for sql in rollup_sql if sql.startswith('DELETE') or 'GROUP BY' in sql])
+        self.assertMatchesSource(Lead)
+
+    def test_rebuild_agrees_with_incremental_updates(self):
+        for i in range(3):
+            Task.objects.create(subject=f'T{i}', due_date=timezone.now(), assigned_to=self.rep, created_by=self.rep)
+        incremental = self.stats_by_key(Task)
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(self.stats_by_key(Task), incremental)
+
+
+class TaskChartTestCase(TestCase):
+    """Tasks spread over the last ~14 months, with the rollups rebuilt"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = User.objects.create_user('chart_manager', password='x')
+        UserProfile.objects.create(user=cls.manager, role='Manager')
+        cls.rep = User.objects.create_user('chart_rep', password='x')
+        UserProfile.objects.create(user=cls.rep, role='Sales', manager_username='chart_manager')
+        cls.outsider = User.objects.create_user('chart_outsider', password='x')
+        UserProfile.objects.create(user=cls.outsider, role='Sales')
+
+        now = timezone.now()
+        priorities = [value for value, _label in Task.TASK_PRIORITIES]
+        for i in range(90):
+            owner = (cls.manager, cls.rep, cls.outsider)[i % 3]
+            task = Task.objects.create(subject=f'Chart task {i}', due_date=now, priority=priorities[i % len(priorities)],
+                                       assigned_to=owner, created_by=owner)
+            created_at = now - timedelta(days=(i * 5) % 420, hours=i % 24)
+            changes = {'created_at': created_at}
+            if i % 4 == 0:
+                changes.update(status='completed', completed_date=created_at + timedelta(days=i % 3))
+            Task.objects.filter(pk=task.pk).update(**changes)
+        call_command('rebuild_rollups', stdout=StringIO())
+
+    def chart_tasks(self, user=None):
+        """The tasks a chart counts for user, filtered per row like the old helpers did"""
+        tasks = Task.objects.all()
+        if user is not None:
+            subordinates = UserProfile.objects.filter(manager_username=user.username).values('user_id')
+            tasks = tasks.filter(Q(manager_username=user.username) | Q(assigned_to__in=subordinates) |
+                                 Q(created_by=user))
+        return tasks
+
+
+class TaskTrendTests(TaskChartTestCase):
+    """timeseries.task_trend() against per-day COUNT queries"""
+
+    def expected(self, window, user=None):
+        kind, buckets, _start, _end = timeseries.window_buckets(window)
+        tasks = self.chart_tasks(user)
+        completed = tasks.filter(status='completed')
+        if kind == 'day':
+            return ([tasks.filter(created_at__date=day).count() for day in buckets],
+                    [completed.filter(completed_date__date=day).count() for day in buckets])
+        return ([tasks.filter(created_at__year=day.year, created_at__month=day.month).count() for day in buckets],
+                [completed.filter(completed_date__year=day.year, completed_date__month=day.month).count()
+                 for day in buckets])
+
+    def test_series_match_per_day_counts(self):
+        for window in timeseries.WINDOWS:
+            for user in (None, self.manager):
+                with self.subTest(window=window, manager=bool(user)):
+                    trend = timeseries.task_trend(user, window)
+                    created, completed = self.expected(window, user)
+                    self.assertEqual(trend['created'], created)
+                    self.assertEqual(trend['completed'], completed)
+                    self.assertEqual(len(trend['labels']), len(created))
+        self.assertTrue(any(timeseries.task_trend(None, 'year')['completed']))
+
+    def test_two_queries_per_chart(self):
+        with self.assertNumQueries(2):
+            timeseries.task_trend(None, 'month')
+
+
+class PriorityHistogramTests(TaskChartTestCase):
+    """timeseries.priority_histogram() against per-priority COUNT queries"""
+
+    def test_counts_match_per_priority_counts(self):
+        today = timezone.localdate()
+        priorities = [value for value, _label in Task.TASK_PRIORITIES]
+        for user in (None, self.manager):
+            with self.subTest(manager=bool(user)):
+                histogram = timeseries.priority_histogram(user)
+                for window, start_day in timeseries.priority_windows(today).items():
+                    tasks = self.chart_tasks(user).filter(created_at__date__gte=start_day,
+                                                          created_at__date__lte=today)
+                    self.assertEqual(histogram[window],
+                                     {priority: tasks.filter(priority=priority).count() for priority in priorities})
+        self.assertTrue(sum(timeseries.priority_histogram()['month'].values()))
+
+    def test_one_query(self):
+        with self.assertNumQueries(1):
+            timeseries.priority_histogram()
+
+
+class DashboardKpiTests(TestCase):
+    """dashboard.dashboard_metrics() against the per-row queries it replaced"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('kpi_admin', password='x', is_staff=True)
+        cls.manager = User.objects.create_user('kpi_manager', password='x')
+        UserProfile.objects.create(user=cls.manager, role='Manager')
+        cls.rep = User.objects.create_user('kpi_rep', password='x')
+        UserProfile.objects.create(user=cls.rep, role='Sales', manager_username='kpi_manager')
+        cls.outsider = User.objects.create_user('kpi_outsider', password='x')
+        UserProfile.objects.create(user=cls.outsider, role='Sales')
+        account = Account.objects.create(name='KPI account', created_by=cls.admin)
+
+        now = timezone.now()
+        sources = [value for value, _label in Lead.LEAD_SOURCES] + ['website']
+        stages = ['prospecting', 'closed_won', 'closed_lost', 'closed_won']
+        owners = (cls.manager, cls.rep, cls.outsider)
+        for i in range(60):
+            owner = owners[i % 3]
+            created_at = now - timedelta(days=i * 3 % 200, hours=i % 5)
+            lead = Lead.objects.create(first_name='KPI', last_name=str(i), assigned_to=owner, created_by=owner,
+                                       lead_source=sources[i % len(sources)])
+            deal = Deal.objects.create(name=f'KPI deal {i}', account=account, amount=Decimal(100 + i * 10),
+                                       stage=stages[i % len(stages)], closing_date=date.today(),
+                                       assigned_to=owner, created_by=owner)
+            Lead.objects.filter(pk=lead.pk).update(created_at=created_at)
+            Deal.objects.filter(pk=deal.pk).update(created_at=created_at)
+        call_command('rebuild_rollups', stdout=StringIO())
+
+    def expected(self, user, now, is_manager):
+        """The numbers the dashboard computed per row before the aggregates"""
+        since, previous_since = now - timedelta(days=30), now - timedelta(days=60)
+        leads, deals, users = Lead.objects.all(), Deal.objects.all(), User.objects.all()
+        if is_manager:
+            managed = list(UserProfile.objects.filter(manager_username=user.username).values_list('user_id', flat=True))
+            leads = leads.filter(Q(manager_username=user.username) | Q(assigned_to__in=managed) | Q(created_by=user))
+            deals = deals.filter(Q(assigned_to__in=managed) | Q(created_by=user))
+            users = users.filter(id__in=managed + [user.id])
+        won = deals.filter(stage='closed_won')
+        total_revenue = sum(deal.amount for deal in won)
+        last_month = sum(deal.amount for deal in won if previous_since <= deal.created_at < since)
+
+        monthly_revenue, monthly_deals = [0] * 12, [0] * 12
+        for deal in Deal.objects.filter(stage='closed_won'):
+            created = timezone.localtime(deal.created_at)
+            if created.year == timezone.localtime(now).year:
+                monthly_revenue[created.month - 1] += float(deal.amount)
+                monthly_deals[created.month - 1] += 1
+        lead_sources = {key: 0 for key, _label in dashboard.LEAD_SOURCE_CHART}
+        for lead in Lead.objects.all():
+            key = dashboard.LEAD_SOURCE_ALIASES.get(lead.lead_source, lead.lead_source)
+            if key in lead_sources:
+                lead_sources[key] += 1
+        return {
+            'total_users': users.count(),
+            'new_users': users.filter(date_joined__gte=since).count(),
+            'total_leads': leads.count(),
+            'new_leads': leads.filter(created_at__gte=since).count(),
+            'total_deals': deals.count(),
+            'new_deals': deals.filter(created_at__gte=since).count(),
+            'total_revenue': total_revenue,
+            'revenue_increase': total_revenue - last_month,
+            'monthly_revenue': monthly_revenue,
+            'monthly_deals': monthly_deals,
+            'lead_sources': lead_sources,
+        }
+
+    def test_metrics_match_per_row_results(self):
+        now = timezone.now()
+        for user, is_manager in ((self.admin, False), (self.manager, True)):
+            user = User.objects.select_related('profile').get(pk=user.pk)
+            with self.subTest(user=user.username):
+                self.assertEqual(dashboard.dashboard_metrics(user, now), self.expected(user, now, is_manager))
+
+    def test_query_count_does_not_grow_with_rows(self):
+        manager = User.objects.select_related('profile').get(pk=self.manager.pk)
+        with CaptureQueriesContext(connection) as ctx:
+            dashboard.dashboard_metrics(manager)
+        Lead.objects.bulk_create([Lead(first_name='More', last_name=str(i), assigned_to=self.rep)
+                                  for i in range(50)])
+        with self.assertNumQueries(len(ctx.captured_queries)):
+            dashboard.dashboard_metrics(manager)
+
+
+class RepDashboardTests(TestCase):
+    """GET /api/dashboard/?manager_username= counts the rep's cards on the server"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.rep = User.objects.create_user('cards_rep', password='x')
+        cls.other = User.objects.create_user('cards_other', password='x')
+        for owner, manager, count in ((cls.rep, 'cards_boss', 60), (None, 'cards_boss', 3),
+                                      (cls.other, 'cards_boss', 4), (cls.rep, 'someone_else', 5)):
+            Lead.objects.bulk_create([
+                Lead(first_name='Card', last_name=str(i), assigned_to=owner, created_by=cls.rep,
+                     manager_username=manager)
+                for i in range(count)
+            ])
+        account = Account.objects.create(name='Cards Ltd', manager_username='cards_boss', created_by=cls.rep)
+        for owner in (cls.rep, None, cls.other):
+            Deal.objects.create(name='Card deal', account=account, amount=Decimal('10'), closing_date=date.today(),
+                                assigned_to=owner, created_by=cls.rep)
+
+    def test_cards_are_counted_in_one_request(self):
+        self.client.force_login(self.rep)
+        data = self.client.get('/api/dashboard/?manager_username=cards_boss').json()
+        # Leads under the manager that are the rep's or unassigned, past the first page of a list
+        self.assertEqual(data['scope_counts'], {'leads': 63, 'contacts': 0, 'accounts': 1, 'deals': 2})
+        self.assertEqual(len(data['recent_leads']), 5)
+        self.assertTrue(all(lead.get('assigned_to') in (None, self.rep.id) for lead in data['recent_leads']))
+        self.assertEqual(self.client.get('/api/dashboard/').json()['scope_counts'], {})
+
+
+# Uploads are imported during the request; completed jobs delete their file
+INLINE_IMPORTS = dict(ACTIVITY_LOG_ASYNC=False, IMPORT_JOBS_RUNNER='inline', MEDIA_ROOT=tempfile.gettempdir())
+
+
+@override_settings(**INLINE_IMPORTS)
+class LeadImportTests(TestCase):
+    """Streaming, chunked lead CSV import"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('importer', password='x')
+        cls.rep = User.objects.create_user('rep', password='x')
+
+    def upload(self, lines):
+        content = '\n'.join(lines).encode('utf-8')
+        return SimpleUploadedFile('leads.csv', content, content_type='text/csv')
+
+    def test_import_reports_bad_rows_and_keeps_good_ones(self):
+        rows = ['first_name,last_name,email,lead_source,lead_status,assigned_to']
+        rows += [f'Ann,Row{i},ann{i}@example.com,email,new,rep' for i in range(5)]
+        rows += [',Missing,x@example.com,email,new,rep', 'Bad,Source,y@example.com,carrier_pigeon,new,']
+        self.client.force_login(self.admin)
+        response = self.client.post('/admin/leads/import/', {'import_file': self.upload(rows), 'header_row': 'on'})
+        job = ImportJob.objects.get()
+        self.assertRedirects(response, f'/admin/leads/?import_job={job.id}', fetch_redirect_response=False)
+
+        self.assertEqual(Lead.objects.count(), 5)
+        self.assertEqual(set(Lead.objects.values_list('assigned_to__username', flat=True)), {'rep'})
+        errors = job.errors
+        self.assertEqual([error['line'] for error in errors], [7, 8])
+        self.assertIn('first_name', errors[0]['error'])
+        self.assertIn('lead_source', errors[1]['error'])
+
+        report = self.client.get(f'/admin/import/jobs/{job.id}/errors/')
+        self.assertIn(b'carrier_pigeon', report.content)
+
+    def test_rows_are_written_in_batches(self):
+        rows = ['first_name,last_name,assigned_to'] + [f'A,{i},rep' for i in range(300)]
+        with CaptureQueriesContext(connection) as ctx:
+            report = LeadImporter(self.admin, chunk_size=100).run(iter_csv_rows(self.upload(rows)))
+        self.assertEqual(report.created, 300)
+        # No per-row user lookups or INSERTs: a handful of queries per chunk
+        self.assertLess(len(ctx.captured_queries), 40)
+
+    def test_rollups_include_imported_leads(self):
+        rows = ['first_name,last_name,lead_source'] + [f'A,{i},referral' for i in range(3)]
+        LeadImporter(self.admin).run(iter_csv_rows(self.upload(rows)))
+        stats = DailyLeadStats.objects.get(lead_source='referral')
+        self.assertEqual(stats.lead_count, 3)
+
+
+@override_settings(**INLINE_IMPORTS)
+class BulkImporterTests(TestCase):
+    """The declarative importers behind the other admin CSV imports"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('bulk_importer', password='x')
+        cls.industry = Industry.objects.create(name='Fintech')
+        cls.account = Account.objects.create(name='Acme', created_by=cls.admin)
+
+    def upload(self, lines, name='import.csv'):
+        content = '\n'.join(lines).encode('utf-8')
+        return SimpleUploadedFile(name, content, content_type='text/csv')
+
+    def test_headerless_file_is_read_in_template_order(self):
+        rows = [f'Account {i},{self.industry.id},,555-0100,"$1,200.50",12,1 Main St,' for i in range(3)]
+        rows.append('Broken,,,,lots,,,')
+        self.client.force_login(self.admin)
+        self.client.post('/admin/accounts/import/', {'import_file': self.upload(rows)})
+
+        imported = Account.objects.filter(name__startswith='Account ')
+        self.assertEqual(imported.count(), 3)
+        self.assertEqual({(a.industry_id, str(a.annual_revenue), a.billing_address) for a in imported},
+                         {(self.industry.id, '1200.50', '1 Main St')})
+        errors = ImportJob.objects.get().errors
+        self.assertEqual([error['line'] for error in errors], [4])
+        self.assertIn('annual_revenue', errors[0]['error'])
+
+    def test_related_keys_are_prefetched_per_chunk(self):
+        header = ','.join(DealImporter.headers())
+        rows = [header] + [f'Deal {i},100,,,,{self.account.id},,' for i in range(200)]
+        rows.append('Orphan,100,,,,999999,,')
+        with CaptureQueriesContext(connection) as ctx:
+            report = DealImporter(self.admin, chunk_size=50).run(iter_csv_rows(self.upload(rows)))
+        self.assertEqual(report.created, 200)
+        self.assertIn('account_id', report.errors[0]['error'])
+        self.assertLess(len(ctx.captured_queries), 40)
+        deal = Deal.objects.first()
+        self.assertEqual(deal.closing_date, timezone.localdate() + timedelta(days=30))
+        self.assertEqual(deal.created_by, self.admin)
+
+    def test_unique_columns_are_checked_against_table_and_file(self):
+        Product.objects.create(name='Old', product_code='SKU-1', unit_price=1)
+        rows = ['name,category_id,sku,price', 'A,,SKU-1,5', 'B,,SKU-2,5', 'C,,SKU-2,5', 'D,,SKU-3,0']
+        self.client.force_login(self.admin)
+        self.client.post('/admin/products/import/', {'import_file': self.upload(rows), 'header_row': 'on'})
+
+        self.assertEqual(list(Product.objects.order_by('id').values_list('product_code', flat=True)),
+                         ['SKU-1', 'SKU-2'])
+        errors = ImportJob.objects.get().errors
+        self.assertEqual([error['line'] for error in errors], [2, 4, 5])
+
+
+@override_settings(**INLINE_IMPORTS)
+class ImportJobTests(TestCase):
+    """Uploads are queued as ImportJobs and imported in the background"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('job_owner', password='x')
+
+    def upload(self, lines):
+        return SimpleUploadedFile('accounts.csv', '\n'.join(lines).encode('utf-8'), content_type='text/csv')
+
+    @override_settings(IMPORT_JOBS_RUNNER='worker')
+    def test_upload_returns_before_the_import_runs(self):
+        self.client.force_login(self.admin)
+        rows = ['name,website'] + [f'Queued {i},' for i in range(5)] + [',']
+        self.client.post('/admin/accounts/import/', {'import_file': self.upload(rows), 'header_row': 'on'})
+
+        job = ImportJob.objects.get()
+        self.assertEqual((job.status, job.kind, job.has_header), ('pending', 'accounts', True))
+        self.assertFalse(Account.objects.exists())
+        progress = self.client.get(f'/admin/import/jobs/{job.id}/').json()
+        self.assertEqual((progress['status'], progress['finished']), ('pending', False))
+
+        call_command('run_import_worker', once=True, stdout=StringIO())
+
+        self.assertEqual(Account.objects.count(), 5)
+        progress = self.client.get(f'/admin/import/jobs/{job.id}/').json()
+        self.assertEqual(progress['status'], 'completed')
+        self.assertEqual((progress['rows_processed'], progress['created'], progress['error_count']), (6, 5, 1))
+        job.refresh_from_db()
+        self.assertFalse(job.file)
+
+    def test_claimed_jobs_are_not_run_twice(self):
+        job = ImportJob.objects.create(kind='accounts', original_name='x.csv', created_by=self.admin,
+                                       status='running')
+        run_import_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.rows_processed), ('running', 0))
+
+    def test_unreadable_file_fails_the_job(self):
+        self.client.force_login(self.admin)
+        upload = SimpleUploadedFile('accounts.csv', b'name\n\xff\xfe broken', content_type='text/csv')
+        self.client.post('/admin/accounts/import/', {'import_file': upload, 'header_row': 'on'})
+        job = ImportJob.objects.get()
+        self.assertEqual(job.status, 'failed')
+        self.assertIn('decode', job.message)
+        job.file.delete(save=False)
+
+    def test_jobs_without_a_heartbeat_are_failed(self):
+        long_ago = timezone.now() - timedelta(seconds=700)
+        lost = ImportJob.objects.create(kind='accounts', original_name='lost.csv', created_by=self.admin,
+                                        status='running', started_at=long_ago, heartbeat_at=long_ago)
+        alive = ImportJob.objects.create(kind='accounts', original_name='alive.csv', created_by=self.admin,
+                                         status='running', started_at=long_ago, heartbeat_at=timezone.now())
+        self.client.force_login(self.admin)
+
+        progress = self.client.get(f'/admin/import/jobs/{lost.id}/').json()
+
+        self.assertEqual((progress['status'], progress['finished']), ('failed', True))
+        self.assertIn('restarted', progress['message'])
+        alive.refresh_from_db()
+        self.assertEqual(alive.status, 'running')
+
+    def test_queued_jobs_are_only_stale_with_the_thread_runner(self):
+        job = ImportJob.objects.create(kind='accounts', original_name='queued.csv', created_by=self.admin)
+        ImportJob.objects.filter(id=job.id).update(created_at=timezone.now() - timedelta(seconds=700))
+
+        with self.settings(IMPORT_JOBS_RUNNER='worker'):
+            self.assertEqual(recover_stale_jobs(), 0)
+        with self.settings(IMPORT_JOBS_RUNNER='thread'):
+            self.assertEqual(recover_stale_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+
+    @override_settings(IMPORT_JOBS_RUNNER='inline')
+    def test_progress_updates_the_heartbeat(self):
+        self.client.force_login(self.admin)
+        rows = ['name,website'] + [f'Beat {i},' for i in range(3)]
+        started = timezone.now()
+        self.client.post('/admin/accounts/import/', {'import_file': self.upload(rows), 'header_row': 'on'})
+        job = ImportJob.objects.get()
+        self.assertEqual(job.status, 'completed')
+        self.assertGreaterEqual(job.heartbeat_at, started)
+
+
+class ExportTests(TestCase):
+    """Streaming CSV / XLSX exports under the caller's visibility scope"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.rep = User.objects.create_user('export_rep', password='x')
+        cls.other = User.objects.create_user('export_other', password='x')
+        for owner in (cls.rep, cls.other):
+            account = Account.objects.create(name=f'{owner.username} account', assigned_to=owner, created_by=owner)
+            Transaction.objects.create(transaction_type='invoice', amount='10.50', date=date.today(),
+                                       account=account, created_by=owner)
+            for i in range(5):
+                Lead.objects.create(first_name=f'Lead {i}', last_name=owner.username, annual_revenue='1234.50',
+                                    assigned_to=owner, created_by=owner)
+
+    def setUp(self):
+        self.client.force_login(self.rep)
+
+    def read_csv(self, response):
+        content = b''.join(response.streaming_content).decode('utf-8-sig')
+        return list(csv.DictReader(StringIO(content)))
+
+    def test_csv_only_contains_visible_rows(self):
+        response = self.client.get('/api/export/leads.csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = self.read_csv(response)
+        self.assertEqual(len(rows), 5)
+        self.assertEqual({row['assigned_to'] for row in rows}, {'export_rep'})
+        self.assertEqual(rows[0]['annual_revenue'], '1234.50')
+
+        rows = self.read_csv(self.client.get('/api/export/transactions.csv'))
+        self.assertEqual([row['account'] for row in rows], ['export_rep account'])
+
+    def test_rows_are_fetched_in_keyset_batches(self):
+        spec = EXPORTS['leads']
+        with CaptureQueriesContext(connection) as ctx:
+            chunks = list(stream_csv(spec, Lead.objects.all(), chunk_size=4))
+        # Header, then 10 rows in batches of 4, 4 and 2
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(len(ctx.captured_queries), 3)
+        self.assertIn('"crm_app_lead"."id" >', ctx.captured_queries[1]['sql'])
+
+    def test_xlsx_is_a_valid_workbook(self):
+        response = self.client.get('/api/export/accounts.xlsx')
+        package = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+        sheet = package.read('xl/worksheets/sheet1.xml').decode('utf-8')
+        self.assertEqual(sheet.count('<row>'), 2)
+        self.assertIn('export_rep account', sheet)
+        self.assertNotIn('export_other', sheet)
+
+    def test_formula_like_text_is_not_evaluated(self):
+        Lead.objects.create(first_name='=HYPERLINK("http://evil.test")', last_name='@SUM(A1)', phone='+919876543210',
+                            assigned_to=self.rep, created_by=self.rep)
+        [row] = [row for row in self.read_csv(self.client.get('/api/export/leads.csv'))
+                 if row['last_name'] == "'@SUM(A1)"]
+        self.assertEqual((row['first_name'], row['phone']), ("'=HYPERLINK(\"http://evil.test\")", "'+919876543210"))
+
+        Account.objects.create(name='-1+1', assigned_to=self.rep, created_by=self.rep)
+        response = self.client.get('/api/export/accounts.xlsx')
+        sheet = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content))).read('xl/worksheets/sheet1.xml')
+        # XLSX text is an inline string, never a formula, and is written as is
+        self.assertIn(b'<c t="inlineStr"><is><t xml:space="preserve">-1+1</t></is></c>', sheet)
+        self.assertNotIn(b'<f>', sheet)
+
+    def test_xlsx_text_round_trips_unchanged(self):
+        Lead.objects.create(first_name='@handle', last_name='-dash', phone='+91 98765', assigned_to=self.rep,
+                            created_by=self.rep)
+        response = self.client.get('/api/export/leads.xlsx')
+        package = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+        sheet = package.read('xl/worksheets/sheet1.xml').decode('utf-8')
+        for text in ('@handle', '-dash', '+91 98765'):
+            self.assertIn(f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>', sheet)
+        self.assertNotIn("'+91", sheet)
+
+    def test_unknown_export_is_404(self):
+        self.assertEqual(self.client.get('/api/export/users.csv').status_code, 404)
+        self.assertEqual(self.client.get('/api/export/leads.pdf').status_code, 404)
+
+
+@skipUnless(importlib.util.find_spec('pyarrow'), 'pyarrow is not installed')
+class ColumnarExportTests(TestCase):
+    """export_columnar Parquet snapshots"""
+
+    def export(self, output_dir, source, at, **options):
+        with mock.patch('django.utils.timezone.now', return_value=at):
+            call_command('export_columnar', output_dir=output_dir, sources=[source], stdout=StringIO(), **options)
+
+    def exported_ids(self, output_dir, source, kind):
+        import pyarrow.parquet as pq
+
+        return sorted(pk for path in Path(output_dir, source).glob(f'*-{kind}.parquet')
+                      for pk in pq.read_table(path).column('id').to_pylist())
+
+    @override_settings(COLUMNAR_EXPORT_LAG_SECONDS=60)
+    def test_full_then_incremental_snapshot(self):
+        import pyarrow.parquet as pq
+
+        account = Account.objects.create(name='Parquet')
+        deal = Deal.objects.create(name='Big', account=account, amount='12345.67', closing_date=date.today())
+        Deal.objects.create(name='Small', account=account, amount='0.01', closing_date=date.today())
+        start = timezone.now()
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            self.export(output_dir, 'deals', start + timedelta(seconds=61))
+            [full] = Path(output_dir, 'deals').glob('*-full.parquet')
+            table = pq.read_table(full)
+            self.assertEqual(str(table.schema.field('amount').type), 'decimal128(15, 2)')
+            self.assertEqual(str(table.schema.field('created_at').type), 'timestamp[us, tz=UTC]')
+            self.assertEqual(sorted(table.column('amount').to_pylist()), [Decimal('0.01'), Decimal('12345.67')])
+
+            # Stamped just before the next run starts, as if its transaction were still open
+            Deal.objects.filter(pk=deal.pk).update(updated_at=start + timedelta(seconds=100))
+            self.export(output_dir, 'deals', start + timedelta(seconds=120), incremental=True)
+            self.assertEqual(self.exported_ids(output_dir, 'deals', 'incremental'), [])
+            # Once the lag has passed the next run picks it up
+            self.export(output_dir, 'deals', start + timedelta(seconds=180), incremental=True)
+            self.assertEqual(self.exported_ids(output_dir, 'deals', 'incremental'), [deal.pk])
+            self.assertEqual(list(Path(output_dir, 'deals').glob('*.tmp')), [])
+
+    @override_settings(ACTIVITY_LOG_ASYNC=False)
+    def test_activity_log_watermark_is_the_id(self):
+        user = User.objects.create_user('parquet_user', password='x')
+        log_user_activity(user=user, action_type='view', action_detail='first')
+        now = timezone.now()
+        with tempfile.TemporaryDirectory() as output_dir:
+            self.export(output_dir, 'activity', now)
+            self.assertEqual(len(self.exported_ids(output_dir, 'activity', 'full')), 1)
+            # Logged before the last run but inserted after it, like a buffered entry
+            UserActivityLog.objects.create(user=user, action_type='view', action_detail='late',
+                                           timestamp=now - timedelta(minutes=1))
+            self.export(output_dir, 'activity', now + timedelta(seconds=1), incremental=True)
+            late = UserActivityLog.objects.get(action_detail='late')
+            self.assertEqual(self.exported_ids(output_dir, 'activity', 'incremental'), [late.pk])
+
+
+class SearchIndexTests(TestCase):
+    """SearchDocument/SearchToken index and /api/search/"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.rep = User.objects.create_user('search_rep', password='x')
+        cls.other = User.objects.create_user('search_other', password='x')
+        cls.account = Account.objects.create(name='Zenith Labs', website='https://www.zenith.io',
+                                             assigned_to=cls.rep, created_by=cls.rep)
+        cls.contact = Contact.objects.create(first_name='José', last_name='Álvarez', email='jose@zenith.io',
+                                             phone='+91 98765-43210', account=cls.account,
+                                             assigned_to=cls.rep, created_by=cls.rep)
+        cls.lead = Lead.objects.create(first_name='Joseph', last_name='Zenner', company='Acme',
+                                       assigned_to=cls.rep, created_by=cls.rep)
+        Lead.objects.create(first_name='Josephine', last_name='Hidden', assigned_to=cls.other, created_by=cls.other)
+
+    def search(self, user, query, **params):
+        self.client.force_login(user)
+        response = self.client.get('/api/search/', {'q': query, **params})
+        return [(hit['type'], hit['title']) for hit in response.json()['results']]
+
+    def test_prefix_terms_match_normalized_tokens(self):
+        self.assertEqual(self.search(self.rep, 'jose alva'), [('contact', 'José Álvarez')])
+        self.assertEqual(self.search(self.rep, '9876543210'), [('contact', 'José Álvarez')])
+        self.assertEqual(self.search(self.rep, '(987) 654'), [('contact', 'José Álvarez')])
+        self.assertCountEqual(self.search(self.rep, 'zenith.io'), [('account', 'Zenith Labs'), ('contact', 'José Álvarez')])
+
+    def test_hits_are_scoped_and_ranked(self):
+        # Exact token matches rank first; the other user's lead is never returned
+        self.assertEqual(self.search(self.rep, 'jose'), [('contact', 'José Álvarez'), ('lead', 'Joseph Zenner')])
+        self.assertEqual(self.search(self.other, 'jose'), [('lead', 'Josephine Hidden')])
+        self.assertEqual(self.search(self.rep, 'zen', types='lead'), [('lead', 'Joseph Zenner')])
+
+    def test_index_follows_saves_renames_and_deletes(self):
+        self.account.name = 'Polaris'
+        self.account.save()
+        self.assertCountEqual(self.search(self.rep, 'polaris'), [('account', 'Polaris'), ('contact', 'José Álvarez')])
+        self.lead.delete()
+        self.assertEqual(self.search(self.rep, 'zenner'), [])
+        self.assertFalse(SearchToken.objects.filter(document_id=f'lead:{self.lead.pk}').exists())
+
+    def test_imported_rows_are_indexed(self):
+        upload = SimpleUploadedFile('leads.csv', b'first_name,last_name,email\nImogen,Quill,imogen@quill.test\n')
+        LeadImporter(self.rep).run(iter_csv_rows(upload))
+        self.assertEqual(self.search(self.rep, 'quill'), [('lead', 'Imogen Quill')])
+
+    def test_rebuild_command_restores_the_index(self):
+        SearchDocument.objects.filter(entity_type='lead').delete()
+        SearchDocument.objects.create(key='lead:999999', entity_type='lead', object_id=999999, title='Gone',
+                                      updated_at=timezone.now())
+        call_command('rebuild_search_index', only=['lead'], stdout=StringIO())
+        self.assertEqual(SearchDocument.objects.filter(entity_type='lead').count(), 2)
+        self.assertEqual(self.search(self.rep, 'zenner'), [('lead', 'Joseph Zenner')])
+
+
+
+@override_settings(ACTIVITY_LOG_ASYNC=False)
+class AutocompleteTests(TestCase):
+    """Per-process prefix index behind /api/autocomplete/<entity>/"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.rep = User.objects.create_user('ac_rep', password='x')
+        cls.other = User.objects.create_user('ac_other', password='x')
+        cls.admin = User.objects.create_user('ac_admin', password='x', is_superuser=True)
+        Lead.objects.create(first_name='Maria', last_name='Lopez', email='maria@acme.test',
+                            assigned_to=cls.rep, created_by=cls.rep)
+        Lead.objects.create(first_name='Mario', last_name='Rossi', email='mario@other.test',
+                            assigned_to=cls.other, created_by=cls.other)
+        account = Account.objects.create(name='Marigold Farms', created_by=cls.rep)
+        Deal.objects.create(name='Marigold renewal', account=account, amount=Decimal('1200.00'),
+                            closing_date=date(2026, 1, 1), created_by=cls.rep)
+
+    def setUp(self):
+        autocomplete.reset()
+
+    def lookup(self, user, entity, prefix, **params):
+        self.client.force_login(user)
+        response = self.client.get(f'/api/autocomplete/{entity}/', {'prefix': prefix, **params})
+        return [item['name'] for item in response.json()['results']]
+
+    def test_prefix_matches_any_word_in_order(self):
+        self.assertEqual(self.lookup(self.admin, 'lead', 'mari'),
+                         ['Maria Lopez (maria@acme.test)', 'Mario Rossi (mario@other.test)'])
+        self.assertEqual(self.lookup(self.admin, 'lead', 'ROSS'), ['Mario Rossi (mario@other.test)'])
+        self.assertEqual(self.lookup(self.admin, 'lead', 'maria lo'), ['Maria Lopez (maria@acme.test)'])
+        self.assertEqual(self.lookup(self.admin, 'lead', 'mari', limit=1), ['Maria Lopez (maria@acme.test)'])
+        self.assertEqual(self.lookup(self.admin, 'deal', 'renew'), ['Marigold renewal ($1200.00)'])
+        self.assertEqual(self.lookup(self.admin, 'lead', ''), [])
+
+    def test_results_are_scoped_to_the_user(self):
+        self.assertEqual(self.lookup(self.rep, 'lead', 'mari'), ['Maria Lopez (maria@acme.test)'])
+        self.assertEqual(self.lookup(self.other, 'account', 'mari'), [])
+
+    def test_signals_update_the_loaded_index(self):
+        self.assertEqual(self.lookup(self.admin, 'account', 'mari'), ['Marigold Farms (No website)'])
+        account = Account.objects.get(name='Marigold Farms')
+        account.name = 'Harvest Co'
+        account.save()
+        Account.objects.create(name='Marina Bay', website='https://bay.test', created_by=self.rep)
+        self.assertEqual(self.lookup(self.admin, 'account', 'mari'), ['Marina Bay (https://bay.test)'])
+        self.assertEqual(self.lookup(self.admin, 'account', 'harv'), ['Harvest Co (No website)'])
+        Lead.objects.filter(first_name='Mario').delete()
+        self.assertEqual(self.lookup(self.admin, 'lead', 'mario'), [])
+
+    @override_settings(AUTOCOMPLETE_REFRESH_SECONDS=0)
+    def test_rows_written_without_signals_arrive_on_refresh(self):
+        self.assertEqual(self.lookup(self.admin, 'lead', 'zed'), [])
+        Lead.objects.bulk_create([Lead(first_name='Zed', last_name='Bulk', email='zed@bulk.test')])
+        self.assertEqual(self.lookup(self.admin, 'lead', 'zed'), ['Zed Bulk (zed@bulk.test)'])
+
+    def test_rows_past_the_candidate_cap_come_from_the_database(self):
+        for name in ('Marcel', 'Marco', 'Marcy'):
+            Lead.objects.create(first_name=name, last_name='Hidden', assigned_to=self.other, created_by=self.other)
+        # Two candidates per lookup: both belong to someone else
+        with mock.patch.object(autocomplete, 'CANDIDATE_BATCH', 2), \
+                mock.patch.object(autocomplete, 'MAX_CANDIDATE_BATCHES', 1):
+            self.assertEqual(self.lookup(self.rep, 'lead', 'mar'), ['Maria Lopez (maria@acme.test)'])
+            self.assertEqual(self.lookup(self.rep, 'lead', 'maria lo'), ['Maria Lopez (maria@acme.test)'])
+            self.assertEqual(self.lookup(self.admin, 'lead', 'mar', limit=3),
+                             ['Marcel Hidden (None)', 'Marco Hidden (None)', 'Marcy Hidden (None)'])
+
+    def test_database_fallback_reads_a_bounded_number_of_rows(self):
+        for name in ('Marcel', 'Marco', 'Marcy'):
+            Lead.objects.create(first_name=name, last_name='Mine', assigned_to=self.rep, created_by=self.rep)
+        index, visible = autocomplete.get_index('lead'), Lead.objects.visible_to(self.rep)
+        with mock.patch.object(autocomplete, 'MAX_FALLBACK_ROWS', 2), CaptureQueriesContext(connection) as queries:
+            found = autocomplete.visible_matches(index, visible, 'mar', set(), 10)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(len(found), 2)
+
+    @override_settings(AUTOCOMPLETE_REBUILD_SECONDS=0)
+    def test_rebuild_loads_without_holding_the_index_lock(self):
+        index = autocomplete.get_index('lead')
+        lock_was_free = []
+
+        def probe():
+            acquired = index.lock.acquire(blocking=False)
+            if acquired:
+                index.lock.release()
+            lock_was_free.append(acquired)
+
+        original_load = index.load
+
+        def load(queryset):
+            thread = threading.Thread(target=probe)
+            thread.start()
+            thread.join()
+            return original_load(queryset)
+
+        with mock.patch.object(index, 'load', load):
+            index.ensure_fresh()
+        self.assertEqual(lock_was_free, [True])
+        self.assertEqual({label for _pk, label in index.scan('maria')[0]}, {'Maria Lopez (maria@acme.test)'})
+
+    def test_admin_tasks_page_no_longer_embeds_related_items(self):
+        self.client.force_login(self.admin)
+        response = self.client.get('/admin/tasks/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('leads_json', response.context)
+        self.assertNotContains(response, 'maria@acme.test')
+
+    def test_unknown_entity_is_404(self):
+        self.client.force_login(self.admin)
+        self.assertEqual(self.client.get('/api/autocomplete/task/', {'prefix': 'a'}).status_code, 404)
+
+
+@override_settings(ACTIVITY_LOG_ASYNC=False)
+class CountryRoutingTests(TestCase):
+    """Compiled AllotManager routing used by allot_lead_manager"""
+
+    @classmethod
+    def setUpTestData(cls):
+        for country, manager in [('IN', 'mgr_in'), ('US', 'mgr_us'), ('OM', 'mgr_om'), ('PG', 'mgr_pg'),
+                                 ('GN', 'mgr_gn'), ('GE', 'mgr_ge'), ('GB', None)]:
+            AllotManager.objects.create(country=country, manager_username=manager)
+
+    def setUp(self):
+        routing.invalidate()
+
+    def test_addresses_route_on_whole_word_mentions(self):
+        router = routing.get_router()
+        self.assertEqual(router.manager_for(address='12 MG Road, Mumbai, India'), ('IN', 'mgr_in'))
+        self.assertEqual(router.manager_for(address='Indianapolis, Indiana'), (None, None))
+        self.assertEqual(router.manager_for(address='Strada Oman 3, Romania'), ('OM', 'mgr_om'))
+        self.assertEqual(router.manager_for(address='Bucharest, Romania'), (None, None))
+        # The last mention wins, the longest name on ties
+        self.assertEqual(router.manager_for(address='Atlanta, Georgia, U.S.A.'), ('US', 'mgr_us'))
+        self.assertEqual(router.manager_for(address='Port Moresby, Papua New Guinea'), ('PG', 'mgr_pg'))
+        self.assertEqual(router.manager_for(address='Conakry, Guinea'), ('GN', 'mgr_gn'))
+        self.assertEqual(router.manager_for(address='Pune\nIN'), ('IN', 'mgr_in'))
+        # Unassigned countries route nowhere
+        self.assertEqual(router.manager_for(address='London, United Kingdom'), ('GB', None))
+
+    def test_explicit_country_beats_the_address(self):
+        router = routing.get_router()
+        self.assertEqual(router.manager_for('us', 'Mumbai, India'), ('US', 'mgr_us'))
+        self.assertEqual(router.manager_for('India', 'Atlanta, USA'), ('IN', 'mgr_in'))
+        self.assertEqual(router.manager_for('FR', 'Mumbai, India'), (None, None))
+
+    def test_router_is_kept_until_allot_managers_change(self):
+        router = routing.get_router()
+        # Only the version check
+        with self.assertNumQueries(1):
+            self.assertIs(routing.get_router(), router)
+        AllotManager.objects.create(country='FR', manager_username='mgr_fr')
+        self.assertEqual(routing.get_router().manager_for(address='Lyon, France'), ('FR', 'mgr_fr'))
+        AllotManager.objects.filter(country='FR').delete()
+        self.assertEqual(routing.get_router().manager_for(address='Lyon, France'), (None, None))
+
+    def test_changes_without_signals_are_picked_up(self):
+        # As if another process had made the change: no local invalidation
+        routing.get_router()
+        with mock.patch.object(routing, 'invalidate'):
+            AllotManager.objects.create(country='FR', manager_username='mgr_fr')
+            self.assertEqual(routing.get_router().manager_for(address='Lyon, France'), ('FR', 'mgr_fr'))
+            AllotManager.objects.filter(country='FR').update(manager_username='mgr_fr2', updated_at=timezone.now())
+            self.assertEqual(routing.get_router().manager_for(country='FR'), ('FR', 'mgr_fr2'))
+
+    def test_allot_lead_manager_assigns_the_routed_manager(self):
+        response = self.client.post('/api/allotleadmanager/', {
+            'first_name': 'Web', 'last_name': 'Form', 'email': 'web@form.test',
+            'address': 'Muscat, Sultanate of Oman',
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Lead.objects.get(email='web@form.test').manager_username, 'mgr_om')
+
+
+@override_settings(ACTIVITY_LOG_ASYNC=False, LEAD_INGEST_MODE='upsert', LEAD_DEFAULT_CALLING_CODE='91')
+class LeadDedupTests(TestCase):
+    """Dedup keys, upsert ingestion and the dedupe_leads command"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('dedup_admin', password='x')
+        cls.lead = Lead.objects.create(first_name='Asha', last_name='Rao', email='Asha@Example.com ',
+                                       phone='098765 43210', created_by=cls.admin)
+
+    def test_keys_are_normalized(self):
+        self.assertEqual(dedup.dedup_keys('Asha@Example.com ', '+91 98765-43210', '(0091) 98765 43210'),
+                         ['email:asha@example.com', 'phone:+919876543210'])
+        self.assertEqual(dedup.dedup_keys(None, '12345', '+1 (415) 555-0100'), ['phone:+14155550100'])
+        self.assertEqual(set(self.lead.dedup_keys.values_list('key', flat=True)),
+                         {'email:asha@example.com', 'phone:+919876543210'})
+        self.lead.email = 'asha@new.test'
+        self.lead.save()
+        self.assertEqual(set(self.lead.dedup_keys.values_list('key', flat=True)),
+                         {'email:asha@new.test', 'phone:+919876543210'})
+
+    def test_web_form_repeats_are_merged(self):
+        payload = {'first_name': 'Asha', 'last_name': 'R', 'phone': '9876543210', 'company': 'Rao & Co'}
+        response = self.client.post('/api/allotleadmanager/', payload, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Lead.objects.count(), 1)
+        self.lead.refresh_from_db()
+        # Blank fields are filled, existing values are kept
+        self.assertEqual((self.lead.company, self.lead.last_name), ('Rao & Co', 'Rao'))
+
+        # The public caller isn't shown the lead it was merged into
+        self.assertEqual(response.json(), {'detail': 'Lead received'})
+
+        new_lead = self.client.post('/api/allotleadmanager/', {**payload, 'phone': '9000000000'},
+                                    content_type='application/json')
+        self.assertEqual(Lead.objects.count(), 2)
+        # A new lead is returned serialized
+        self.assertEqual(new_lead.status_code, 201)
+        self.assertEqual(new_lead.json()['id'], Lead.objects.latest('id').id)
+        self.assertEqual(new_lead.json()['phone'], '9000000000')
+
+    def test_web_form_ingest_query_count(self):
+        payload = {'first_name': 'Ravi', 'last_name': 'K', 'email': 'ravi@example.com', 'country': 'India'}
+        # Warm the routing table, then pin the cost of one new and one merged submission:
+        # the dedup key lookup, the write, its rollup, search and dedup key signals
+        self.client.post('/api/allotleadmanager/', {**payload, 'email': 'warm@example.com'},
+                         content_type='application/json')
+        with self.assertNumQueries(20):
+            self.client.post('/api/allotleadmanager/', payload, content_type='application/json')
+        with self.assertNumQueries(18):
+            self.client.post('/api/allotleadmanager/', {**payload, 'company': 'K Ltd'},
+                             content_type='application/json')
+
+    def test_api_create_upserts_and_insert_mode_does_not(self):
+        self.client.force_login(self.admin)
+        response = self.client.post('/api/leads/', {'first_name': 'A', 'last_name': 'R', 'email': 'ASHA@example.com'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()['id'], response.json()['merged']), (self.lead.id, True))
+        with self.settings(LEAD_INGEST_MODE='insert'):
+            response = self.client.post('/api/leads/', {'first_name': 'A', 'last_name': 'R', 'email': 'asha@example.com'},
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        # The key stays with the first lead
+        self.assertEqual(LeadDedupKey.objects.get(key='email:asha@example.com').lead_id, self.lead.id)
+
+    def test_api_create_does_not_merge_into_leads_the_user_cannot_see(self):
+        rep = User.objects.create_user('dedup_rep', password='x')
+        self.client.force_login(rep)
+        response = self.client.post('/api/leads/', {'first_name': 'A', 'last_name': 'R', 'email': 'asha@example.com',
+                                                    'company': 'Taken Over', 'assigned_to': rep.id},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 409)
+        self.assertNotIn('id', response.json())
+        self.lead.refresh_from_db()
+        self.assertEqual((self.lead.assigned_to_id, self.lead.company), (None, None))
+        self.assertEqual(Lead.objects.count(), 1)
+
+    def test_api_merge_keeps_the_owner(self):
+        rep = User.objects.create_user('dedup_owner', password='x')
+        other = User.objects.create_user('dedup_other', password='x')
+        mine = Lead.objects.create(first_name='Mine', last_name='Lead', email='mine@example.com', created_by=rep)
+        self.client.force_login(rep)
+        response = self.client.post('/api/leads/', {'first_name': 'M', 'last_name': 'L', 'email': 'mine@example.com',
+                                                    'company': 'Filled', 'assigned_to': other.id,
+                                                    'manager_username': other.username},
+                                    content_type='application/json')
+        self.assertEqual((response.status_code, response.json()['merged']), (200, True))
+        mine.refresh_from_db()
+        self.assertEqual((mine.company, mine.assigned_to_id, mine.manager_username), ('Filled', None, None))
+
+    def test_import_merges_known_and_repeated_rows(self):
+        rows = 'first_name,last_name,email,phone,company\n' \
+               'Asha,Rao,asha@example.com,,Imported Co\n' \
+               'Ravi,K,ravi@example.com,,\n' \
+               'Ravi,K,RAVI@example.com,9123456789,\n'
+        report = LeadImporter(self.admin).run(iter_csv_rows(SimpleUploadedFile('leads.csv', rows.encode())))
+        self.assertEqual((report.created, report.merged), (1, 2))
+        self.lead.refresh_from_db()
+        self.assertEqual(self.lead.company, 'Imported Co')
+        ravi = Lead.objects.get(email='ravi@example.com')
+        self.assertEqual(ravi.phone, '9123456789')
+        self.assertEqual(DailyLeadStats.objects.aggregate(total=Sum('lead_count'))['total'], 2)
+        self.assertEqual(set(ravi.dedup_keys.values_list('key', flat=True)),
+                         {'email:ravi@example.com', 'phone:+919123456789'})
+
+    def test_import_merge_moves_the_lead_in_the_rollups(self):
+        rows = 'first_name,last_name,email,assigned_to\nAsha,Rao,asha@example.com,dedup_admin\n'
+        report = LeadImporter(self.admin).run(iter_csv_rows(SimpleUploadedFile('leads.csv', rows.encode())))
+        self.assertEqual(report.merged, 1)
+        self.assertEqual(DailyLeadStats.objects.filter(assigned_to=self.admin)
+                         .aggregate(total=Sum('lead_count'))['total'], 1)
+        self.assertFalse(DailyLeadStats.objects.filter(assigned_to__isnull=True, lead_count__gt=0).exists())
+
+    def test_dedupe_command_merges_into_the_oldest_lead(self):
+        with self.settings(LEAD_INGEST_MODE='insert'):
+            by_email = Lead.objects.create(first_name='Asha', last_name='Two', email='asha@example.com',
+                                           mobile='+44 20 7946 0000')
+            by_mobile = Lead.objects.create(first_name='Asha', last_name='Three', phone='00442079460000',
+                                            company='Chain Ltd')
+            Lead.objects.create(first_name='Other', last_name='Lead', email='other@example.com')
+        task = Task.objects.create(subject='Call', due_date=timezone.now(), related_lead=by_mobile,
+                                   assigned_to=self.admin, created_by=self.admin)
+        LeadDedupKey.objects.all().delete()
+
+        out = StringIO()
+        call_command('dedupe_leads', dry_run=True, stdout=out)
+        self.assertIn('1 leads have 2 duplicates', out.getvalue())
+        self.assertEqual(Lead.objects.count(), 4)
+
+        call_command('dedupe_leads', batch_size=2, stdout=StringIO())
+        self.assertEqual(set(Lead.objects.values_list('last_name', flat=True)), {'Rao', 'Lead'})
+        self.assertFalse(Lead.objects.filter(pk__in=[by_email.pk, by_mobile.pk]).exists())
+        self.lead.refresh_from_db()
+        self.assertEqual((self.lead.company, self.lead.mobile), ('Chain Ltd', '+44 20 7946 0000'))
+        task.refresh_from_db()
+        self.assertEqual(task.related_lead_id, self.lead.id)
+        self.assertEqual(LeadDedupKey.objects.get(key='phone:+442079460000').lead_id, self.lead.id)
+
+
+@override_settings(ACTIVITY_LOG_ASYNC=False)
+class BulkConvertTests(TestCase):
+    """POST /api/leads/bulk_convert/"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.rep = User.objects.create_user('convert_rep', password='x')
+        cls.other = User.objects.create_user('convert_other', password='x')
+        cls.account = Account.objects.create(name='Existing Ltd', created_by=cls.rep)
+
+    def make_leads(self, count, owner=None, **fields):
+        owner = owner or self.rep
+        return [
+            Lead.objects.create(first_name='Lead', last_name=str(i), company=f'Co {i}', email=f'l{i}@co.test',
+                                manager_username=None, assigned_to=owner, created_by=owner, **fields)
+            for i in range(count)
+        ]
+
+    def convert(self, payload):
+        if '_auth_user_id' not in self.client.session:
+            self.client.force_login(self.rep)
+        return self.client.post('/api/leads/bulk_convert/', payload, content_type='application/json')
+
+    def test_converts_many_leads_and_reports_each(self):
+        fresh, with_account, with_deal = self.make_leads(3)
+        done = self.make_leads(1, lead_status='converted')[0]
+        hidden = self.make_leads(1, owner=self.other)[0]
+        response = self.convert({'leads': [
+            {'id': fresh.id},
+            {'id': with_account.id, 'account': {'id': self.account.id}},
+            {'id': with_deal.id, 'deal': {'create_deal': True, 'amount': '900.50', 'closing_date': '2026-12-01'}},
+            {'id': done.id},
+            {'id': hidden.id},
+            {'id': fresh.id},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual((body['converted'], body['failed']), (3, 3))
+        self.assertEqual([result['status'] for result in body['results']],
+                         ['converted', 'converted', 'converted', 'error', 'error', 'error'])
+
+        fresh.refresh_from_db()
+        self.assertEqual(fresh.lead_status, 'converted')
+        self.assertEqual(fresh.converted_account.name, 'Co 0')
+        self.assertEqual(fresh.converted_contact.account_id, fresh.converted_account_id)
+        self.assertEqual(Contact.objects.get(pk=body['results'][1]['contact']).account_id, self.account.id)
+        deal = Deal.objects.get(pk=body['results'][2]['deal'])
+        self.assertEqual((deal.amount, list(deal.contacts.values_list('pk', flat=True))),
+                         (Decimal('900.50'), [body['results'][2]['contact']]))
+        self.assertTrue(SearchDocument.objects.filter(key=f"account:{body['results'][0]['account']}").exists())
+
+    def test_query_count_does_not_grow_with_the_selection(self):
+        def queries(count):
+            ids = [lead.id for lead in self.make_leads(count)]
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.convert({'ids': ids, 'deal': {'create_deal': True}})
+            self.assertEqual(response.json()['converted'], count)
+            return len(ctx.captured_queries)
+        self.client.force_login(self.rep)
+        self.assertEqual(queries(3), queries(12))
+
+    def test_database_errors_roll_back_every_lead(self):
+        leads = self.make_leads(2)
+        with mock.patch.object(Deal.contacts.through.objects, 'bulk_create', side_effect=IntegrityError('boom')):
+            with self.assertRaises(IntegrityError):
+                conversion.convert_leads(self.rep, [{'id': lead.id, 'deal': {'create_deal': True}} for lead in leads])
+        self.assertFalse(Lead.objects.filter(lead_status='converted').exists())
+        self.assertEqual(Account.objects.count(), 1)
+
+    def test_ids_are_read_back_where_bulk_create_returns_none(self):
+        leads = self.make_leads(3)
+        with mock.patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False):
+            results = conversion.convert_leads(self.rep, [{'id': lead.id} for lead in leads])
+        for lead, result in zip(leads, results):
+            lead.refresh_from_db()
+            self.assertEqual((lead.converted_account_id, lead.converted_contact_id), (result['account'], result['contact']))
+            self.assertEqual(lead.converted_account.name, lead.company)
+
+
+@override_settings(ACTIVITY_LOG_ASYNC=False)
+class BulkEditTests(TestCase):
+    """PATCH /api/<entity>/bulk/"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('bulk_admin', password='x', is_staff=True)
+        cls.leaving = User.objects.create_user('bulk_leaving', password='x')
+        cls.taking_over = User.objects.create_user('bulk_taking_over', password='x')
+
+    def make_leads(self, count, owner=None, **fields):
+        owner = owner or self.leaving
+        return [
+            Lead.objects.create(first_name='Book', last_name=str(i), email=f'book{i}@co.test',
+                                assigned_to=owner, created_by=owner, **fields)
+            for i in range(count)
+        ]
+
+    def patch(self, entity, payload, user=None):
+        user = user or self.admin
+        if self.client.session.get('_auth_user_id') != str(user.pk):
+            self.client.force_login(user)
+        return self.client.patch(f'/api/{entity}/bulk/', payload, content_type='application/json')
+
+    def test_reassigns_a_book_by_filter(self):
+        book = self.make_leads(3)
+        kept = self.make_leads(1, owner=self.taking_over, lead_status='contacted')[0]
+        before = Lead.objects.get(pk=book[0].pk).updated_at
+        response = self.patch('leads', {'filter': {'assigned_to': self.leaving.id},
+                                        'patch': {'assigned_to': self.taking_over.id}})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['updated'], 3)
+        self.assertEqual(sorted(response.json()['ids']), sorted(lead.pk for lead in book))
+
+        self.assertFalse(Lead.objects.filter(assigned_to=self.leaving).exists())
+        self.assertGreater(Lead.objects.get(pk=book[0].pk).updated_at, before)
+        self.assertEqual(Lead.objects.get(pk=kept.pk).lead_status, 'contacted')
+        # Signals were skipped; rollups, search and the activity log are still current
+        self.assertEqual(DailyLeadStats.objects.filter(assigned_to=self.taking_over).aggregate(
+            total=Sum('lead_count'))['total'], 4)
+        self.assertFalse(DailyLeadStats.objects.filter(assigned_to=self.leaving).exists())
+        self.assertEqual(SearchDocument.objects.get(key=f'lead:{book[0].pk}').assigned_to_id, self.taking_over.id)
+        logs = UserActivityLog.objects.filter(user=self.admin, action_type='update', model_affected='Lead')
+        self.assertCountEqual(logs.values_list('object_id', flat=True), [lead.pk for lead in book])
+
+    def test_id_list_only_touches_visible_rows(self):
+        own = self.make_leads(2)
+        hidden = self.make_leads(1, owner=self.taking_over)[0]
+        response = self.patch('leads', {'ids': [own[0].pk, str(own[1].pk), hidden.pk, 999999],
+                                        'patch': {'lead_status': 'qualified'}}, user=self.leaving)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['missing'], [hidden.pk, 999999])
+        self.assertEqual(Lead.objects.filter(lead_status='qualified').count(), 2)
+        self.assertEqual(Lead.objects.get(pk=hidden.pk).lead_status, 'new')
+
+    def test_rejects_invalid_patches(self):
+        lead = self.make_leads(1)[0]
+        for payload in (
+            {'ids': [lead.pk], 'patch': {'lead_status': 'bogus'}},
+            {'ids': [lead.pk], 'patch': {'first_name': 'Sneaky'}},
+            {'ids': [lead.pk], 'patch': {'assigned_to': 999999}},
+            {'ids': [lead.pk], 'patch': {'lead_status': 'converted'}},
+            {'filter': {}, 'patch': {'lead_status': 'contacted'}},
+            {'filter': {'email': lead.email}, 'patch': {'lead_status': 'contacted'}},
+        ):
+            response = self.patch('leads', payload)
+            self.assertEqual(response.status_code, 400, payload)
+        self.assertEqual(Lead.objects.get(pk=lead.pk).lead_status, 'new')
+
+        with override_settings(BULK_EDIT_MAX_ROWS=1):
+            self.make_leads(1)
+            response = self.patch('leads', {'filter': {'lead_status': 'new'}, 'patch': {'lead_status': 'contacted'}})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Lead.objects.filter(lead_status='contacted').exists())
+
+    def test_tasks_and_deals(self):
+        due = timezone.now() + timedelta(days=1)
+        tasks = [
+            Task.objects.create(subject=f'Call {i}', due_date=due, assigned_to=self.leaving, created_by=self.leaving)
+            for i in range(2)
+        ]
+        response = self.patch('tasks', {'ids': [task.pk for task in tasks],
+                                        'patch': {'status': 'completed', 'priority': 'high'}})
+        self.assertEqual(response.json()['updated'], 2)
+        for task in Task.objects.filter(pk__in=[task.pk for task in tasks]):
+            self.assertEqual((task.status, task.priority), ('completed', 'high'))
+            self.assertIsNotNone(task.completed_date)
+        self.assertEqual(DailyTaskStats.objects.filter(priority='high').aggregate(
+            total=Sum('completed_count'))['total'], 2)
+
+        account = Account.objects.create(name='Bulk Ltd', created_by=self.leaving)
+        deal = Deal.objects.create(name='Renewal', account=account, amount=Decimal('10'),
+                                   closing_date=date(2026, 12, 1), created_by=self.leaving)
+        response = self.patch('deals', {'filter': {'account': account.pk, 'stage': 'qualification'},
+                                        'patch': {'stage': 'proposal', 'assigned_to': self.taking_over.id}})
+        self.assertEqual(response.json()['ids'], [deal.pk])
+        deal.refresh_from_db()
+        self.assertEqual((deal.stage, deal.assigned_to_id), ('proposal', self.taking_over.id))
+
+    def test_query_count_does_not_grow_with_the_selection(self):
+        def queries(count):
+            ids = [lead.pk for lead in self.make_leads(count)]
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.patch('leads', {'ids': ids, 'patch': {'lead_status': 'contacted'}})
+            self.assertEqual(response.json()['updated'], count)
+            return len(ctx.captured_queries)
+        self.client.force_login(self.admin)
+        self.assertEqual(queries(3), queries(12))
+
+
+class FieldsetTests(TestCase):
+    """?fields=, ?expand= and ?lean= on the list/retrieve endpoints"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('fieldset_user', password='x', first_name='Fay', last_name='Set')
+        cls.account = Account.objects.create(name='Sparse Ltd', created_by=cls.user)
+        cls.leads = [
+            Lead.objects.create(first_name='Lean', last_name=str(i), description='x' * 500, address='Long road',
+                                assigned_to=cls.user, created_by=cls.user)
+            for i in range(3)
+        ]
+        cls.deal = Deal.objects.create(name='Sparse deal', account=cls.account, amount=Decimal('12.50'),
+                                       closing_date=date(2026, 12, 1), assigned_to=cls.user, created_by=cls.user)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_fields_narrow_the_response_and_the_query(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/leads/?fields=id,last_name,assigned_to_name,full_name')
+        self.assertEqual(response.status_code, 200)
+        row = response.json()['results'][0]
+        self.assertEqual(set(row), {'id', 'last_name', 'assigned_to_name', 'full_name'})
+        self.assertEqual((row['assigned_to_name'], row['full_name']), ('Fay Set', 'Lean 2'))
+        page_query = ctx.captured_queries[-1]['sql']
+        self.assertNotIn('"description"', page_query)
+        self.assertNotIn('crm_app_industry', page_query)
+
+        response = self.client.get(f'/api/leads/{self.leads[0].pk}/?fields=id,lead_status')
+        self.assertEqual(response.json(), {'id': self.leads[0].pk, 'lead_status': 'new'})
+
+    def test_expand_nests_related_objects(self):
+        response = self.client.get('/api/deals/?fields=id,contacts_count&expand=account,assigned_to')
+        row = response.json()['results'][0]
+        self.assertEqual(set(row), {'id', 'contacts_count', 'account', 'assigned_to'})
+        self.assertEqual(row['account']['name'], 'Sparse Ltd')
+        self.assertEqual(row['assigned_to']['username'], 'fieldset_user')
+        # Without fields= everything else stays as it was
+        full = self.client.get('/api/deals/?expand=account').json()['results'][0]
+        self.assertEqual((full['account']['id'], full['account_name']), (self.account.pk, 'Sparse Ltd'))
+
+    def test_lean_rows_match_the_serializer(self):
+        full = self.client.get('/api/deals/').json()['results'][0]
+        lean = self.client.get('/api/deals/?lean=1').json()['results'][0]
+        self.assertNotIn('description', lean)
+        self.assertNotIn('assigned_to_name', lean)
+        for name, value in lean.items():
+            self.assertEqual(value, full[name], name)
+
+        response = self.client.get('/api/leads/?lean=1&fields=id,last_name&cursor=&page_size=2')
+        self.assertEqual(response.json()['results'], [{'id': lead.pk, 'last_name': lead.last_name}
+                                                      for lead in reversed(self.leads[1:])])
+        self.assertEqual(len(self.client.get(response.json()['next']).json()['results']), 1)
+
+    def test_rejects_unknown_and_unavailable_fields(self):
+        for url in ('/api/leads/?fields=nope', '/api/leads/?expand=created_by',
+                    '/api/leads/?lean=1&fields=full_name', '/api/leads/?lean=1&expand=assigned_to'):
+            self.assertEqual(self.client.get(url).status_code, 400, url)
+
+
+class ReadSerializerTests(TestCase):
+    """GET lists rendered from .values() match the ModelSerializer output"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('reader', password='x', first_name='Rea', last_name='Der', is_staff=True)
+        industry = Industry.objects.create(name='Fintech')
+        cls.lead = Lead.objects.create(salutation='dr', first_name='Ada', last_name='Lee', industry=industry,
+                                       annual_revenue=Decimal('1200.50'), assigned_to=cls.user, created_by=cls.user)
+        Lead.objects.create(first_name='No', last_name='Owner', created_by=cls.user)
+        account = Account.objects.create(name='Reader Ltd', created_by=cls.user)
+        contact = Contact.objects.create(first_name='Con', last_name='Tact', account=account, created_by=cls.user)
+        deal = Deal.objects.create(name='Reader deal', account=account, amount=Decimal('10'),
+                                   closing_date=date(2026, 12, 1), created_by=cls.user)
+        due = timezone.now() + timedelta(days=2)
+        for related in ({'related_lead': cls.lead}, {'related_contact': contact}, {'related_account': account},
+                        {'related_deal': deal}, {}):
+            Task.objects.create(subject='Follow up', due_date=due, assigned_to=cls.user, created_by=cls.user,
+                                **related)
+        Transaction.objects.create(transaction_type='invoice', amount=Decimal('99.90'), date=date(2026, 1, 5),
+                                   account=account, deal=deal, created_by=cls.user)
+        Transaction.objects.create(transaction_type='refund', amount=Decimal('5'), date=date(2026, 1, 6),
+                                   account=account, created_by=cls.user)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def assertSameAsModelSerializer(self, viewset, url):
+        fast = self.client.get(url)
+        with mock.patch.object(viewset, 'read_serializer_class', None):
+            slow = self.client.get(url)
+        self.assertEqual(fast.status_code, 200)
+        self.assertEqual(json.loads(fast.content), json.loads(slow.content))
+        return fast.json()
+
+    def test_lists_match_the_model_serializers(self):
+        body = self.assertSameAsModelSerializer(LeadViewSet, '/api/leads/')
+        self.assertEqual(body['results'][1]['full_name'], 'Dr. Ada Lee')
+        self.assertNotIn('assigned_to_name', body['results'][0])
+        body = self.assertSameAsModelSerializer(TaskViewSet, '/api/tasks/')
+        self.assertEqual(sorted(str((task['related_to'] or {}).get('type')) for task in body['results']),
+                         ['None', 'account', 'contact', 'deal', 'lead'])
+        self.assertSameAsModelSerializer(TransactionViewSet, '/api/transactions/')
+
+    def test_fields_cursor_and_ordering_use_the_read_path(self):
+        for url in ('/api/leads/?fields=id,full_name,industry_name', '/api/tasks/?cursor=&page_size=2',
+                    '/api/leads/?ordering=last_name', '/api/transactions/?fields=amount,deal_name&status=pending'):
+            self.assertSameAsModelSerializer(LeadViewSet if 'leads' in url else
+                                             TaskViewSet if 'tasks' in url else TransactionViewSet, url)
+
+    def test_one_query_per_page(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get('/api/tasks/?cursor=')
+        self.assertEqual(len([q for q in ctx.captured_queries if 'crm_app_task' in q['sql']]), 1)
+
+    def test_read_serializers_cover_every_field(self):
+        for reader in (LeadReadSerializer, TaskReadSerializer, TransactionReadSerializer):
+            self.assertEqual(list(reader.get_columns()), list(reader.serializer_class().fields))
+
+    def test_renderer_cache_is_bounded(self):
+        names = list(LeadReadSerializer.get_columns())
+        self.assertIs(LeadReadSerializer(['id', 'email']).render, LeadReadSerializer(['email', 'id']).render)
+        for first in names:
+            for second in names:
+                LeadReadSerializer([first, second])
+        self.assertLessEqual(LeadReadSerializer._renderer.cache_info().currsize, RENDERER_CACHE_SIZE)
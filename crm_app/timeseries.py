@@ -0,0 +1,153 @@
+"""
+Time-bucket aggregation for the dashboard charts.
+
+The chart helpers used to issue one COUNT per day/month with a
+``created_at__date=day`` filter, which wraps the column in a function and
+cannot use an index. The task charts now read the DailyTaskStats rollup
+(see rollups.py): every series is a single GROUP BY over a plain ``day``
+range, so the cost depends on the number of days, not on the number of
+tasks. Buckets without rows are filled in Python.
+"""
+from datetime import timedelta
+
+from django.db.models import F, Q, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .hierarchy import ManagerHierarchy
+from .models import Task, DailyTaskStats, is_manager_user
+
+# Number of buckets and bucket size for each chart window
+WINDOWS = {
+    'week': ('day', 7),
+    'month': ('day', 30),
+    'year': ('month', 12),
+}
+
+
+def _add_months(day, months):
+    """First day of the month `months` away from day's month"""
+    month_index = day.year * 12 + (day.month - 1) + months
+    return day.replace(year=month_index // 12, month=month_index % 12 + 1, day=1)
+
+
+def window_buckets(window, today=None):
+    """
+    Return (kind, bucket_dates, start_day, end_day) for a chart window.
+
+    bucket_dates are local dates (the first day of each month for 'year');
+    start_day/end_day bound the whole window, end_day exclusive.
+    """
+    kind, size = WINDOWS[window]
+    today = today or timezone.localdate()
+    if kind == 'day':
+        buckets = [today - timedelta(days=i) for i in range(size - 1, -1, -1)]
+        end_day = today + timedelta(days=1)
+    else:
+        first_of_month = today.replace(day=1)
+        buckets = [_add_months(first_of_month, -i) for i in range(size - 1, -1, -1)]
+        end_day = _add_months(first_of_month, 1)
+    return kind, buckets, buckets[0], end_day
+
+
+def bucket_sums(stats, measure, kind, start_day, end_day):
+    """
+    Sum a rollup measure per day/month for days in [start_day, end_day).
+
+    Runs one GROUP BY query and returns {date: total}.
+    """
+    bucket = F('day') if kind == 'day' else TruncMonth('day')
+    rows = (
+        stats.filter(day__gte=start_day, day__lt=end_day)
+        .order_by()
+        .annotate(bucket=bucket)
+        .values('bucket')
+        .annotate(total=Sum(measure))
+        .values_list('bucket', 'total')
+    )
+    return {bucket: total or 0 for bucket, total in rows}
+
+
+def fill_series(buckets, counts):
+    """Turn a sparse {date: count} dict into a list aligned with buckets"""
+    return [counts.get(bucket, 0) for bucket in buckets]
+
+
+def task_chart_scope(user=None):
+    """
+    Filter for the tasks counted by the admin task charts.
+
+    Managers see tasks whose manager is them, assigned to one of their
+    subordinates or created by them; everyone else sees all tasks. The
+    columns exist on both Task and DailyTaskStats.
+    """
+    if user and is_manager_user(user):
+        managed_user_ids = ManagerHierarchy.subordinate_ids(user)
+        return (
+            Q(manager_id=user.id) |
+            Q(assigned_to_id__in=managed_user_ids) |
+            Q(created_by_id=user.id)
+        )
+    return Q()
+
+
+def task_trend(user=None, window='week', today=None):
+    """Created/completed task series for a chart window in two GROUP BY queries"""
+    kind, buckets, start_day, end_day = window_buckets(window, today)
+    stats = DailyTaskStats.objects.filter(task_chart_scope(user))
+
+    created = bucket_sums(stats, 'created_count', kind, start_day, end_day)
+    completed = bucket_sums(stats, 'completed_count', kind, start_day, end_day)
+
+    if window == 'week':
+        labels = [day.strftime('%a') for day in buckets]  # Mon, Tue, ...
+    elif window == 'month':
+        labels = [day.day for day in buckets]  # Day of month (1-31)
+    else:
+        labels = [day.strftime('%b') for day in buckets]  # Jan, Feb, ...
+
+    return {
+        'labels': labels,
+        'created': fill_series(buckets, created),
+        'completed': fill_series(buckets, completed),
+    }
+
+
+def priority_windows(today=None):
+    """
+    First local day of each priority histogram window:
+    the last 7 days, the last 30 days and the current year to date.
+    """
+    today = today or timezone.localdate()
+    return {
+        'week': today - timedelta(days=7),
+        'month': today - timedelta(days=30),
+        'year': today.replace(month=1, day=1),
+    }
+
+
+def priority_histogram(user=None, today=None, stats=None):
+    """
+    Task counts per priority for every window in priority_windows().
+
+    Uses one conditional-aggregation query (Sum(filter=Q(...)) per
+    window/priority pair) and returns {'week': {'high': n, ...}, ...}.
+    Pass a DailyTaskStats queryset as stats to count a different scope.
+    """
+    today = today or timezone.localdate()
+    windows = priority_windows(today)
+    priorities = [value for value, _label in Task.TASK_PRIORITIES]
+
+    if stats is None:
+        stats = DailyTaskStats.objects.filter(task_chart_scope(user))
+    aggregates = {
+        f'{window}_{priority}': Sum('created_count', filter=Q(priority=priority, day__gte=start_day))
+        for window, start_day in windows.items()
+        for priority in priorities
+    }
+    totals = stats.filter(day__gte=min(windows.values()), day__lte=today).aggregate(**aggregates)
+
+    return {
+        window: {priority: totals[f'{window}_{priority}'] or 0 for priority in priorities}
+        for window in windows
+    }
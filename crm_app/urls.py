@@ -26,6 +26,9 @@ urlpatterns = [
     path('api/', include(router.urls)),
     path('api/allotleadmanager/', views.allot_lead_manager, name='allot-lead-manager'),
     path('api/users-by-manager/', api_views.get_users_by_manager, name='users-by-manager'),
+    path('api/search/', views.search, name='search'),
+    path('api/autocomplete/<slug:entity>/', views.autocomplete_entity, name='autocomplete'),
+    path('api/export/<slug:entity>.<slug:file_format>', views.export_entity, name='export-entity'),
     
     # Authentication endpoints
     path('api/register/', views.register_user, name='register'),
@@ -91,6 +94,8 @@ urlpatterns = [
     path('admin/leads/<int:lead_id>/', admin_views.admin_lead_detail, name='admin_lead_detail'),
     path('admin/leads/<int:lead_id>/edit/', admin_views.admin_lead_edit, name='admin_lead_edit'),
     path('admin/leads/import/', admin_views.admin_lead_import, name='admin_lead_import'),
+    path('admin/import/jobs/<int:job_id>/', admin_views.admin_import_job_status, name='admin_import_job_status'),
+    path('admin/import/jobs/<int:job_id>/errors/', admin_views.admin_import_job_errors, name='admin_import_job_errors'),
     path('admin/leads/convert/<int:lead_id>/', admin_views.admin_lead_convert, name='admin_lead_convert'),
     path('admin/download-lead-template/', admin_views.admin_download_lead_template, name='admin_download_lead_template'),
     path('admin/contacts/', admin_views.admin_contacts, name='admin_contacts'),
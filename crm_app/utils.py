@@ -1,3 +1,6 @@
+from django.utils import timezone
+
+from .activity import record_activities, record_activity
 from .models import UserActivityLog
 
 def log_user_activity(user, action_type, action_detail, model_affected=None, object_id=None, ip_address=None, additional_data=None):
@@ -12,9 +15,12 @@ def log_user_activity(user, action_type, action_detail, model_affected=None, obj
     - object_id: Optional ID of the object affected
     - ip_address: Optional IP address of the user
     - additional_data: Optional JSON data with additional information
+
+    The row is queued and written in batches by a background thread
+    (see activity.py), so logging adds no database round trip to the request.
     """
     try:
-        UserActivityLog.objects.create(
+        record_activity(UserActivityLog(
             user=user,
             action_type=action_type,
             action_detail=action_detail,
@@ -22,7 +28,30 @@ def log_user_activity(user, action_type, action_detail, model_affected=None, obj
             object_id=object_id,
             ip_address=ip_address,
             additional_data=additional_data
-        )
+        ))
     except Exception as e:
         # Log the error but don't disrupt the user experience
         print(f"Error logging user activity: {str(e)}")
+
+
+def log_user_activities(user, action_type, action_detail, model_affected, object_ids, additional_data=None):
+    """
+    Log the same action on many objects, one UserActivityLog row per object,
+    written together (see activity.record_activities).
+    """
+    try:
+        timestamp = timezone.now()
+        record_activities(
+            UserActivityLog(
+                user=user,
+                action_type=action_type,
+                action_detail=action_detail,
+                model_affected=model_affected,
+                object_id=object_id,
+                timestamp=timestamp,
+                additional_data=additional_data
+            )
+            for object_id in object_ids
+        )
+    except Exception as e:
+        print(f"Error logging user activity: {str(e)}")
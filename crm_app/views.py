@@ -1,13 +1,19 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
-from django.db.models import Count, Sum, Q
+from django.db.models import Count, Sum, Q, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.contrib import messages
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.contrib.auth.decorators import login_required
 
 from .utils import log_user_activity
+from .exports import EXPORTS, stream_csv, stream_xlsx
+from . import autocomplete, bulk_edit, conversion, dedup, routing, search as search_index
+from .fieldsets import Fieldset
+from .pagination import KeysetCursorPagination
+from .read_serializers import LeadReadSerializer, TaskReadSerializer, TransactionReadSerializer
 
 from rest_framework import viewsets, status, permissions, filters
 from rest_framework.decorators import api_view, permission_classes, action
@@ -17,7 +23,8 @@ from rest_framework_simplejwt.tokens import RefreshToken
 
 from .models import (
     Industry, Account, Contact, Lead, Deal, Task, Event, 
-    Note, Document, Transaction, Product, DealProduct, UserProfile, AllotManager
+    Note, Document, Transaction, Product, DealProduct, UserProfile,
+    DailyDealStats
 )
 from .serializers import (
     UserSerializer, UserProfileSerializer, IndustrySerializer, AccountSerializer,
@@ -187,26 +194,46 @@ def dashboard(request):
     deals_count = Deal.objects.count()
     tasks_count = Task.objects.count()
     
-    # Get deals by stage
+    # The rep dashboard (?manager_username=): its cards count, and its recent
+    # lists show, the rows under that manager the user can see that are
+    # assigned to them or unassigned. Counted here instead of paging through
+    # every list in the browser.
+    manager_username = request.query_params.get('manager_username')
+    scope_counts = {}
+    if manager_username:
+        mine = Q(assigned_to__isnull=True) | Q(assigned_to=request.user)
+        scoped = {
+            'leads': Lead.objects.visible_to(request.user).filter(mine, manager_username=manager_username),
+            'contacts': Contact.objects.visible_to(request.user).filter(mine, manager_username=manager_username),
+            'accounts': Account.objects.visible_to(request.user).filter(mine, manager_username=manager_username),
+            'deals': Deal.objects.visible_to(request.user).filter(mine, account__manager_username=manager_username),
+        }
+        scope_counts = {key: queryset.count() for key, queryset in scoped.items()}
+    
+    # Get deals by stage from the daily deal rollup (one GROUP BY)
+    stage_totals = dict(
+        DailyDealStats.objects.order_by().values('stage').annotate(total=Sum('deal_count')).values_list('stage', 'total')
+    )
     deals_by_stage = {}
     for stage_choice in Deal.DEAL_STAGES:
         stage_code = stage_choice[0]
         stage_name = stage_choice[1]
-        count = Deal.objects.filter(stage=stage_code).count()
-        deals_by_stage[stage_name] = count
+        deals_by_stage[stage_name] = stage_totals.get(stage_code) or 0
     
     # Get recent leads (last 5)
-    recent_leads = Lead.objects.all().order_by('-created_at')[:5]
+    recent_leads = scoped['leads'] if manager_username else Lead.objects.all()
+    recent_leads = recent_leads.select_related('assigned_to').order_by('-created_at')[:5]
     
     # Get recent deals (last 5)
-    recent_deals = Deal.objects.all().order_by('-created_at')[:5]
+    recent_deals = scoped['deals'] if manager_username else Deal.objects.all()
+    recent_deals = recent_deals.select_related('assigned_to', 'account').order_by('-created_at')[:5]
     
     # Get upcoming tasks (next 5 due) assigned to the current user
-    upcoming_tasks = Task.objects.filter(
+    upcoming_tasks = TaskViewSet.with_profile(Task.objects.filter(
         status__in=['not_started', 'in_progress', 'waiting'],
         due_date__gte=timezone.now(),
         assigned_to=request.user  # Only show tasks assigned to the current user
-    ).order_by('due_date')[:5]
+    )).order_by('due_date')[:5]
     
     # Safe serialization of tasks using the proper field names
     try:
@@ -254,7 +281,7 @@ def dashboard(request):
             'name': deal.name,
             'amount': deal.amount,
             'stage': deal.stage,
-            'expected_close_date': deal.expected_close_date,
+            'expected_close_date': deal.closing_date,
             'created_at': deal.created_at
         }
         # Add assigned_to if it exists
@@ -275,6 +302,7 @@ def dashboard(request):
         'accounts_count': accounts_count,
         'deals_count': deals_count,
         'tasks_count': tasks_count,
+        'scope_counts': scope_counts,
         'deals_by_stage': deals_by_stage,
         'recent_leads': serialized_leads,
         'recent_deals': serialized_deals,
@@ -283,6 +311,170 @@ def dashboard(request):
     
     return Response(dashboard_data)
 
+# Bulk export: /api/export/<entity>.csv or .xlsx
+EXPORT_CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_entity(request, entity, file_format):
+    """Stream every row of an entity the user can see, in constant memory (see exports.py)"""
+    spec = EXPORTS.get(entity)
+    if spec is None or file_format not in EXPORT_CONTENT_TYPES:
+        return Response({'error': 'Unknown export'}, status=status.HTTP_404_NOT_FOUND)
+    
+    queryset = spec.queryset(request.user)
+    if file_format == 'csv':
+        content = stream_csv(spec, queryset)
+    else:
+        content = stream_xlsx(spec, queryset, sheet_name=entity.title())
+    
+    response = StreamingHttpResponse(content, content_type=EXPORT_CONTENT_TYPES[file_format])
+    response['Content-Disposition'] = f'attachment; filename="{entity}-{timezone.localdate():%Y-%m-%d}.{file_format}"'
+    return response
+
+# Full-text search across leads, contacts and accounts (see search.py)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def search(request):
+    # ?types=lead,contact narrows the entity types searched
+    types = request.query_params.get('types', '').split(',')
+    entity_types = [value for value in types if value in search_index.ENTITY_TYPES]
+    try:
+        limit = min(max(int(request.query_params.get('limit', 20)), 1), 100)
+    except ValueError:
+        limit = 20
+    
+    documents = search_index.search(request.user, request.query_params.get('q', ''), entity_types, limit)
+    return Response({
+        'results': [
+            {
+                'type': document.entity_type,
+                'id': document.object_id,
+                'title': document.title,
+                'subtitle': document.subtitle,
+            }
+            for document in documents
+        ]
+    })
+
+# Typeahead for the related-item pickers (see autocomplete.py)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def autocomplete_entity(request, entity):
+    if entity not in autocomplete.SPECS:
+        return Response({'error': f'Unknown entity: {entity}'}, status=status.HTTP_404_NOT_FOUND)
+    try:
+        limit = int(request.query_params.get('limit', autocomplete.DEFAULT_LIMIT))
+    except ValueError:
+        limit = autocomplete.DEFAULT_LIMIT
+    limit = min(max(limit, 1), autocomplete.MAX_LIMIT)
+    
+    results = autocomplete.lookup(request.user, entity, request.query_params.get('prefix', ''), limit)
+    return Response({'results': results})
+
+class PrefetchProfileMixin:
+    """
+    Load everything the ViewSet's serializer reads in a fixed number of queries.
+
+    Each ViewSet declares the FKs its serializer follows (select_related),
+    the many-to-many/reverse relations it lists (prefetch_related) and any
+    per-row aggregates (annotations). The profile is applied on top of
+    get_queryset() for list/retrieve/update, and custom actions that
+    serialize another model use that model's ViewSet.with_profile().
+
+    list and retrieve also take ?fields=, ?expand= and (list only) ?lean=,
+    which narrow the profile to what the selected fields read (see
+    fieldsets.py). ViewSets with a read_serializer_class render GET lists
+    from .values() rows instead of serializer_class (see read_serializers.py).
+    """
+    select_related_fields = ()
+    prefetch_related_fields = ()
+    annotations = {}
+    read_serializer_class = None
+
+    @classmethod
+    def with_profile(cls, queryset):
+        if cls.select_related_fields:
+            queryset = queryset.select_related(*cls.select_related_fields)
+        if cls.prefetch_related_fields:
+            queryset = queryset.prefetch_related(*cls.prefetch_related_fields)
+        if cls.annotations:
+            queryset = queryset.annotate(**cls.annotations)
+        return queryset
+
+    def get_fieldset(self):
+        if not hasattr(self, '_fieldset'):
+            self._fieldset = None
+            if self.action in ('list', 'retrieve'):
+                self._fieldset = Fieldset.from_request(
+                    self.request, self.get_serializer_class(),
+                    lean_allowed=self.action == 'list', annotations=self.annotations,
+                )
+        return self._fieldset
+
+    def get_read_serializer(self):
+        """The ValuesSerializer for this request (GET list without expand or lean), or None"""
+        if not hasattr(self, '_read_serializer'):
+            self._read_serializer = None
+            fieldset = self.get_fieldset()
+            if self.read_serializer_class is not None and self.action == 'list' \
+                    and (fieldset is None or not (fieldset.lean or fieldset.expand)):
+                self._read_serializer = self.read_serializer_class(fieldset.fields if fieldset else None)
+        return self._read_serializer
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        reader = self.get_read_serializer()
+        if reader is not None:
+            # The cursor paginator reads its ordering columns from the rows
+            ordering = [name.lstrip('-') for name in KeysetCursorPagination.get_ordering(queryset, self)]
+            return reader.values(queryset, extra=ordering)
+        fieldset = self.get_fieldset()
+        if fieldset is None:
+            return self.with_profile(queryset)
+        return fieldset.narrow(queryset, self)
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        fieldset = self.get_fieldset()
+        if fieldset is not None:
+            fieldset.apply(getattr(serializer, 'child', serializer))
+        return serializer
+
+    def list(self, request, *args, **kwargs):
+        reader = self.get_read_serializer()
+        fieldset = self.get_fieldset()
+        if reader is not None:
+            render = reader.render_many
+        elif fieldset is not None and fieldset.lean:
+            render = fieldset.lean_rows
+        else:
+            return super().list(request, *args, **kwargs)
+        # Rows are dicts from .values(); no ModelSerializer involved
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(render(page))
+        return Response(render(queryset))
+
+class BulkEditMixin:
+    """PATCH /api/<entity>/bulk/: one field patch applied to many records (see bulk_edit.py)"""
+    bulk_edit_entity = None
+
+    @action(detail=False, methods=['patch'], url_path='bulk')
+    def bulk(self, request):
+        try:
+            result = bulk_edit.apply(request.user, self.bulk_edit_entity, request.data)
+        except bulk_edit.BulkEditError as error:
+            return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result)
+
+# Serializers with a get_related_to() follow these four FKs
+RELATED_TO_FIELDS = ('related_lead', 'related_contact', 'related_account', 'related_deal')
+
 # ViewSets for all models
 class IndustryViewSet(viewsets.ModelViewSet):
     queryset = Industry.objects.all()
@@ -292,47 +484,23 @@ class IndustryViewSet(viewsets.ModelViewSet):
     search_fields = ['name', 'description']
     ordering_fields = ['name', 'created_at']
 
-class AccountViewSet(viewsets.ModelViewSet):
+class AccountViewSet(PrefetchProfileMixin, viewsets.ModelViewSet):
     queryset = Account.objects.all()
     serializer_class = AccountSerializer
     permission_classes = [IsAuthenticated]
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['name', 'website', 'phone', 'description']
     ordering_fields = ['name', 'created_at', 'annual_revenue']
+    select_related_fields = ('industry', 'assigned_to')
 
     def get_queryset(self):
         """Return accounts visible to the requesting user with optional ?manager=username filter."""
-        from django.db.models import Q as models_Q
-        from django.contrib.auth.models import User
-        user = self.request.user
-
-        # Base queryset and optional manager filter via query param
-        base_qs = Account.objects.all()
+        # Row-level visibility (staff / manager / regular user) lives in VisibleQuerySet
+        base_qs = Account.objects.visible_to(self.request.user)
         manager_username_param = self.request.query_params.get('manager')
         if manager_username_param:
             base_qs = base_qs.filter(manager_username=manager_username_param)
-
-        # Staff / superuser → unrestricted
-        if user.is_staff or user.is_superuser:
-            return base_qs
-
-        # Identify if user is a manager
-        is_manager = False
-        if hasattr(user, 'profile') and user.profile and user.profile.role:
-            is_manager = user.profile.role.lower() == 'manager'
-
-        if is_manager:
-            managed_user_ids = User.objects.filter(profile__manager_username=user.username).values_list('id', flat=True)
-            return base_qs.filter(
-                models_Q(assigned_to=user) |
-                models_Q(created_by=user) |
-                models_Q(manager_username=user.username) |
-                models_Q(assigned_to__id__in=managed_user_ids) |
-                models_Q(created_by__id__in=managed_user_ids)
-            ).distinct()
-
-        # Regular user – only accounts they own/created
-        return base_qs.filter(models_Q(assigned_to=user) | models_Q(created_by=user))
+        return base_qs
 
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
@@ -340,82 +508,61 @@ class AccountViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def contacts(self, request, pk=None):
         account = self.get_object()
-        contacts = Contact.objects.filter(account=account)
+        contacts = ContactViewSet.with_profile(Contact.objects.filter(account=account))
         serializer = ContactSerializer(contacts, many=True)
         return Response(serializer.data)
     
     @action(detail=True, methods=['get'])
     def deals(self, request, pk=None):
         account = self.get_object()
-        deals = Deal.objects.filter(account=account)
+        deals = DealViewSet.with_profile(Deal.objects.filter(account=account))
         serializer = DealSerializer(deals, many=True)
         return Response(serializer.data)
     
     @action(detail=True, methods=['get'])
     def tasks(self, request, pk=None):
         account = self.get_object()
-        tasks = Task.objects.filter(related_account=account)
+        tasks = TaskViewSet.with_profile(Task.objects.filter(related_account=account))
         serializer = TaskSerializer(tasks, many=True)
         return Response(serializer.data)
     
     @action(detail=True, methods=['get'])
     def notes(self, request, pk=None):
         account = self.get_object()
-        notes = Note.objects.filter(related_account=account)
+        notes = NoteViewSet.with_profile(Note.objects.filter(related_account=account))
         serializer = NoteSerializer(notes, many=True)
         return Response(serializer.data)
     
     @action(detail=True, methods=['get'])
     def documents(self, request, pk=None):
         account = self.get_object()
-        documents = Document.objects.filter(related_account=account)
+        documents = DocumentViewSet.with_profile(Document.objects.filter(related_account=account))
         serializer = DocumentSerializer(documents, many=True, context={'request': request})
         return Response(serializer.data)
     
     @action(detail=True, methods=['get'])
     def transactions(self, request, pk=None):
         account = self.get_object()
-        transactions = Transaction.objects.filter(account=account)
+        transactions = TransactionViewSet.with_profile(Transaction.objects.filter(account=account))
         serializer = TransactionSerializer(transactions, many=True)
         return Response(serializer.data)
 
-class ContactViewSet(viewsets.ModelViewSet):
+class ContactViewSet(PrefetchProfileMixin, viewsets.ModelViewSet):
     queryset = Contact.objects.all()
     serializer_class = ContactSerializer
     permission_classes = [IsAuthenticated]
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['first_name', 'last_name', 'email', 'phone', 'mobile', 'job_title']
     ordering_fields = ['first_name', 'last_name', 'created_at']
+    select_related_fields = ('account', 'assigned_to')
 
     def get_queryset(self):
         """Return contacts visible to the requesting user with optional ?manager=username filter."""
-        from django.db.models import Q as models_Q
-        from django.contrib.auth.models import User
-        user = self.request.user
-
-        base_qs = Contact.objects.all()
+        base_qs = Contact.objects.visible_to(self.request.user)
         manager_username_param = self.request.query_params.get('manager')
         if manager_username_param:
             base_qs = base_qs.filter(manager_username=manager_username_param)
-
-        if user.is_staff or user.is_superuser:
-            return base_qs
-
-        is_manager = False
-        if hasattr(user, 'profile') and user.profile and user.profile.role:
-            is_manager = user.profile.role.lower() == 'manager'
-
-        if is_manager:
-            managed_user_ids = User.objects.filter(profile__manager_username=user.username).values_list('id', flat=True)
-            return base_qs.filter(
-                models_Q(assigned_to=user) |
-                models_Q(created_by=user) |
-                models_Q(manager_username=user.username) |
-                models_Q(assigned_to__id__in=managed_user_ids) |
-                models_Q(created_by__id__in=managed_user_ids)
-            ).distinct()
-
-        return base_qs.filter(models_Q(assigned_to=user) | models_Q(created_by=user))
+        return base_qs
 
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
@@ -423,38 +570,41 @@ class ContactViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def deals(self, request, pk=None):
         contact = self.get_object()
-        deals = Deal.objects.filter(contacts=contact)
+        deals = DealViewSet.with_profile(Deal.objects.filter(contacts=contact))
         serializer = DealSerializer(deals, many=True)
         return Response(serializer.data)
     
     @action(detail=True, methods=['get'])
     def tasks(self, request, pk=None):
         contact = self.get_object()
-        tasks = Task.objects.filter(related_contact=contact)
+        tasks = TaskViewSet.with_profile(Task.objects.filter(related_contact=contact))
         serializer = TaskSerializer(tasks, many=True)
         return Response(serializer.data)
     
     @action(detail=True, methods=['get'])
     def notes(self, request, pk=None):
         contact = self.get_object()
-        notes = Note.objects.filter(related_contact=contact)
+        notes = NoteViewSet.with_profile(Note.objects.filter(related_contact=contact))
         serializer = NoteSerializer(notes, many=True)
         return Response(serializer.data)
     
     @action(detail=True, methods=['get'])
     def documents(self, request, pk=None):
         contact = self.get_object()
-        documents = Document.objects.filter(related_contact=contact)
+        documents = DocumentViewSet.with_profile(Document.objects.filter(related_contact=contact))
         serializer = DocumentSerializer(documents, many=True, context={'request': request})
         return Response(serializer.data)
 
-class LeadViewSet(viewsets.ModelViewSet):
+class LeadViewSet(BulkEditMixin, PrefetchProfileMixin, viewsets.ModelViewSet):
     queryset = Lead.objects.all()
     serializer_class = LeadSerializer
+    read_serializer_class = LeadReadSerializer
     permission_classes = [IsAuthenticated]
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['first_name', 'last_name', 'company', 'email', 'phone', 'mobile']
     ordering_fields = ['first_name', 'last_name', 'created_at', 'lead_status']
+    bulk_edit_entity = 'leads'
+    select_related_fields = ('industry', 'assigned_to')
     
     def get_queryset(self):
         """Return leads visible to the requesting user.
@@ -463,33 +613,24 @@ class LeadViewSet(viewsets.ModelViewSet):
         • Regular user       → leads assigned to or created by them.
         Un-assigned leads are only visible to staff.
         """
-        from django.db.models import Q as models_Q
-        user = self.request.user
-
-        # Staff / superusers see everything
-        if user.is_staff or user.is_superuser:
-            return Lead.objects.all()
-
-        # Determine if user is a manager (based on optional user.profile.role)
-        is_manager = False
-        if hasattr(user, 'profile') and user.profile and user.profile.role:
-            is_manager = user.profile.role.lower() == 'manager'
-
-        if is_manager:
-            # Fetch IDs of users managed by this manager (assuming manager_username linkage)
-            managed_user_ids = User.objects.filter(profile__manager_username=user.username).values_list('id', flat=True)
-            return Lead.objects.filter(
-                models_Q(assigned_to=user) |
-                models_Q(created_by=user) |
-                models_Q(assigned_to__id__in=managed_user_ids) |
-                models_Q(created_by__id__in=managed_user_ids)
-            ).distinct()
-
-        # Regular user – only their own leads (assigned or created)
-        return Lead.objects.filter(models_Q(assigned_to=user) | models_Q(created_by=user))
+        return Lead.objects.visible_to(self.request.user)
     
-    def perform_create(self, serializer):
-        serializer.save(created_by=self.request.user)
+    def create(self, request, *args, **kwargs):
+        """
+        In upsert mode a lead whose email/phone is known is merged into the
+        existing one (see dedup.py) if the requester can see it; a match on
+        someone else's lead is a 409
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            lead, created = dedup.ingest(serializer, user=request.user, created_by=request.user)
+        except dedup.DuplicateLead:
+            return Response({'error': 'A lead with this email or phone number already exists'},
+                            status=status.HTTP_409_CONFLICT)
+        if created:
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response({**self.get_serializer(lead).data, 'merged': True}, status=status.HTTP_200_OK)
     
     @action(detail=True, methods=['post'])
     def convert(self, request, pk=None):
@@ -576,64 +717,90 @@ class LeadViewSet(viewsets.ModelViewSet):
             'deal': DealSerializer(deal).data if deal else None
         })
     
+    @action(detail=False, methods=['post'])
+    def bulk_convert(self, request):
+        """
+        Convert many leads in one transaction (see conversion.py). Send either
+        {"leads": [{"id": 1, "account": {"id": 5}, "deal": {...}}, ...]} or
+        {"ids": [1, 2, 3], "deal": {...}} to apply the same deal options to all.
+        """
+        items = request.data.get('leads')
+        if items is None:
+            shared = {key: request.data[key] for key in ('account', 'deal') if key in request.data}
+            items = [{'id': pk, **shared} for pk in request.data.get('ids') or []]
+        if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+            return Response({'error': 'Send "ids" or a list of "leads"'}, status=status.HTTP_400_BAD_REQUEST)
+        if not items:
+            return Response({'error': 'No leads selected'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > conversion.MAX_BULK_CONVERT:
+            return Response({'error': f'At most {conversion.MAX_BULK_CONVERT} leads per request'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        
+        # Ids may arrive as strings from form-encoded clients
+        for item in items:
+            account = item.get('account')
+            account_id = account.get('id') if isinstance(account, dict) else account
+            item['account'] = {'id': account_id} if account_id not in (None, '') else None
+            for holder, key in ((item, 'id'), (item['account'], 'id')):
+                if holder is not None and str(holder.get(key)).isdigit():
+                    holder[key] = int(holder[key])
+            if not isinstance(item.get('deal'), (dict, type(None))):
+                item['deal'] = None
+        
+        try:
+            results = conversion.convert_leads(request.user, items)
+        except conversion.ConcurrentInsert:
+            return Response({'error': 'Other records were created at the same time; please retry'},
+                            status=status.HTTP_409_CONFLICT)
+        converted = sum(1 for result in results if result['status'] == 'converted')
+        return Response({'converted': converted, 'failed': len(results) - converted, 'results': results})
+    
     @action(detail=True, methods=['get'])
     def tasks(self, request, pk=None):
         lead = self.get_object()
-        tasks = Task.objects.filter(related_lead=lead)
+        tasks = TaskViewSet.with_profile(Task.objects.filter(related_lead=lead))
         serializer = TaskSerializer(tasks, many=True)
         return Response(serializer.data)
     
     @action(detail=True, methods=['get'])
     def notes(self, request, pk=None):
         lead = self.get_object()
-        notes = Note.objects.filter(related_lead=lead)
+        notes = NoteViewSet.with_profile(Note.objects.filter(related_lead=lead))
         serializer = NoteSerializer(notes, many=True)
         return Response(serializer.data)
     
     @action(detail=True, methods=['get'])
     def documents(self, request, pk=None):
         lead = self.get_object()
-        documents = Document.objects.filter(related_lead=lead)
+        documents = DocumentViewSet.with_profile(Document.objects.filter(related_lead=lead))
         serializer = DocumentSerializer(documents, many=True, context={'request': request})
         return Response(serializer.data)
 
-class DealViewSet(viewsets.ModelViewSet):
+class DealViewSet(BulkEditMixin, PrefetchProfileMixin, viewsets.ModelViewSet):
     queryset = Deal.objects.all()
     serializer_class = DealSerializer
     permission_classes = [IsAuthenticated]
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['name', 'description']
     ordering_fields = ['name', 'created_at', 'amount', 'closing_date', 'stage', 'probability']
+    bulk_edit_entity = 'deals'
+    select_related_fields = ('account', 'assigned_to')
+    prefetch_related_fields = (Prefetch('contacts', queryset=Contact.objects.only('id')),)
+    # A correlated COUNT keeps the page query (and the paginator's COUNT) free of GROUP BY
+    annotations = {
+        'contacts_count': Coalesce(Subquery(
+            Deal.contacts.through.objects.filter(deal_id=OuterRef('pk'))
+            .order_by().values('deal_id').annotate(total=Count('*')).values('total')
+        ), 0),
+    }
 
     def get_queryset(self):
         """Return deals visible to the requesting user with optional ?manager=username filter."""
-        from django.db.models import Q as models_Q
-        from django.contrib.auth.models import User
-        user = self.request.user
-
-        base_qs = Deal.objects.all()
+        base_qs = Deal.objects.visible_to(self.request.user)
         manager_username_param = self.request.query_params.get('manager')
         if manager_username_param:
             base_qs = base_qs.filter(account__manager_username=manager_username_param)
-
-        if user.is_staff or user.is_superuser:
-            return base_qs
-
-        is_manager = False
-        if hasattr(user, 'profile') and user.profile and user.profile.role:
-            is_manager = user.profile.role.lower() == 'manager'
-
-        if is_manager:
-            managed_user_ids = User.objects.filter(profile__manager_username=user.username).values_list('id', flat=True)
-            return base_qs.filter(
-                models_Q(assigned_to=user) |
-                models_Q(created_by=user) |
-                models_Q(account__manager_username=user.username) |
-                models_Q(assigned_to__id__in=managed_user_ids) |
-                models_Q(created_by__id__in=managed_user_ids)
-            ).distinct()
-
-        return base_qs.filter(models_Q(assigned_to=user) | models_Q(created_by=user))
+        return base_qs
 
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
@@ -641,7 +808,7 @@ class DealViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def contacts(self, request, pk=None):
         deal = self.get_object()
-        contacts = deal.contacts.all()
+        contacts = ContactViewSet.with_profile(deal.contacts.all())
         serializer = ContactSerializer(contacts, many=True)
         return Response(serializer.data)
     
@@ -676,7 +843,7 @@ class DealViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def products(self, request, pk=None):
         deal = self.get_object()
-        products = DealProduct.objects.filter(deal=deal)
+        products = DealProductViewSet.with_profile(DealProduct.objects.filter(deal=deal))
         serializer = DealProductSerializer(products, many=True)
         return Response(serializer.data)
     
@@ -711,38 +878,41 @@ class DealViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def tasks(self, request, pk=None):
         deal = self.get_object()
-        tasks = Task.objects.filter(related_deal=deal)
+        tasks = TaskViewSet.with_profile(Task.objects.filter(related_deal=deal))
         serializer = TaskSerializer(tasks, many=True)
         return Response(serializer.data)
     
     @action(detail=True, methods=['get'])
     def notes(self, request, pk=None):
         deal = self.get_object()
-        notes = Note.objects.filter(related_deal=deal)
+        notes = NoteViewSet.with_profile(Note.objects.filter(related_deal=deal))
         serializer = NoteSerializer(notes, many=True)
         return Response(serializer.data)
     
     @action(detail=True, methods=['get'])
     def documents(self, request, pk=None):
         deal = self.get_object()
-        documents = Document.objects.filter(related_deal=deal)
+        documents = DocumentViewSet.with_profile(Document.objects.filter(related_deal=deal))
         serializer = DocumentSerializer(documents, many=True, context={'request': request})
         return Response(serializer.data)
     
     @action(detail=True, methods=['get'])
     def transactions(self, request, pk=None):
         deal = self.get_object()
-        transactions = Transaction.objects.filter(deal=deal)
+        transactions = TransactionViewSet.with_profile(Transaction.objects.filter(deal=deal))
         serializer = TransactionSerializer(transactions, many=True)
         return Response(serializer.data)
 
-class TaskViewSet(viewsets.ModelViewSet):
+class TaskViewSet(BulkEditMixin, PrefetchProfileMixin, viewsets.ModelViewSet):
     queryset = Task.objects.all()
     serializer_class = TaskSerializer
+    read_serializer_class = TaskReadSerializer
     permission_classes = [IsAuthenticated]
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['subject', 'description']
     ordering_fields = ['subject', 'due_date', 'status', 'priority', 'created_at']
+    bulk_edit_entity = 'tasks'
+    select_related_fields = ('assigned_to',) + RELATED_TO_FIELDS
     
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
@@ -764,29 +934,7 @@ class TaskViewSet(viewsets.ModelViewSet):
         • Regular user → tasks assigned to or created by them.
         Supports same filter query-params as before.
         """
-        from django.db.models import Q as models_Q
-        user = self.request.user
-
-        # Determine role
-        is_staff = user.is_staff or user.is_superuser
-        is_manager = False
-        if hasattr(user, 'profile') and user.profile and user.profile.role:
-            is_manager = user.profile.role.lower() == 'manager'
-
-        if is_staff:
-            queryset = Task.objects.all()
-        elif is_manager:
-            manager_username = user.username
-            managed_user_ids = User.objects.filter(profile__manager_username=manager_username).values_list('id', flat=True)
-            queryset = Task.objects.filter(
-                models_Q(manager_username=manager_username) |
-                models_Q(assigned_to__id__in=managed_user_ids) |
-                models_Q(created_by_id__in=managed_user_ids) |
-                models_Q(assigned_to=user) |
-                models_Q(created_by=user)
-            ).distinct()
-        else:
-            queryset = Task.objects.filter(models_Q(assigned_to=user) | models_Q(created_by=user))
+        queryset = Task.objects.visible_to(self.request.user)
 
         # Get filter parameters
         status_param = self.request.query_params.get('status')
@@ -831,13 +979,15 @@ class TaskViewSet(viewsets.ModelViewSet):
         
         return queryset
 
-class EventViewSet(viewsets.ModelViewSet):
+class EventViewSet(PrefetchProfileMixin, viewsets.ModelViewSet):
     queryset = Event.objects.all()
     serializer_class = EventSerializer
     permission_classes = [IsAuthenticated]
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['title', 'description', 'location']
     ordering_fields = ['title', 'start_time', 'end_time', 'created_at']
+    select_related_fields = ('created_by',) + RELATED_TO_FIELDS
+    prefetch_related_fields = ('attendees',)
     
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
@@ -884,24 +1034,26 @@ class EventViewSet(viewsets.ModelViewSet):
         
         return queryset
 
-class NoteViewSet(viewsets.ModelViewSet):
+class NoteViewSet(PrefetchProfileMixin, viewsets.ModelViewSet):
     queryset = Note.objects.all()
     serializer_class = NoteSerializer
     permission_classes = [IsAuthenticated]
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['subject', 'content']
     ordering_fields = ['subject', 'created_at']
+    select_related_fields = ('created_by',) + RELATED_TO_FIELDS
     
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
 
-class DocumentViewSet(viewsets.ModelViewSet):
+class DocumentViewSet(PrefetchProfileMixin, viewsets.ModelViewSet):
     queryset = Document.objects.all()
     serializer_class = DocumentSerializer
     permission_classes = [IsAuthenticated]
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['title', 'description']
     ordering_fields = ['title', 'created_at']
+    select_related_fields = ('created_by',) + RELATED_TO_FIELDS
     
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
@@ -911,13 +1063,15 @@ class DocumentViewSet(viewsets.ModelViewSet):
         context.update({'request': self.request})
         return context
 
-class TransactionViewSet(viewsets.ModelViewSet):
+class TransactionViewSet(PrefetchProfileMixin, viewsets.ModelViewSet):
     queryset = Transaction.objects.all()
     serializer_class = TransactionSerializer
+    read_serializer_class = TransactionReadSerializer
     permission_classes = [IsAuthenticated]
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['reference_number', 'description']
     ordering_fields = ['date', 'due_date', 'amount', 'status', 'created_at']
+    select_related_fields = ('account', 'deal')
     
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
@@ -960,12 +1114,13 @@ class ProductViewSet(viewsets.ModelViewSet):
         
         return queryset
 
-class DealProductViewSet(viewsets.ModelViewSet):
+class DealProductViewSet(PrefetchProfileMixin, viewsets.ModelViewSet):
     queryset = DealProduct.objects.all()
     serializer_class = DealProductSerializer
     permission_classes = [IsAuthenticated]
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     ordering_fields = ['deal__name', 'product__name', 'quantity', 'unit_price', 'total_price']
+    select_related_fields = ('product', 'deal')
     
     def get_queryset(self):
         queryset = DealProduct.objects.all()
@@ -1048,13 +1203,17 @@ def leads_page(request):
     q_unassigned_criteria = Q(assigned_to__isnull=True)
     
     # Managerial visibility for unassigned leads includes:
-    # a) Leads where Lead.manager_username is the current user's username (current user is the direct manager for these leads)
-    q_managerial_scope_for_unassigned = Q(manager_username=request.user.username)
+    # a) Leads whose manager is the current user (current user is the direct manager for these leads)
+    q_managerial_scope_for_unassigned = Q(manager_id=request.user.id)
     logger.info(f" - Including unassigned leads where Lead.manager_username is: '{request.user.username}' (current user)")
 
-    # b) Leads where Lead.manager_username is the current user's manager (from UserProfile)
+    # b) Leads whose manager is the current user's manager (from UserProfile)
     if user_manager_username and user_manager_username != request.user.username:
-        q_managerial_scope_for_unassigned |= Q(manager_username=user_manager_username)
+        if user_profile.manager_id:
+            q_managerial_scope_for_unassigned |= Q(manager_id=user_profile.manager_id)
+        else:
+            # manager_username does not match a user; fall back to the string
+            q_managerial_scope_for_unassigned |= Q(manager_username=user_manager_username)
         logger.info(f" - Including unassigned leads where Lead.manager_username is: '{user_manager_username}' (current user's manager)")
     elif not user_manager_username:
         logger.info(" - Current user has no manager specified in UserProfile, so manager's scope for unassigned leads is not applied.")
@@ -1067,7 +1226,7 @@ def leads_page(request):
     logger.info(f"Final query structure: (Assigned to '{request.user.username}') OR (IsUnassigned AND (LeadManager='{request.user.username}' OR LeadManager='{user_manager_username if user_manager_username else 'N/A'}'))")
 
     # Query for leads
-    leads = Lead.objects.filter(final_query).distinct()
+    leads = Lead.objects.filter(final_query)
     
     # Log the initial query results
     logger.info(f"Initial query count: {leads.count()}")
@@ -1719,43 +1878,27 @@ def transaction_page(request):
 def allot_lead_manager(request):
     """
     API endpoint to create a new lead and automatically assign a manager based on the country.
+
+    A new lead is returned serialized, as before. The endpoint is public, so
+    a repeat submission merged into an existing lead gets a 201 without the
+    lead's data or id: the caller doesn't learn what the CRM holds on it.
     """
     # Validate the incoming data using the LeadSerializer
     serializer = LeadSerializer(data=request.data)
     if serializer.is_valid():
-        # Get the country from the request data (from address or explicitly provided)
-        country = request.data.get('country')
-        
-        # If country is not provided, try to extract it from the address
-        if not country and 'address' in request.data and request.data['address']:
-            # This is a simple approach - in a real application, you might use a geocoding service
-            # to extract the country from the address
-            address = request.data['address']
-            # For now, we'll just check if any country name appears in the address
-            # In a real app, you'd use a more sophisticated approach
-            try:
-                # Try to find a matching country in the AllotManager table
-                allot_managers = AllotManager.objects.all()
-                for manager in allot_managers:
-                    country_name = dict(AllotManager.COUNTRIES).get(manager.country)
-                    if country_name and country_name.lower() in address.lower():
-                        country = manager.country
-                        break
-            except Exception as e:
-                print(f"Error extracting country from address: {e}")
-        
-        if country:
-            try:
-                # Look up the manager for this country
-                manager = AllotManager.objects.filter(country=country).first()
-                if manager and manager.manager_username:
-                    # Set the manager_username in the lead data
-                    serializer.validated_data['manager_username'] = manager.manager_username
-            except Exception as e:
-                print(f"Error finding manager for country {country}: {e}")
-        
-        # Save the lead with the assigned manager (if any)
-        lead = serializer.save()
+        # Route on the explicit country (code or name), else on the address.
+        # The compiled routing table is kept per process; this costs one version check.
+        _country, manager_username = routing.get_router().manager_for(
+            request.data.get('country'), request.data.get('address')
+        )
+        if manager_username:
+            serializer.validated_data['manager_username'] = manager_username
+        
+        # Save the lead with the assigned manager (if any); a repeat
+        # submission is merged into the lead it duplicates
+        lead, created = dedup.ingest(serializer)
+        if not created:
+            return Response({'detail': 'Lead received'}, status=status.HTTP_201_CREATED)
         
         # Return the created lead with status 201
         return Response(LeadSerializer(lead).data, status=status.HTTP_201_CREATED)
@@ -59,6 +59,89 @@ async function apiRequest(endpoint, method = 'GET', data = null) {
     }
 }
 
+// Turn a `next` link from a list response back into an apiRequest() endpoint
+function apiEndpoint(link) {
+    const url = new URL(link, window.location.origin);
+    return url.pathname.slice(API_BASE_URL.length) + url.search;
+}
+
+// Page through a list endpoint with the keyset cursor (?cursor=), one
+// request per page. onPage(rows, first) is called as each page arrives, so
+// the first rows render without waiting for the rest of the list.
+// pager.more() fetches the next page and resolves to whether another one is
+// left; pager.follow(element) loads it whenever the end of element scrolls
+// into view; pager.stop() drops the pages still in flight (call it before
+// loading the list again). Options: pageSize, and request for pages that
+// authenticate differently than apiRequest().
+function apiPager(endpoint, onPage, options = {}) {
+    const request = options.request || apiRequest;
+    const separator = endpoint.includes('?') ? '&' : '?';
+    let next = `${endpoint}${separator}cursor=&page_size=${options.pageSize || 50}`;
+    let first = true;
+    let pending = null;
+    let stopped = false;
+    let observer = null;
+
+    const pager = {
+        get hasMore() {
+            return next !== null && !stopped;
+        },
+
+        more() {
+            if (!pending) {
+                pending = (async () => {
+                    if (!pager.hasMore) return false;
+                    const data = await request(next);
+                    if (stopped) return false;
+                    if (!data) {
+                        // apiRequest has already reported the error
+                        next = null;
+                        return false;
+                    }
+                    const rows = Array.isArray(data) ? data : (data.results || []);
+                    next = !Array.isArray(data) && data.next ? apiEndpoint(data.next) : null;
+                    onPage(rows, first);
+                    first = false;
+                    return pager.hasMore;
+                })().finally(() => { pending = null; });
+            }
+            return pending;
+        },
+
+        follow(element) {
+            let sentinel = element.nextElementSibling;
+            if (!sentinel || !sentinel.classList.contains('api-pager-sentinel')) {
+                sentinel = document.createElement('div');
+                sentinel.className = 'api-pager-sentinel';
+                element.after(sentinel);
+            }
+            const visible = () => sentinel.getBoundingClientRect().top < window.innerHeight;
+            observer = new IntersectionObserver(async entries => {
+                if (!entries.some(entry => entry.isIntersecting)) return;
+                // A page can render no rows (client-side filters), so keep
+                // going while the end of the list is still on screen
+                while (await pager.more() && visible()) {}
+                if (!pager.hasMore) observer.disconnect();
+            });
+            observer.observe(sentinel);
+            return pager;
+        },
+
+        stop() {
+            stopped = true;
+            if (observer) observer.disconnect();
+        },
+    };
+    return pager;
+}
+
+// Read every page of a short list (dropdown options, one calendar range),
+// rendering each page as it arrives
+async function apiEachPage(endpoint, onPage, options = {}) {
+    const pager = apiPager(endpoint, onPage, Object.assign({ pageSize: 100 }, options));
+    while (await pager.more()) {}
+}
+
 async function processResponse(response) {
     const contentType = response.headers.get('content-type');
     if (contentType && contentType.includes('application/json')) {
@@ -271,212 +354,22 @@ async function loadDashboardData() {
     // Get dashboard data filtering by manager_username
     const dashboardData = await apiRequest(`dashboard/?manager_username=${userProfile.manager_username}`);
     
-    // Get all data separately to apply filtering
-    const leadsData = await apiRequest(`leads/?manager_username=${userProfile.manager_username}`);
-    const contactsData = await apiRequest(`contacts/?manager_username=${userProfile.manager_username}`);
-    const accountsData = await apiRequest(`accounts/?manager_username=${userProfile.manager_username}`);
-    const dealsData = await apiRequest(`deals/?manager_username=${userProfile.manager_username}`);
-    const tasksData = await apiRequest(`tasks/?manager_username=${userProfile.manager_username}`);
-    
-    // Update dashboard stats with accurate counts based on filtering
-    // First strictly filter by matching manager_username, then filter by assignment
-    
-    // Filter and count leads
-    let filteredLeads = [];
-    if (leadsData && leadsData.results) {
-        // First strictly filter by matching manager_username
-        const managerLeads = leadsData.results.filter(lead => 
-            lead.manager_username === userProfile.manager_username
-        );
-        // Then filter by assignment
-        filteredLeads = managerLeads.filter(lead => 
-            !lead.assigned_to || 
-            lead.assigned_to === currentUser.id || 
-            (lead.assigned_to && lead.assigned_to.id === currentUser.id)
-        );
-    } else if (leadsData && Array.isArray(leadsData)) {
-        // First strictly filter by matching manager_username
-        const managerLeads = leadsData.filter(lead => 
-            lead.manager_username === userProfile.manager_username
-        );
-        // Then filter by assignment
-        filteredLeads = managerLeads.filter(lead => 
-            !lead.assigned_to || 
-            lead.assigned_to === currentUser.id || 
-            (lead.assigned_to && lead.assigned_to.id === currentUser.id)
-        );
-    }
-    document.getElementById('leads-count').textContent = filteredLeads.length;
-    
-    // Filter and count contacts
-    let filteredContacts = [];
-    if (contactsData && contactsData.results) {
-        // First strictly filter by matching manager_username
-        const managerContacts = contactsData.results.filter(contact => 
-            contact.manager_username === userProfile.manager_username
-        );
-        // Then filter by assignment
-        filteredContacts = managerContacts.filter(contact => 
-            !contact.assigned_to || 
-            contact.assigned_to === currentUser.id || 
-            (contact.assigned_to && contact.assigned_to.id === currentUser.id)
-        );
-    } else if (contactsData && Array.isArray(contactsData)) {
-        // First strictly filter by matching manager_username
-        const managerContacts = contactsData.filter(contact => 
-            contact.manager_username === userProfile.manager_username
-        );
-        // Then filter by assignment
-        filteredContacts = managerContacts.filter(contact => 
-            !contact.assigned_to || 
-            contact.assigned_to === currentUser.id || 
-            (contact.assigned_to && contact.assigned_to.id === currentUser.id)
-        );
-    }
-    document.getElementById('contacts-count').textContent = filteredContacts.length;
-    
-    // Filter and count accounts
-    let filteredAccounts = [];
-    if (accountsData && accountsData.results) {
-        // First strictly filter by matching manager_username
-        const managerAccounts = accountsData.results.filter(account => 
-            account.manager_username === userProfile.manager_username
-        );
-        // Then filter by assignment
-        filteredAccounts = managerAccounts.filter(account => 
-            !account.assigned_to || 
-            account.assigned_to === currentUser.id || 
-            (account.assigned_to && account.assigned_to.id === currentUser.id)
-        );
-    } else if (accountsData && Array.isArray(accountsData)) {
-        // First strictly filter by matching manager_username
-        const managerAccounts = accountsData.filter(account => 
-            account.manager_username === userProfile.manager_username
-        );
-        // Then filter by assignment
-        filteredAccounts = managerAccounts.filter(account => 
-            !account.assigned_to || 
-            account.assigned_to === currentUser.id || 
-            (account.assigned_to && account.assigned_to.id === currentUser.id)
-        );
-    }
-    document.getElementById('accounts-count').textContent = filteredAccounts.length;
-    
-    // Filter and count deals
-    let filteredDeals = [];
-    if (dealsData && dealsData.results) {
-        // First strictly filter by matching manager_username
-        const managerDeals = dealsData.results.filter(deal => 
-            deal.manager_username === userProfile.manager_username
-        );
-        // Then filter by assignment
-        filteredDeals = managerDeals.filter(deal => 
-            !deal.assigned_to || 
-            deal.assigned_to === currentUser.id || 
-            (deal.assigned_to && deal.assigned_to.id === currentUser.id)
-        );
-    } else if (dealsData && Array.isArray(dealsData)) {
-        // First strictly filter by matching manager_username
-        const managerDeals = dealsData.filter(deal => 
-            deal.manager_username === userProfile.manager_username
-        );
-        // Then filter by assignment
-        filteredDeals = managerDeals.filter(deal => 
-            !deal.assigned_to || 
-            deal.assigned_to === currentUser.id || 
-            (deal.assigned_to && deal.assigned_to.id === currentUser.id)
-        );
-    }
-    document.getElementById('deals-count').textContent = filteredDeals.length;
+    // Row counts for the cards, computed by the server over the rows under
+    // this manager that are assigned to the current user (or unassigned)
+    const counts = (dashboardData && dashboardData.scope_counts) || {};
+    document.getElementById('leads-count').textContent = counts.leads || 0;
+    document.getElementById('contacts-count').textContent = counts.contacts || 0;
+    document.getElementById('accounts-count').textContent = counts.accounts || 0;
+    document.getElementById('deals-count').textContent = counts.deals || 0;
     
-    // Use the filtered data and dashboardData for populating the dashboard components
+    // The 5 most recent leads and deals, from the same server-side scope
+    populateRecentLeads((dashboardData && dashboardData.recent_leads) || []);
+    populateRecentDeals((dashboardData && dashboardData.recent_deals) || []);
     
-    // For recent leads, use the filtered leads directly if dashboardData.recent_leads is empty
-    let recentLeads = [];
-    if (dashboardData && dashboardData.recent_leads && dashboardData.recent_leads.length > 0) {
-        // First strictly filter by matching manager_username
-        const managerRecentLeads = dashboardData.recent_leads.filter(lead => 
-            lead.manager_username === userProfile.manager_username
-        );
-        // Then filter by assignment
-        recentLeads = managerRecentLeads.filter(lead => 
-            !lead.assigned_to || 
-            lead.assigned_to === currentUser.id || 
-            (lead.assigned_to && lead.assigned_to.id === currentUser.id)
-        );
-    } else {
-        // Use the filtered leads if dashboardData doesn't have recent_leads
-        recentLeads = filteredLeads;
-    }
-    
-    // Sort by date (assuming there's a created_date or similar field)
-    recentLeads.sort((a, b) => {
-        const dateA = new Date(a.created_at || a.date || 0);
-        const dateB = new Date(b.created_at || b.date || 0);
-        return dateB - dateA; // Descending (newest first)
-    });
-    
-    // Take only the 5 most recent leads
-    recentLeads = recentLeads.slice(0, 5);
-    populateRecentLeads(recentLeads);
-    
-    // For recent deals
-    let recentDeals = [];
-    if (dashboardData && dashboardData.recent_deals && dashboardData.recent_deals.length > 0) {
-        // First strictly filter by matching manager_username
-        const managerRecentDeals = dashboardData.recent_deals.filter(deal => 
-            deal.manager_username === userProfile.manager_username
-        );
-        // Then filter by assignment
-        recentDeals = managerRecentDeals.filter(deal => 
-            !deal.assigned_to || 
-            deal.assigned_to === currentUser.id || 
-            (deal.assigned_to && deal.assigned_to.id === currentUser.id)
-        );
-    } else {
-        // Use filtered deals if dashboardData doesn't have recent_deals
-        recentDeals = filteredDeals;
-    }
-    populateRecentDeals(recentDeals);
-    
-    // For upcoming tasks, use tasksData directly
-    let upcomingTasks = [];
-    if (tasksData && tasksData.results) {
-        // First strictly filter by matching manager_username
-        const managerTasks = tasksData.results.filter(task => 
-            task.manager_username === userProfile.manager_username
-        );
-        // Then filter by assignment - show all tasks assigned to the current user
-        upcomingTasks = managerTasks.filter(task => 
-            task.assigned_to === currentUser.username || 
-            task.assigned_to === currentUser.id || 
-            (task.assigned_to && task.assigned_to.id === currentUser.id)
-        );
-        // Sort by due date
-        upcomingTasks.sort((a, b) => {
-            const dateA = new Date(a.due_date || 0);
-            const dateB = new Date(b.due_date || 0);
-            return dateA - dateB; // Ascending (closest due date first)
-        });
-    } else if (dashboardData && dashboardData.upcoming_tasks) {
-        // Fall back to dashboard data if direct task fetch fails
-        const managerUpcomingTasks = dashboardData.upcoming_tasks.filter(task => 
-            task.manager_username === userProfile.manager_username
-        );
-        // Show all tasks assigned to the current user
-        upcomingTasks = managerUpcomingTasks.filter(task => 
-            task.assigned_to === currentUser.username || 
-            task.assigned_to === currentUser.id || 
-            (task.assigned_to && task.assigned_to.id === currentUser.id)
-        );
-        // Sort by due date
-        upcomingTasks.sort((a, b) => {
-            const dateA = new Date(a.due_date || 0);
-            const dateB = new Date(b.due_date || 0);
-            return dateA - dateB; // Ascending (closest due date first)
-        });
-    }
-    populateUpcomingTasks(upcomingTasks);
+    // The dashboard's upcoming tasks are the current user's, soonest first
+    populateUpcomingTasks(((dashboardData && dashboardData.upcoming_tasks) || []).filter(task =>
+        task.manager_username === userProfile.manager_username
+    ));
 }
 
 function initTransaction() {